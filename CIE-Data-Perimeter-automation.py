@@ -1,12 +1,12 @@
-import boto3
 import json
 import csv
 from rich.progress import Progress
 from tqdm import tqdm
 from rich import print
+from aws_clients import client
 
 def add_trust_relationship(role_name, trust_policy):
-    iam_client = boto3.client('iam')
+    iam_client = client('iam')
     
     # Update the role's trust relationship policy
     try:
@@ -19,7 +19,7 @@ def add_trust_relationship(role_name, trust_policy):
         return False
 
 def add_trust_relationship_to_all_roles(trust_policy):
-    iam_client = boto3.client('iam')
+    iam_client = client('iam')
     
     # Get a list of all IAM roles
     roles = iam_client.list_roles()['Roles']
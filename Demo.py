@@ -1,48 +1,58 @@
-import boto3
-import json
-import csv
+import argparse
 from rich.progress import Progress
 from rich.table import Table
 from rich import print
 from rich.console import Console
 from time import time
+from aws_clients import client
+from circuit_breaker import AccountCircuitBreaker, last_error_code
+from org_index import add_ou_arguments, filter_rows, load_index, load_prefilter
+from phase_profiler import add_profile_arguments, profiler
+from policy_merge import merge_statement
+from role_reader import iter_roles, prefetch
+from role_records import Outcome, RoleRecord, to_rows
+from sinks import UPDATE_RESULT_FIELDS, UPDATE_RESULT_SCHEMA, write_rows
 
-def assume_role(account_id, role_name):
-    sts_client = boto3.client('sts')
+def assume_role(account_id, role_name, errors=None):
+    sts_client = client('sts')
     role_arn = f"arn:aws:iam::{account_id}:role/{role_name}"
     try:
-        assumed_role = sts_client.assume_role(
-            RoleArn=role_arn,
-            RoleSessionName="AssumeRoleSession"
-        )
+        with profiler.phase('sts'):
+            assumed_role = sts_client.assume_role(
+                RoleArn=role_arn,
+                RoleSessionName="AssumeRoleSession"
+            )
         return assumed_role['Credentials']
     except sts_client.exceptions.ClientError as e:
         print(f"[bold red]Failed to assume role {role_name} in account {account_id}: {str(e)}[/bold red]")
+        if errors is not None:
+            errors.append(e)
         return None
 
 def update_trust_policy(iam_client, role_name, new_trust_policy_statement):
     try:
-        current_policy = iam_client.get_role(RoleName=role_name)['Role']['AssumeRolePolicyDocument']
+        with profiler.phase('get_role'):
+            current_policy = iam_client.get_role(RoleName=role_name)['Role']['AssumeRolePolicyDocument']
     except iam_client.exceptions.NoSuchEntityException:
         return False
 
-    if new_trust_policy_statement not in current_policy['Statement']:
-        current_policy['Statement'].append(new_trust_policy_statement)
+    with profiler.phase('merge'):
+        needs_update, policy_document = merge_statement(current_policy, new_trust_policy_statement)
+    if needs_update:
         try:
-            iam_client.update_assume_role_policy(
-                RoleName=role_name,
-                PolicyDocument=json.dumps(current_policy)
-            )
+            with profiler.phase('update_role'):
+                iam_client.update_assume_role_policy(
+                    RoleName=role_name,
+                    PolicyDocument=policy_document
+                )
             return True
         except iam_client.exceptions.UnmodifiableEntityException:
             return False
     else:
         return True
 
-def process_roles_from_csv(file_path, new_trust_policy_statement):
-    with open(file_path, mode='r') as file:
-        csv_reader = csv.DictReader(file)
-        rows = list(csv_reader)
+def process_roles_from_csv(file_path, new_trust_policy_statement, output_file='trust_policy_update_results.csv', ous=(), prefilter=None):
+    rows = prefetch(profiler.timed('read_input', filter_rows(iter_roles(file_path), ous)))
 
     table = Table(title="Trust Policy Update Results")
     table.add_column("Account ID")
@@ -50,46 +60,67 @@ def process_roles_from_csv(file_path, new_trust_policy_statement):
     table.add_column("Trust Policy Updated", style="cyan")
     
     results = []
+    circuit_breaker = AccountCircuitBreaker()
     
-    with Progress() as progress:
-        task = progress.add_task("[cyan]Processing...", total=len(rows))
+    with Progress() as progress, profiler.sampling():
+        task = progress.add_task("[cyan]Processing...", total=None)
         
         for row in rows:
             account_id = row['AccountID']
             role_name = row['RoleName']
             
-            credentials = assume_role(account_id, role_name)
+            # Suspended, closed or non-member accounts are settled without an STS call
+            skip_outcome = prefilter.outcome(account_id) if prefilter else None
+            if skip_outcome is not None:
+                record = RoleRecord(account_id, role_name, skip_outcome)
+                results.append(record)
+                table.add_row(account_id, role_name, record.outcome.label)
+                progress.update(task, advance=1)
+                continue
+            
+            if not circuit_breaker.allow(account_id):
+                record = RoleRecord(account_id, role_name, Outcome.CIRCUIT_OPEN)
+                results.append(record)
+                table.add_row(account_id, role_name, record.outcome.label)
+                progress.update(task, advance=1)
+                continue
+            
+            errors = []
+            credentials = assume_role(account_id, role_name, errors)
             if not credentials:
-                result = {'AccountID': account_id, 'RoleName': role_name, 'TrustPolicyUpdated': 'Failed to Assume Role'}
-                results.append(result)
-                table.add_row(account_id, role_name, result['TrustPolicyUpdated'])
+                circuit_breaker.record_failure(account_id, last_error_code(errors))
+                record = RoleRecord(account_id, role_name, Outcome.ASSUME_ROLE_FAILED)
+                results.append(record)
+                table.add_row(account_id, role_name, record.outcome.label)
                 progress.update(task, advance=1)
                 continue
+            circuit_breaker.record_success(account_id)
             
-            iam_client = boto3.client(
-                'iam',
-                aws_access_key_id=credentials['AccessKeyId'],
-                aws_secret_access_key=credentials['SecretAccessKey'],
-                aws_session_token=credentials['SessionToken']
-            )
+            with profiler.phase('client'):
+                iam_client = client(
+                    'iam',
+                    aws_access_key_id=credentials['AccessKeyId'],
+                    aws_secret_access_key=credentials['SecretAccessKey'],
+                    aws_session_token=credentials['SessionToken']
+                )
             
             if update_trust_policy(iam_client, role_name, new_trust_policy_statement):
-                result = {'AccountID': account_id, 'RoleName': role_name, 'TrustPolicyUpdated': 'True'}
+                record = RoleRecord(account_id, role_name, Outcome.UPDATED)
             else:
-                result = {'AccountID': account_id, 'RoleName': role_name, 'TrustPolicyUpdated': 'False'}
-            results.append(result)
-            table.add_row(account_id, role_name, result['TrustPolicyUpdated'])
-            progress.update(task, advance=1)
+                record = RoleRecord(account_id, role_name, Outcome.NOT_UPDATED)
+            results.append(record)
+            with profiler.phase('render'):
+                table.add_row(account_id, role_name, record.outcome.label)
+                progress.update(task, advance=1)
     
-    print(table)
+    with profiler.phase('render'):
+        print(table)
     
-    with open('trust_policy_update_results.csv', mode='w', newline='') as file:
-        writer = csv.DictWriter(file, fieldnames=['AccountID', 'RoleName', 'TrustPolicyUpdated'])
-        writer.writeheader()
-        writer.writerows(results)
+    with profiler.phase('write'):
+        write_rows(output_file, UPDATE_RESULT_FIELDS, to_rows(results), UPDATE_RESULT_SCHEMA)
     
     console = Console()
-    console.print("[bold bright_red]Output saved as trust_policy_update_results.csv[/bold bright_red]")
+    console.print(f"[bold bright_red]Output saved as {output_file}[/bold bright_red]")
 
 new_trust_policy_statement = {
     "Effect": "Deny",
@@ -111,12 +142,27 @@ new_trust_policy_statement = {
     }
 }
 
-start_time = time()
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Add the data perimeter Deny statement to the trust policy of the roles in input_roles.csv")
+    parser.add_argument('--output', default='trust_policy_update_results.csv', help="Results file to write, CSV, JSONL or Parquet (default: %(default)s)")
+    add_profile_arguments(parser)
+    add_ou_arguments(parser)
+    args = parser.parse_args()
+    profiler.enable_from_args(args)
+    if args.refresh_org_index:
+        load_index(refresh=True)
+    prefilter = load_prefilter(not args.no_account_prefilter)
 
-process_roles_from_csv('input_roles.csv', new_trust_policy_statement)
+    start_time = time()
 
-end_time = time()
-elapsed_time = end_time - start_time
+    process_roles_from_csv('input_roles.csv', new_trust_policy_statement, args.output, ous=args.ou, prefilter=prefilter)
+
+    end_time = time()
+    elapsed_time = end_time - start_time
+
+    console = Console()
+    console.print(f"[bold bright_red]Script completed in {elapsed_time:.2f} seconds[/bold bright_red]")
 
-console = Console()
-console.print(f"[bold bright_red]Script completed in {elapsed_time:.2f} seconds[/bold bright_red]")
+    report = profiler.write_report(args.output)
+    if report:
+        console.print(f"[bold bright_red]Phase report saved as {report}[/bold bright_red]")
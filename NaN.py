@@ -1,11 +1,12 @@
-import boto3
 import csv
 from rich.progress import Progress
 from rich.console import Console
+from aws_clients import client
+from stackset_resolver import resolve_stackset_roles
 
 # Initialize clients for IAM and CloudFormation
-iam_client = boto3.client('iam')
-cf_client = boto3.client('cloudformation')
+iam_client = client('iam')
+cf_client = client('cloudformation')
 
 console = Console()
 
@@ -29,24 +30,8 @@ def get_cloudformation_roles():
                         console.log(f"[cyan]Processing role from CloudFormation stack: {role_name}")
             progress.update(task, advance=1)
 
-    # Handle StackSets
-    stacksets = cf_client.list_stack_sets()['Summaries']
-    for stackset in stacksets:
-        stackset_name = stackset['StackSetName']
-        # Paginate through instances of each StackSet
-        instances_paginator = cf_client.get_paginator('list_stack_instances')
-        for page in instances_paginator.paginate(StackSetName=stackset_name):
-            for instance in page['Summaries']:
-                if 'StackId' in instance:
-                    stack_id = instance['StackId']
-                    stack_instance_resources = cf_client.list_stack_resources(StackName=stack_id)['StackResourceSummaries']
-                    for resource in stack_instance_resources:
-                        if resource['ResourceType'] == 'AWS::IAM::Role':
-                            role_name = resource['PhysicalResourceId']
-                            cf_roles[role_name] = (stackset_name, stack_id)
-                            console.log(f"[magenta]Processing role from CloudFormation StackSet: {role_name}")
-                else:
-                    console.log(f"[red]No StackId found for instance in StackSet: {stackset_name}")
+    # Resolve StackSet instances from inside their target accounts
+    cf_roles.update(resolve_stackset_roles(cf_client))
     return cf_roles
 
 def get_all_roles():
@@ -0,0 +1,141 @@
+import os
+import threading
+from itertools import chain
+from time import time
+from botocore.exceptions import BotoCoreError, ClientError
+from aws_clients import client
+from circuit_breaker import AccountCircuitBreaker
+from hum import AUDIT_FIELDS, audit_rows, get_all_roles, get_cloudformation_roles, iam_client
+from org_index import ACCOUNT_STATUS_FIELDS, ORG_INDEX_TTL, AccountPrefilter, account_status_rows, accounts_in_ous, load_index
+from role_enrichment import ENRICHMENT_FIELDS, RoleEnricher
+from role_filter import RoleFilter
+from scheduler import AccountScheduler
+from sinks import UPDATE_RESULT_FIELDS
+from xpl import assume_role, new_trust_policy_statement, process_role
+
+# Seconds before expiry at which cached assumed-role credentials are renewed
+CREDENTIAL_MARGIN = 300
+# How long the CloudFormation role inventory is reused between audit jobs, in seconds
+INVENTORY_TTL = int(os.environ.get('AWS_AUTOMATION_INVENTORY_TTL', '300'))
+
+class CredentialCache:
+    """IAM clients for assumed roles, reused until shortly before their credentials expire"""
+
+    def __init__(self, margin=CREDENTIAL_MARGIN):
+        self.margin = margin
+        self.lock = threading.Lock()
+        self.clients = {}
+
+    def iam_client(self, account_id, role_name, errors=None):
+        """Return an IAM client acting as the role, or None when it cannot be assumed"""
+        key = (account_id, role_name)
+        with self.lock:
+            entry = self.clients.get(key)
+        if entry is not None and entry[0] - self.margin > time():
+            return entry[1]
+        credentials = assume_role(account_id, role_name, errors)
+        if not credentials:
+            return None
+        iam = client(
+            'iam',
+            aws_access_key_id=credentials['AccessKeyId'],
+            aws_secret_access_key=credentials['SecretAccessKey'],
+            aws_session_token=credentials['SessionToken']
+        )
+        with self.lock:
+            self.clients[key] = (credentials['Expiration'].timestamp(), iam)
+        return iam
+
+class WarmState:
+    """Sessions, credentials and inventory kept across the jobs of one server process"""
+
+    def __init__(self):
+        self.credentials = CredentialCache()
+        self.index_lock = threading.Lock()
+        self.inventory_lock = threading.Lock()
+        self.org_index = None
+        self.cloudformation_roles = None
+        self.cloudformation_built_at = 0
+
+    def warm_up(self):
+        """Load service models and the org index before the first job arrives"""
+        for service_name in ('sts', 'iam', 'cloudformation', 'organizations'):
+            client(service_name)
+        try:
+            self.index()
+        except (BotoCoreError, ClientError):
+            # Member-account credentials cannot read Organizations; jobs run without it
+            pass
+
+    def index(self, refresh=False):
+        with self.index_lock:
+            if refresh or self.org_index is None or time() - self.org_index.built_at >= ORG_INDEX_TTL:
+                self.org_index = load_index(refresh=refresh)
+            return self.org_index
+
+    def stack_roles(self, refresh=False):
+        with self.inventory_lock:
+            if refresh or self.cloudformation_roles is None or time() - self.cloudformation_built_at >= INVENTORY_TTL:
+                self.cloudformation_roles = get_cloudformation_roles()
+                self.cloudformation_built_at = time()
+            return self.cloudformation_roles
+
+def trust_update(state, request):
+    """Add a statement (the data perimeter Deny by default) to the trust policy of the listed roles
+
+    Request: roles [{AccountID, RoleName}], optional statement, ou, prefilter.
+    """
+    statement = request.get('statement') or new_trust_policy_statement
+    rows = [{'AccountID': str(role['AccountID']), 'RoleName': role['RoleName']} for role in request.get('roles', [])]
+    skipped = []
+    if request.get('ou') or request.get('prefilter', True):
+        try:
+            index = state.index()
+        except (BotoCoreError, ClientError):
+            index = None
+        if index is not None and request.get('ou'):
+            account_ids = accounts_in_ous(request['ou'], index=index)
+            rows = [row for row in rows if row['AccountID'] in account_ids]
+        if index is not None and request.get('prefilter', True):
+            rows = AccountPrefilter(index).split(rows, skipped)
+    circuit_breaker = AccountCircuitBreaker()
+
+    def worker(row):
+        # The warm credential cache stands in for a fresh assume_role per role
+        return process_role(row, statement, circuit_breaker, state.credentials.iam_client)
+
+    scheduler = AccountScheduler(max_workers=request.get('max_workers', 16), per_account_limit=request.get('per_account_limit', 4))
+    for row, outcome in chain(scheduler.run(rows, worker), skipped):
+        yield {'AccountID': row['AccountID'], 'RoleName': row['RoleName'], 'TrustPolicyUpdated': outcome.label}
+
+def provenance_audit(state, request):
+    """Classify the current account's roles as created by CloudFormation or manually
+
+    Request: optional filter clauses, enrich (default true) and refresh.
+    """
+    enricher = RoleEnricher(iam_client) if request.get('enrich', True) else None
+    try:
+        cf_role_details = state.stack_roles(request.get('refresh', False))
+        all_roles = get_all_roles(RoleFilter(request.get('filter', [])), enricher)
+        cf_roles = set(cf_role_details)
+        yield from audit_rows(all_roles & cf_roles, all_roles - cf_roles, cf_role_details, enricher)
+    finally:
+        if enricher:
+            enricher.close()
+
+def account_status(state, request):
+    """Report the OU path and status of every account, or those under the requested OUs
+
+    Request: optional ou and refresh.
+    """
+    return account_status_rows(state.index(request.get('refresh', False)), request.get('ou', ()))
+
+def _audit_fields(request):
+    return AUDIT_FIELDS + ENRICHMENT_FIELDS if request.get('enrich', True) else AUDIT_FIELDS
+
+# Job name -> (handler yielding rows, fields of the rows for a request)
+JOBS = {
+    'trust_update': (trust_update, lambda request: UPDATE_RESULT_FIELDS),
+    'provenance_audit': (provenance_audit, _audit_fields),
+    'account_status': (account_status, lambda request: ACCOUNT_STATUS_FIELDS),
+}
@@ -0,0 +1,179 @@
+import argparse
+import json
+import os
+import socket
+import socketserver
+import sys
+import tempfile
+from time import monotonic
+from rich.console import Console
+from rich.table import Table
+from role_reader import iter_roles
+from sinks import open_sink
+
+console = Console()
+
+# Where the resident server listens; the socket is only accessible to its owner
+SOCKET_PATH = os.environ.get('AWS_AUTOMATION_SOCKET', os.path.join(tempfile.gettempdir(), 'aws-automation.sock'))
+
+JOB_NAMES = ['trust_update', 'provenance_audit', 'account_status']
+
+class JobHandler(socketserver.StreamRequestHandler):
+    """Run one JSON request line and stream back its fields, one line per row, then a done or error line"""
+
+    def _send(self, message):
+        self.wfile.write((json.dumps(message) + '\n').encode())
+
+    def handle(self):
+        start = monotonic()
+        try:
+            request = json.loads(self.rfile.readline())
+            handler, fields = self.server.jobs[request['job']]
+        except (ValueError, KeyError, TypeError) as e:
+            self._send({'error': f"Bad request: {e}"})
+            return
+
+        rows = 0
+        try:
+            self._send({'fields': fields(request)})
+            for row in handler(self.server.state, request):
+                self._send({'row': row})
+                rows += 1
+        except (BrokenPipeError, ConnectionResetError):
+            console.print(f"[yellow]{request['job']}: client disconnected after {rows} rows[/yellow]")
+            return
+        except Exception as e:
+            # A failed job must not take the warm process down with it
+            console.print(f"[bold red]{request['job']} failed: {e}[/bold red]")
+            self._send({'error': f"{type(e).__name__}: {e}"})
+            return
+        seconds = monotonic() - start
+        self._send({'done': {'rows': rows, 'seconds': round(seconds, 3)}})
+        console.print(f"[green]{request['job']}: {rows} rows in {seconds:.2f}s[/green]")
+
+class AutomationServer(socketserver.ThreadingUnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, socket_path, state, jobs):
+        self.state = state
+        self.jobs = jobs
+        super().__init__(socket_path, JobHandler)
+
+def _remove_stale_socket(socket_path):
+    if not os.path.exists(socket_path):
+        return
+    probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        probe.connect(socket_path)
+    except (ConnectionRefusedError, FileNotFoundError):
+        os.unlink(socket_path)
+        return
+    finally:
+        probe.close()
+    raise SystemExit(f"A server is already listening on {socket_path}")
+
+def serve(socket_path=SOCKET_PATH):
+    """Keep boto3, service models, assumed-role credentials and inventories loaded and run jobs as they arrive"""
+    # Imported here so that submit, which runs on every job, never pays for boto3
+    from automation_jobs import JOBS, WarmState
+
+    state = WarmState()
+    with console.status("Warming up clients and the organization index..."):
+        state.warm_up()
+    _remove_stale_socket(socket_path)
+    old_umask = os.umask(0o177)
+    try:
+        server = AutomationServer(socket_path, state, JOBS)
+    finally:
+        os.umask(old_umask)
+    console.print(f"[bold green]Listening on {socket_path}[/bold green]")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        os.unlink(socket_path)
+
+def submit(request, socket_path=SOCKET_PATH, output_file=None):
+    """Send a job to the server and print or write its rows as they stream back"""
+    connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        connection.connect(socket_path)
+    except (ConnectionRefusedError, FileNotFoundError):
+        raise SystemExit(f"No server on {socket_path}, start one with: python automation_server.py serve")
+
+    sink = table = None
+    summary = None
+    with connection, connection.makefile('rb') as replies:
+        connection.sendall((json.dumps(request) + '\n').encode())
+        for line in replies:
+            message = json.loads(line)
+            if 'row' in message:
+                if sink:
+                    sink.write(message['row'])
+                else:
+                    table.add_row(*(str(message['row'].get(field, '')) for field in fields))
+            elif 'fields' in message:
+                fields = message['fields']
+                if output_file:
+                    sink = open_sink(output_file, fields)
+                else:
+                    table = Table(title=request['job'])
+                    for field in fields:
+                        table.add_column(field)
+            elif 'done' in message:
+                summary = message['done']
+            elif 'error' in message:
+                console.print(f"[bold red]{message['error']}[/bold red]")
+    if sink:
+        sink.close()
+        console.print(f"[bold bright_red]Output saved as {output_file}[/bold bright_red]")
+    elif table is not None:
+        console.print(table)
+    if summary is None:
+        sys.exit(1)
+    console.print(f"{summary['rows']} rows in {summary['seconds']}s on the server")
+    return summary
+
+def _request(args):
+    request = {'job': args.job}
+    if args.job == 'trust_update':
+        request['roles'] = list(iter_roles(args.input))
+        request['prefilter'] = not args.no_account_prefilter
+        if args.statement:
+            with open(args.statement, mode='r') as file:
+                request['statement'] = json.load(file)
+    if args.ou:
+        request['ou'] = args.ou
+    if args.filter:
+        request['filter'] = args.filter
+    if args.no_enrich:
+        request['enrich'] = False
+    if args.refresh:
+        request['refresh'] = True
+    return request
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run automation jobs on a resident server that keeps sessions, credentials and inventories warm")
+    parser.add_argument('--socket', default=SOCKET_PATH, help="Unix socket path (default: %(default)s)")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    commands.add_parser('serve', help="Start the server in the foreground")
+
+    submit_parser = commands.add_parser('submit', help="Run a job on the server and stream its results")
+    submit_parser.add_argument('job', choices=JOB_NAMES)
+    submit_parser.add_argument('--input', default='input_roles.csv', help="Roles to update, for trust_update (default: %(default)s)")
+    submit_parser.add_argument('--statement', help="JSON file with the statement to add, for trust_update (default: the data perimeter Deny)")
+    submit_parser.add_argument('--ou', action='append', default=[], help="Only target accounts under this OU; repeatable")
+    submit_parser.add_argument('--filter', action='append', default=[], help="Role filter clause, for provenance_audit; repeatable")
+    submit_parser.add_argument('--no-enrich', action='store_true', help="Skip the enrichment columns, for provenance_audit")
+    submit_parser.add_argument('--no-account-prefilter', action='store_true', help="Do not skip suspended, closed or non-member accounts")
+    submit_parser.add_argument('--refresh', action='store_true', help="Rebuild the server's cached inventory before running")
+    submit_parser.add_argument('--output', help="Write rows to this file (CSV, JSONL or Parquet) instead of printing a table")
+    args = parser.parse_args()
+
+    if args.command == 'serve':
+        serve(args.socket)
+    else:
+        submit(_request(args), args.socket, args.output)
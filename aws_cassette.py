@@ -0,0 +1,202 @@
+import copy
+import json
+import os
+import re
+import threading
+from collections import defaultdict, deque
+from datetime import datetime
+from time import perf_counter, sleep
+from urllib.parse import quote, unquote
+from botocore.awsrequest import AWSResponse
+
+ACCOUNT_ID = re.compile(r'(?<!\d)\d{12}(?!\d)')
+# Organization, OU and root IDs
+ORG_ID = re.compile(r'(?<![\w-])(?:o-[a-z0-9]{10,32}|ou-[a-z0-9]{4,32}-[a-z0-9]{8,32}|r-[a-z0-9]{4,32})(?![\w-])')
+SECRET_FIELDS = {'AccessKeyId', 'SecretAccessKey', 'SessionToken'}
+
+def _encode(value):
+    if isinstance(value, datetime):
+        return {'__datetime__': value.isoformat()}
+    return str(value)
+
+def _decode(value):
+    if '__datetime__' in value:
+        return datetime.fromisoformat(value['__datetime__'])
+    return value
+
+def _encode_policy_documents(parsed, shape):
+    # botocore decodes IAM policy documents after every call; store them
+    # encoded so a replayed response can be decoded again
+    if shape is None:
+        return
+    if shape.type_name == 'structure' and isinstance(parsed, dict):
+        for member_name, member_shape in shape.members.items():
+            if member_name not in parsed:
+                continue
+            if member_shape.name == 'policyDocumentType' and not isinstance(parsed[member_name], str):
+                parsed[member_name] = quote(json.dumps(parsed[member_name]))
+            else:
+                _encode_policy_documents(parsed[member_name], member_shape)
+    elif shape.type_name == 'list' and isinstance(parsed, list):
+        for item in parsed:
+            _encode_policy_documents(item, shape.member)
+
+def _params_key(service, operation, params):
+    return service, operation, json.dumps(params, sort_keys=True, default=_encode)
+
+class Sanitizer:
+    """Replace account and organization IDs with stable fake ones and redact credentials, contact details and request metadata"""
+
+    def __init__(self):
+        self.accounts = {}
+        self.org_ids = {}
+
+    def account(self, match):
+        account_id = match.group(0)
+        if account_id not in self.accounts:
+            self.accounts[account_id] = f"{len(self.accounts) + 100000000000:012d}"
+        return self.accounts[account_id]
+
+    def org_id(self, match):
+        org_id = match.group(0)
+        if org_id not in self.org_ids:
+            n = len(self.org_ids)
+            prefix = org_id.split('-', 1)[0]
+            self.org_ids[org_id] = {'o': f"o-{n:010d}", 'ou': f"ou-0000-{n:08d}", 'r': f"r-{n:04d}"}[prefix]
+        return self.org_ids[org_id]
+
+    def _redacted(self, key, record):
+        # Organizations accounts carry the owner's email address and account name
+        return key in SECRET_FIELDS or key.endswith('Email') or (key == 'Name' and 'Email' in record)
+
+    def leaks(self, text):
+        """Return the real account and organization IDs left in serialized text"""
+        text = unquote(text)
+        fakes = set(self.accounts.values()) | set(self.org_ids.values())
+        return sorted({match for pattern in (ACCOUNT_ID, ORG_ID) for match in pattern.findall(text)} - fakes)
+
+    def __call__(self, value):
+        if isinstance(value, dict):
+            return {
+                key: 'REDACTED' if self._redacted(key, value) else self(item)
+                for key, item in value.items() if key != 'ResponseMetadata'
+            }
+        if isinstance(value, list):
+            return [self(item) for item in value]
+        if isinstance(value, str):
+            return ORG_ID.sub(self.org_id, ACCOUNT_ID.sub(self.account, value))
+        return value
+
+class CassetteRecorder:
+    """Append every API call made through a session to a JSONL cassette"""
+
+    def __init__(self, file_path, sanitize=True):
+        self.file = open(file_path, mode='a')
+        self.lock = threading.Lock()
+        self.sanitizer = Sanitizer() if sanitize else None
+
+    def install(self, session):
+        session.events.register('provide-client-params.*.*', self._before)
+        session.events.register('after-call.*.*', self._after)
+
+    def _before(self, params, context, **kwargs):
+        context['cassette_params'] = dict(params)
+        context['cassette_started'] = perf_counter()
+
+    def _after(self, http_response, parsed, model, context, **kwargs):
+        latency = perf_counter() - context.get('cassette_started', perf_counter())
+        params = context.get('cassette_params', {})
+        parsed = copy.deepcopy(parsed)
+        with self.lock:
+            if self.sanitizer:
+                # Sanitize before encoding: URL-quoted policy documents hide IDs from the patterns
+                params, parsed = self.sanitizer(params), self.sanitizer(parsed)
+            _encode_policy_documents(parsed, model.output_shape)
+            interaction = {
+                'service': model.service_model.service_name,
+                'operation': model.name,
+                'params': params,
+                'status': http_response.status_code,
+                'response': parsed,
+                'latency': latency,
+            }
+            line = json.dumps(interaction, default=_encode)
+            if self.sanitizer:
+                leaks = self.sanitizer.leaks(line)
+                if leaks:
+                    raise ValueError(f"Refusing to record {model.name}: real IDs left after sanitizing: {', '.join(leaks)}")
+            self.file.write(line + '\n')
+            self.file.flush()
+
+class CassettePlayer:
+    """Answer API calls from a cassette instead of the network
+
+    Calls are matched on service, operation and parameters, falling back to
+    service and operation; matching responses are served in recorded order
+    and the last one repeats. latency is 'recorded' to sleep for the
+    recorded time, or a number of seconds, and is multiplied by scale.
+    """
+
+    def __init__(self, file_path, latency='recorded', scale=1.0):
+        self.latency = latency
+        self.scale = scale
+        self.lock = threading.Lock()
+        self.exact = defaultdict(deque)
+        self.by_operation = defaultdict(deque)
+        with open(file_path, mode='r') as file:
+            for line in file:
+                if not line.strip():
+                    continue
+                interaction = json.loads(line, object_hook=_decode)
+                self.exact[_params_key(interaction['service'], interaction['operation'], interaction['params'])].append(interaction)
+                self.by_operation[(interaction['service'], interaction['operation'])].append(interaction)
+
+    def install(self, session):
+        session.events.register('provide-client-params.*.*', self._capture_params)
+        session.events.register('before-call.*.*', self._respond)
+
+    def _capture_params(self, params, context, **kwargs):
+        context['cassette_params'] = dict(params)
+
+    def _next(self, queue):
+        if len(queue) > 1:
+            return queue.popleft()
+        return queue[0] if queue else None
+
+    def _respond(self, model, context, **kwargs):
+        service = model.service_model.service_name
+        with self.lock:
+            interaction = self._next(self.exact[_params_key(service, model.name, context.get('cassette_params', {}))])
+            if interaction is None:
+                interaction = self._next(self.by_operation[(service, model.name)])
+        if interaction is None:
+            raise LookupError(f"No recorded response for {service}.{model.name}")
+        latency = interaction['latency'] if self.latency == 'recorded' else float(self.latency)
+        sleep(latency * self.scale)
+        parsed = copy.deepcopy(interaction['response'])
+        parsed['ResponseMetadata'] = {'HTTPStatusCode': interaction['status'], 'HTTPHeaders': {}, 'RetryAttempts': 0}
+        return AWSResponse(f"https://{service}.cassette", interaction['status'], {}, None), parsed
+
+_cassette = None
+
+def install_from_env(session):
+    """Record or replay the session's calls when AWS_CASSETTE_RECORD or AWS_CASSETTE_REPLAY is set
+
+    AWS_CASSETTE_LATENCY ('recorded' or seconds) and AWS_CASSETTE_LATENCY_SCALE
+    tune replay timing. Replay needs no credentials or network access. Every
+    session of the process shares one recorder or player.
+    """
+    global _cassette
+    if _cassette is None:
+        if os.environ.get('AWS_CASSETTE_REPLAY'):
+            os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+            _cassette = CassettePlayer(
+                os.environ['AWS_CASSETTE_REPLAY'],
+                latency=os.environ.get('AWS_CASSETTE_LATENCY', 'recorded'),
+                scale=float(os.environ.get('AWS_CASSETTE_LATENCY_SCALE', '1.0')),
+            )
+        elif os.environ.get('AWS_CASSETTE_RECORD'):
+            _cassette = CassetteRecorder(os.environ['AWS_CASSETTE_RECORD'])
+        else:
+            return
+    _cassette.install(session)
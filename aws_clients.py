@@ -0,0 +1,125 @@
+import os
+import threading
+from collections import OrderedDict
+from time import monotonic, sleep
+import boto3
+import botocore.session
+from botocore.config import Config
+from aws_cassette import install_from_env
+
+# Use the STS endpoint in the runner's region instead of the global one
+os.environ.setdefault('AWS_STS_REGIONAL_ENDPOINTS', 'regional')
+
+# Number of threads the scripts run API calls on; HTTP pools are sized to match
+MAX_CONCURRENCY = int(os.environ.get('AWS_AUTOMATION_CONCURRENCY', '16'))
+
+def client_config(max_concurrency=MAX_CONCURRENCY):
+    """Return the botocore performance profile applied to every client"""
+    return Config(
+        max_pool_connections=max_concurrency,
+        connect_timeout=5,
+        read_timeout=30,
+        tcp_keepalive=True,
+        retries={'mode': 'standard', 'max_attempts': 5},
+    )
+
+# Calls per second allowed per service for bulk per-role lookups, shared by every caller in the process
+RATE_LIMITS = {'iam': float(os.environ.get('AWS_AUTOMATION_IAM_RATE', '20'))}
+
+# Clients built from explicit (assumed-role) credentials kept for reuse, least recently used dropped first
+CREDENTIAL_CLIENT_CACHE = int(os.environ.get('AWS_AUTOMATION_CREDENTIAL_CLIENTS', '256'))
+
+_lock = threading.Lock()
+_session = None
+_config = None
+_clients = {}
+_credential_clients = OrderedDict()
+_local = threading.local()
+
+def get_session():
+    """Return the shared boto3 session"""
+    global _session, _config
+    with _lock:
+        if _session is None:
+            _session = boto3.session.Session()
+            _config = client_config()
+            # Record or replay API traffic for offline benchmarks
+            install_from_env(_session)
+        return _session
+
+def _thread_session():
+    """Return this thread's own session, so threads build clients without waiting on each other"""
+    session = getattr(_local, 'session', None)
+    if session is None:
+        shared = get_session()
+        session = boto3.session.Session(botocore_session=botocore.session.Session())
+        # Share the loaded service models instead of reading them again on every thread
+        session._session.register_component('data_loader', shared._session.get_component('data_loader'))
+        with _lock:
+            install_from_env(session)
+        _local.session = session
+    return session
+
+def client(service_name, region_name=None, **kwargs):
+    """Create a client with the performance profile
+
+    Clients are thread-safe once built, so clients using the default
+    credentials are cached and shared across threads, reusing one
+    keep-alive connection pool. Building clients from a session is not
+    thread-safe, so those are built under a lock, once per service.
+
+    Clients for explicit credentials, such as an assumed role's, are built
+    on the calling thread's own session outside the lock, send their
+    requests through the shared client's connection pool, and are cached
+    per credential set.
+    """
+    session = get_session()
+    if kwargs:
+        key = (service_name, region_name, tuple(sorted(kwargs.items())))
+        with _lock:
+            cached = _credential_clients.get(key)
+            if cached is not None:
+                _credential_clients.move_to_end(key)
+                return cached
+        built = _thread_session().client(service_name, region_name=region_name, config=_config, **kwargs)
+        # Requests are signed per client, so every credential set can share the default client's
+        # keep-alive pool instead of opening new connections for each assumed role
+        shared = client(service_name, region_name)
+        if getattr(shared, '_endpoint', None) is not None and shared._endpoint.host == built._endpoint.host:
+            built._endpoint.http_session = shared._endpoint.http_session
+        with _lock:
+            # Another thread may have built the same client meanwhile; keep the first
+            built = _credential_clients.setdefault(key, built)
+            while len(_credential_clients) > CREDENTIAL_CLIENT_CACHE:
+                _credential_clients.popitem(last=False)
+        return built
+    key = (service_name, region_name)
+    with _lock:
+        if key not in _clients:
+            _clients[key] = session.client(service_name, region_name=region_name, config=_config)
+        return _clients[key]
+
+class RateLimiter:
+    """Space calls evenly so callers on any thread stay under a per-second rate"""
+
+    def __init__(self, rate):
+        self.interval = 1.0 / rate
+        self.lock = threading.Lock()
+        self.next_slot = monotonic()
+
+    def wait(self):
+        with self.lock:
+            now = monotonic()
+            slot = max(self.next_slot, now)
+            self.next_slot = slot + self.interval
+        if slot > now:
+            sleep(slot - now)
+
+_limiters = {}
+
+def rate_limiter(service_name):
+    """Return the process-wide rate limiter for a service"""
+    with _lock:
+        if service_name not in _limiters:
+            _limiters[service_name] = RateLimiter(RATE_LIMITS.get(service_name, 10.0))
+        return _limiters[service_name]
@@ -0,0 +1,43 @@
+"""Compare concurrent STS throughput of default boto3 clients against the aws_clients profile
+
+Needs AWS credentials. Run from the repository root:
+python benchmarks/bench_client_profile.py [calls] [threads]
+"""
+import os
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from time import perf_counter
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import boto3
+
+def run(sts_client, calls, threads):
+    def call(_):
+        start = perf_counter()
+        sts_client.get_caller_identity()
+        return perf_counter() - start
+
+    start = perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        latencies = sorted(executor.map(call, range(calls)))
+    elapsed = perf_counter() - start
+    return calls / elapsed, latencies[len(latencies) // 2], latencies[int(len(latencies) * 0.95)]
+
+def main():
+    calls = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+    threads = int(sys.argv[2]) if len(sys.argv) > 2 else 32
+
+    # Build the baseline before aws_clients switches STS to regional endpoints
+    default_client = boto3.session.Session().client('sts', endpoint_url='https://sts.amazonaws.com')
+    os.environ['AWS_AUTOMATION_CONCURRENCY'] = str(threads)
+    import aws_clients
+    tuned_client = aws_clients.client('sts')
+
+    for name, sts_client in (('default', default_client), ('profile', tuned_client)):
+        sts_client.get_caller_identity()  # warm up the connection pool
+        throughput, p50, p95 = run(sts_client, calls, threads)
+        print(f"{name:8} {sts_client.meta.endpoint_url:40} {throughput:8.1f} calls/s  p50 {p50 * 1000:6.1f} ms  p95 {p95 * 1000:6.1f} ms")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,47 @@
+"""Time a script against a recorded cassette, with no network access
+
+Record once against a real org:
+    AWS_CASSETTE_RECORD=cassettes/org.jsonl python hum.py
+Then replay it as often as needed, from the repository root:
+    python benchmarks/bench_replay.py cassettes/org.jsonl hum.py [--repeat 5] [--latency recorded] [--scale 1.0] [-- script args]
+Arguments after -- are passed to the script.
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+from time import perf_counter
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark a script against a recorded cassette")
+    parser.add_argument('cassette')
+    parser.add_argument('script', help="Script to run; its own arguments go after --")
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--latency', default='recorded', help="'recorded' or a fixed number of seconds per call")
+    parser.add_argument('--scale', type=float, default=1.0, help="Multiplier applied to the simulated latency")
+    argv = sys.argv[1:]
+    script_args = []
+    if '--' in argv:
+        split = argv.index('--')
+        argv, script_args = argv[:split], argv[split + 1:]
+    args = parser.parse_args(argv)
+    command = [args.script] + script_args
+
+    env = dict(
+        os.environ,
+        AWS_CASSETTE_REPLAY=os.path.abspath(args.cassette),
+        AWS_CASSETTE_LATENCY=args.latency,
+        AWS_CASSETTE_LATENCY_SCALE=str(args.scale),
+    )
+    timings = []
+    for _ in range(args.repeat):
+        start = perf_counter()
+        subprocess.run([sys.executable] + command, env=env, check=True, stdout=subprocess.DEVNULL)
+        timings.append(perf_counter() - start)
+
+    print(f"{' '.join(command)}: {len(timings)} runs")
+    print(f"min {min(timings):.3f}s  median {statistics.median(timings):.3f}s  max {max(timings):.3f}s")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,47 @@
+"""Compare per-role memory of result dicts against RoleRecord
+
+Run from the repository root: python benchmarks/bench_role_records.py [roles] [accounts]
+"""
+import os
+import sys
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from role_records import Outcome, RoleRecord
+
+def _rows(roles, accounts):
+    # Fresh strings per row, as produced by parsing an input file
+    for i in range(roles):
+        yield str(100000000000 + i % accounts), f"role-{i:08d}"
+
+def measure(build, roles, accounts):
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    results = build(_rows(roles, accounts))
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+    size = sum(stat.size_diff for stat in after.compare_to(before, 'filename'))
+    del results
+    return size
+
+def build_dicts(rows):
+    return [{'AccountID': account_id, 'RoleName': role_name, 'TrustPolicyUpdated': 'True'} for account_id, role_name in rows]
+
+def build_records(rows):
+    return [RoleRecord(account_id, role_name, Outcome.UPDATED) for account_id, role_name in rows]
+
+def main():
+    roles = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+    accounts = int(sys.argv[2]) if len(sys.argv) > 2 else 500
+    # Role names are the same in both layouts, so report them separately
+    names = measure(lambda rows: [role_name for _, role_name in rows], roles, accounts)
+    dicts = measure(build_dicts, roles, accounts) - names
+    records = measure(build_records, roles, accounts) - names
+    print(f"{roles} roles across {accounts} accounts")
+    print(f"dict rows:    {dicts / roles:6.1f} bytes/role overhead")
+    print(f"RoleRecord:   {records / roles:6.1f} bytes/role overhead")
+    print(f"reduction:    {dicts / records:6.1f}x")
+
+if __name__ == "__main__":
+    main()
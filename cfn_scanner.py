@@ -0,0 +1,195 @@
+import argparse
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+import yaml
+from rich.console import Console
+from role_reader import iter_records
+from sinks import write_rows
+
+console = Console()
+
+TEMPLATE_EXTENSIONS = ('.yaml', '.yml', '.json', '.template')
+
+INDEX_FIELDS = ['Template', 'Logical ID', 'Role Name', 'Path', 'Trust Principals', 'Inline Policies', 'Managed Policy ARNs', 'Wildcard Actions']
+JOIN_FIELDS = ['Role Name', 'Creation Method', 'Stack Name or Set ID', 'Template', 'Logical ID', 'Trust Principals', 'Findings']
+
+class CfnLoader(getattr(yaml, 'CSafeLoader', yaml.SafeLoader)):
+    """YAML loader that understands CloudFormation short-form tags (!Ref, !GetAtt, !Sub, ...)"""
+
+def _construct_cfn_tag(loader, tag_suffix, node):
+    if isinstance(node, yaml.ScalarNode):
+        value = loader.construct_scalar(node)
+    elif isinstance(node, yaml.SequenceNode):
+        value = loader.construct_sequence(node, deep=True)
+    else:
+        value = loader.construct_mapping(node, deep=True)
+    if tag_suffix in ('Ref', 'Condition'):
+        return {tag_suffix: value}
+    if tag_suffix == 'GetAtt' and isinstance(value, str):
+        value = value.split('.', 1)
+    return {f'Fn::{tag_suffix}': value}
+
+CfnLoader.add_multi_constructor('!', _construct_cfn_tag)
+# Keep dates such as Version: 2012-10-17 as strings
+CfnLoader.add_constructor('tag:yaml.org,2002:timestamp', yaml.SafeLoader.construct_yaml_str)
+
+def load_template(file_path):
+    """Parse a JSON or YAML CloudFormation template, returning None if it is not one"""
+    try:
+        with open(file_path, mode='r', encoding='utf-8') as file:
+            text = file.read()
+        template = json.loads(text) if text.lstrip().startswith('{') else yaml.load(text, Loader=CfnLoader)
+    except (OSError, UnicodeDecodeError, ValueError, yaml.YAMLError):
+        # Unreadable, binary or non-template files under a scanned directory are skipped
+        return None
+    if not isinstance(template, dict) or not isinstance(template.get('Resources'), dict):
+        return None
+    return template
+
+def _as_list(value):
+    return value if isinstance(value, list) else [value]
+
+def _literal(value):
+    return value if isinstance(value, str) else json.dumps(value, sort_keys=True)
+
+def _trust_principals(document):
+    principals = []
+    for statement in _as_list((document or {}).get('Statement', [])):
+        if not isinstance(statement, dict) or statement.get('Effect') != 'Allow':
+            continue
+        principal = statement.get('Principal')
+        if principal == '*':
+            principals.append('*')
+        elif isinstance(principal, dict):
+            for principal_type, values in principal.items():
+                principals.extend(f"{principal_type}:{_literal(value)}" for value in _as_list(values))
+    return principals
+
+def _has_wildcard_action(policies):
+    for policy in policies:
+        document = policy.get('PolicyDocument') if isinstance(policy, dict) else None
+        for statement in _as_list((document or {}).get('Statement', [])):
+            if isinstance(statement, dict) and statement.get('Effect') == 'Allow' and '*' in _as_list(statement.get('Action')):
+                return True
+    return False
+
+def scan_template(file_path):
+    """Return one index entry per AWS::IAM::Role resource in a template"""
+    template = load_template(file_path)
+    if template is None:
+        return []
+    entries = []
+    for logical_id, resource in template['Resources'].items():
+        if not isinstance(resource, dict) or resource.get('Type') != 'AWS::IAM::Role':
+            continue
+        properties = resource.get('Properties') or {}
+        policies = _as_list(properties.get('Policies') or [])
+        role_name = properties.get('RoleName')
+        entries.append({
+            'Template': file_path,
+            'Logical ID': logical_id,
+            'Role Name': role_name if isinstance(role_name, str) else '',
+            'Path': _literal(properties.get('Path', '/')),
+            'Trust Principals': ';'.join(_trust_principals(properties.get('AssumeRolePolicyDocument'))),
+            'Inline Policies': ';'.join(_literal(policy.get('PolicyName', '')) for policy in policies if isinstance(policy, dict)),
+            'Managed Policy ARNs': ';'.join(_literal(arn) for arn in _as_list(properties.get('ManagedPolicyArns') or [])),
+            'Wildcard Actions': _has_wildcard_action(policies),
+        })
+    return entries
+
+def find_templates(paths):
+    """Yield template files from the given files and directory trees"""
+    for path in paths:
+        if os.path.isfile(path):
+            yield path
+            continue
+        for root, _, files in os.walk(path):
+            for name in files:
+                if name.endswith(TEMPLATE_EXTENSIONS):
+                    yield os.path.join(root, name)
+
+def scan_templates(paths, max_workers=None):
+    """Scan all templates under paths in parallel processes, returning the role index"""
+    index = []
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        for entries in executor.map(scan_template, find_templates(paths), chunksize=16):
+            index.extend(entries)
+    return index
+
+def _generated_logical_id(role_name, stack_name):
+    # CloudFormation names roles <stack>-<LogicalId>-<suffix>, truncating long parts
+    if not stack_name or not role_name.startswith(stack_name + '-'):
+        return None
+    return role_name[len(stack_name) + 1:].rsplit('-', 1)[0]
+
+def _findings(entry):
+    findings = []
+    principals = entry['Trust Principals'].split(';')
+    if '*' in principals or 'AWS:*' in principals:
+        findings.append('Wildcard trust principal')
+    if entry['Wildcard Actions']:
+        findings.append('Inline policy allows Action *')
+    return findings
+
+def _join_row(row, entry, findings):
+    return {
+        'Role Name': row.get('Role Name') or entry.get('Role Name', ''),
+        'Creation Method': row.get('Creation Method', ''),
+        'Stack Name or Set ID': row.get('Stack Name or Set ID', ''),
+        'Template': entry.get('Template', ''),
+        'Logical ID': entry.get('Logical ID', ''),
+        'Trust Principals': entry.get('Trust Principals', ''),
+        'Findings': ';'.join(findings),
+    }
+
+def join_audit(index, audit_path):
+    """Join the template index against a roles_audit.csv snapshot
+
+    Roles match on an explicit RoleName or on CloudFormation's generated
+    <stack>-<LogicalId>-<suffix> name. Unmatched CloudFormation roles and
+    template roles with no live match are reported as provenance gaps.
+    """
+    by_role_name = {entry['Role Name']: entry for entry in index if entry['Role Name']}
+    by_logical_id = {}
+    for entry in index:
+        by_logical_id.setdefault(entry['Logical ID'], []).append(entry)
+
+    matched = set()
+    for row in iter_records(audit_path):
+        entry = by_role_name.get(row['Role Name'])
+        if entry is None:
+            logical_id = _generated_logical_id(row['Role Name'], row['Stack Name or Set ID'])
+            candidates = by_logical_id.get(logical_id, []) if logical_id else []
+            entry = candidates[0] if len(candidates) == 1 else None
+
+        if entry is None:
+            findings = ['No template found'] if row['Creation Method'] == 'CloudFormation' else []
+            yield _join_row(row, {}, findings)
+        else:
+            matched.add((entry['Template'], entry['Logical ID']))
+            yield _join_row(row, entry, _findings(entry))
+
+    for entry in index:
+        if (entry['Template'], entry['Logical ID']) not in matched:
+            yield _join_row({}, entry, ['Not deployed'] + _findings(entry))
+
+def main():
+    parser = argparse.ArgumentParser(description="Index IAM roles defined in CloudFormation templates")
+    parser.add_argument('paths', nargs='+', help="Template files or directories to scan")
+    parser.add_argument('--index', default='cfn_role_index.csv', help="Output file for the role index")
+    parser.add_argument('--audit', help="roles_audit.csv snapshot to join against")
+    parser.add_argument('--join', default='cfn_role_join.csv', help="Output file for the joined report")
+    parser.add_argument('--workers', type=int, help="Number of parser processes")
+    args = parser.parse_args()
+
+    index = scan_templates(args.paths, args.workers)
+    write_rows(args.index, INDEX_FIELDS, index, schema={'Wildcard Actions': 'bool'})
+    console.log(f"[bold green]Indexed {len(index)} roles into {args.index}")
+
+    if args.audit:
+        write_rows(args.join, JOIN_FIELDS, join_audit(index, args.audit))
+        console.log(f"[bold green]Joined report saved as {args.join}")
+
+if __name__ == "__main__":
+    main()
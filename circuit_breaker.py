@@ -0,0 +1,58 @@
+import threading
+from time import monotonic
+
+# Assume-role errors meaning the whole account will keep refusing us. AccessDenied is left out: each row
+# assumes its own role, so it only says that one role does not trust us. Throttling and other transient
+# errors never trip a circuit either
+TRIPPING_CODES = {
+    'InvalidClientTokenId', 'UnrecognizedClientException', 'ExpiredToken', 'ExpiredTokenException',
+    'RegionDisabledException', 'SignatureDoesNotMatch', 'AuthFailure', 'OptInRequired', 'InvalidIdentityToken',
+}
+
+def last_error_code(errors):
+    """Return the AWS error code of the last collected error, or None"""
+    if not errors:
+        return None
+    return getattr(errors[-1], 'response', {}).get('Error', {}).get('Code')
+
+class AccountCircuitBreaker:
+    """Stop calling accounts whose role assumption keeps failing
+
+    After threshold consecutive account-wide failures (see TRIPPING_CODES) for
+    an account its circuit opens and allow() returns False. Once cooldown seconds have passed a single
+    probe is let through: success closes the circuit, failure re-opens it.
+    """
+
+    def __init__(self, threshold=3, cooldown=300):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.lock = threading.Lock()
+        self.failures = {}
+        self.opened_at = {}
+        self.probing = set()
+
+    def allow(self, account_id):
+        with self.lock:
+            opened_at = self.opened_at.get(account_id)
+            if opened_at is None:
+                return True
+            if account_id in self.probing or monotonic() - opened_at < self.cooldown:
+                return False
+            self.probing.add(account_id)
+            return True
+
+    def record_success(self, account_id):
+        with self.lock:
+            self.failures.pop(account_id, None)
+            self.opened_at.pop(account_id, None)
+            self.probing.discard(account_id)
+
+    def record_failure(self, account_id, error_code=None):
+        with self.lock:
+            self.probing.discard(account_id)
+            if error_code not in TRIPPING_CODES:
+                return
+            self.failures[account_id] = self.failures.get(account_id, 0) + 1
+            if self.failures[account_id] >= self.threshold:
+                self.opened_at[account_id] = monotonic()
+
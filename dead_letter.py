@@ -0,0 +1,262 @@
+import argparse
+import json
+import os
+import sqlite3
+from time import sleep, time
+from rich.console import Console
+from rich.table import Table
+from circuit_breaker import AccountCircuitBreaker
+from policy_merge import policy_hash
+from role_records import Outcome
+from scheduler import AccountScheduler
+from sinks import UPDATE_RESULT_FIELDS, UPDATE_RESULT_SCHEMA, write_rows
+
+console = Console()
+
+DEAD_LETTER_DB = os.environ.get('AWS_AUTOMATION_DEAD_LETTERS', 'dead_letters.db')
+# Rounds of the automatic retry pass and the wait before the first one, doubled each round
+RETRY_ROUNDS = int(os.environ.get('AWS_AUTOMATION_RETRY_ROUNDS', '3'))
+RETRY_DELAY = float(os.environ.get('AWS_AUTOMATION_RETRY_DELAY', '5'))
+
+# Error codes that are worth retrying once the account or service has calmed down
+RETRYABLE_CODES = {
+    'Throttling', 'ThrottlingException', 'ThrottledException', 'RequestThrottled',
+    'RequestLimitExceeded', 'TooManyRequestsException', 'SlowDown',
+    'ServiceUnavailable', 'ServiceUnavailableException', 'InternalFailure',
+    'InternalError', 'InternalServerError', 'RequestTimeout', 'RequestTimeoutException',
+    'ConcurrentModification', 'ConcurrentModificationException', 'PriorRequestNotComplete',
+    'IDPCommunicationError',
+}
+# Recorded for roles skipped by an open circuit; an earlier real error code is kept over it. On its
+# own it is retryable: the role was never tried, and the next round starts with a closed circuit
+CIRCUIT_OPEN_CODE = 'CircuitOpen'
+FAILED_OUTCOMES = {Outcome.NOT_UPDATED, Outcome.ASSUME_ROLE_FAILED, Outcome.CIRCUIT_OPEN}
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS dead_letters (
+    account_id TEXT NOT NULL,
+    role_name TEXT NOT NULL,
+    updater TEXT NOT NULL,
+    payload_hash TEXT NOT NULL,
+    payload TEXT NOT NULL,
+    outcome INTEGER NOT NULL,
+    error_code TEXT NOT NULL,
+    message TEXT NOT NULL,
+    retryable INTEGER NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 1,
+    first_failed REAL NOT NULL,
+    last_failed REAL NOT NULL,
+    PRIMARY KEY (account_id, role_name, updater, payload_hash)
+);
+"""
+
+def error_details(row, outcome):
+    """Return (error code, message) for a failed role from the errors its updater collected"""
+    errors = row.get('Errors')
+    if errors:
+        error = errors[-1]
+        details = getattr(error, 'response', {}).get('Error', {})
+        return details.get('Code', type(error).__name__), details.get('Message', str(error))
+    if outcome == Outcome.CIRCUIT_OPEN:
+        return CIRCUIT_OPEN_CODE, outcome.label
+    return outcome.name, outcome.label
+
+class DeadLetterStore:
+    """Persistent failed (account, role, updater) entries with their latest error
+
+    An entry is keyed by the update it failed to apply, so the same role can
+    be dead-lettered for different statements. Successful updates clear it.
+    A role skipped by an open circuit keeps the error code of its last real
+    failure, which decides whether it is retryable.
+    Writes are committed in batches and on commit() or close().
+    """
+
+    def __init__(self, db_path=DEAD_LETTER_DB, commit_every=1000):
+        self.conn = sqlite3.connect(db_path, timeout=60)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.executescript(SCHEMA)
+        self.commit_every = commit_every
+        self.writes = 0
+
+    def _written(self):
+        self.writes += 1
+        if self.writes % self.commit_every == 0:
+            self.conn.commit()
+
+    def collect(self, row, outcome, updater, payload):
+        """Record a failed role, or clear an earlier entry for the same update once it succeeds"""
+        if outcome in FAILED_OUTCOMES:
+            error_code, message = error_details(row, outcome)
+            now = time()
+            self.conn.execute(
+                """INSERT INTO dead_letters VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, 1, ?, ?)
+                ON CONFLICT (account_id, role_name, updater, payload_hash) DO UPDATE SET
+                    outcome = excluded.outcome,
+                    error_code = CASE WHEN excluded.error_code = ? THEN error_code ELSE excluded.error_code END,
+                    message = CASE WHEN excluded.error_code = ? THEN message ELSE excluded.message END,
+                    retryable = CASE WHEN excluded.error_code = ? THEN retryable ELSE excluded.retryable END,
+                    attempts = attempts + 1, last_failed = excluded.last_failed""",
+                (row['AccountID'], row['RoleName'], updater, policy_hash(payload), json.dumps(payload), int(outcome),
+                 error_code, message, int(error_code in RETRYABLE_CODES or error_code == CIRCUIT_OPEN_CODE), now, now) + (CIRCUIT_OPEN_CODE,) * 3
+            )
+            self._written()
+        elif outcome == Outcome.UPDATED:
+            self.conn.execute(
+                'DELETE FROM dead_letters WHERE account_id = ? AND role_name = ? AND updater = ? AND payload_hash = ?',
+                (row['AccountID'], row['RoleName'], updater, policy_hash(payload))
+            )
+            self._written()
+
+    def entries(self, updater=None, payload=None, retryable_only=False):
+        """Return dead letters as dicts, optionally for one update and only retryable ones"""
+        query = 'SELECT account_id, role_name, updater, payload, error_code, message, retryable, attempts, last_failed FROM dead_letters WHERE 1 = 1'
+        params = []
+        if updater is not None:
+            query += ' AND updater = ? AND payload_hash = ?'
+            params += [updater, policy_hash(payload)]
+        if retryable_only:
+            query += ' AND retryable = 1'
+        return [
+            {
+                'AccountID': account_id, 'RoleName': role_name, 'Updater': updater, 'Payload': json.loads(payload),
+                'ErrorCode': error_code, 'Message': message, 'Retryable': bool(retryable), 'Attempts': attempts, 'LastFailed': last_failed,
+            }
+            for account_id, role_name, updater, payload, error_code, message, retryable, attempts, last_failed
+            in self.conn.execute(query + ' ORDER BY account_id, role_name', params)
+        ]
+
+    def commit(self):
+        self.conn.commit()
+
+    def close(self):
+        self.conn.commit()
+        self.conn.close()
+
+def retry_pass(store, updater, payload, process, rounds=RETRY_ROUNDS, initial_delay=RETRY_DELAY, wait_first=True, retryable_only=True, targets=None, max_workers=16, per_account_limit=4):
+    """Re-run the dead letters of one update, backing off exponentially between rounds
+
+    process(row, circuit_breaker) returns an Outcome, as the updaters'
+    process_role does. Each round gets a fresh circuit breaker, so accounts
+    that tripped in an earlier round are called again. The
+    first round takes every entry when retryable_only is False; later rounds
+    only take entries whose latest error is retryable. The first round starts
+    straight away unless wait_first is set. targets limits the pass to a
+    set of (account_id, role_name) keys. Returns
+    {(account_id, role_name): outcome} for every role retried.
+    """
+    store.commit()
+    final = {}
+    delay = initial_delay
+    scheduler = AccountScheduler(max_workers=max_workers, per_account_limit=per_account_limit)
+    for attempt in range(rounds):
+        rows = [
+            {'AccountID': entry['AccountID'], 'RoleName': entry['RoleName']}
+            for entry in store.entries(updater, payload, retryable_only or attempt > 0)
+            if targets is None or (entry['AccountID'], entry['RoleName']) in targets
+        ]
+        if not rows:
+            break
+        if attempt or wait_first:
+            console.print(f"[yellow]Retrying {len(rows)} failed roles in {delay:g}s (round {attempt + 1} of {rounds})[/yellow]")
+            sleep(delay)
+            delay *= 2
+        else:
+            console.print(f"[yellow]Retrying {len(rows)} failed roles (round 1 of {rounds})[/yellow]")
+        circuit_breaker = AccountCircuitBreaker()
+        for row, outcome in scheduler.run(rows, lambda row: process(row, circuit_breaker)):
+            final[(row['AccountID'], row['RoleName'])] = outcome
+            store.collect(row, outcome, updater, payload)
+        store.commit()
+    return final
+
+def retry_failed(store, results, updater, payload, process, rounds=RETRY_ROUNDS):
+    """Run the retry pass after a main pass and update its RoleRecords with the final outcomes"""
+    store.commit()
+    failed = {(record.account_id, record.role_name) for record in results if record.outcome in FAILED_OUTCOMES}
+    if rounds <= 0 or not failed:
+        return
+    final = retry_pass(store, updater, payload, process, rounds, targets=failed)
+    for record in results:
+        outcome = final.get((record.account_id, record.role_name))
+        if outcome is not None:
+            record.outcome = outcome
+    recovered = sum(1 for outcome in final.values() if outcome == Outcome.UPDATED)
+    remaining = len(store.entries(updater, payload))
+    console.print(f"[bold green]Retry pass recovered {recovered} roles[/bold green], {remaining} left in the dead-letter store")
+
+def add_dead_letter_arguments(parser):
+    parser.add_argument('--dead-letters', default=DEAD_LETTER_DB, help="SQLite store for roles that failed to update (default: %(default)s)")
+    parser.add_argument('--retry-rounds', type=int, default=RETRY_ROUNDS, help="Rounds of the automatic retry pass over retryable failures, 0 to skip (default: %(default)s)")
+
+def _processor(updater, payload):
+    # Imported here because the updaters import this module
+    if updater == 'statement':
+        from xpl import process_role
+        return lambda row, circuit_breaker: process_role(row, payload, circuit_breaker)
+    if updater == 'spec':
+        from trust_mutations import TrustSpec
+        from trust_spec import process_role
+        spec = TrustSpec(payload)
+        return lambda row, circuit_breaker: process_role(row, spec, circuit_breaker)
+    if updater == 'document':
+        from prod import process_role
+        return lambda row, circuit_breaker: process_role(row, payload, circuit_breaker)
+    raise ValueError(f"Unknown updater {updater}")
+
+def list_entries(store, retryable_only=False):
+    table = Table(title="Dead Letters")
+    table.add_column("Account ID")
+    table.add_column("Role Name")
+    table.add_column("Updater")
+    table.add_column("Error", style="red")
+    table.add_column("Retryable")
+    table.add_column("Attempts", justify="right")
+    table.add_column("Message")
+    entries = store.entries(retryable_only=retryable_only)
+    for entry in entries:
+        table.add_row(
+            entry['AccountID'], entry['RoleName'], entry['Updater'], entry['ErrorCode'],
+            'Yes' if entry['Retryable'] else 'No', str(entry['Attempts']), entry['Message'][:80]
+        )
+    console.print(table)
+    return entries
+
+def retry_all(store, output_file, rounds=RETRY_ROUNDS, retryable_only=True):
+    """Re-drive every dead-lettered update and write the outcomes of the retried roles"""
+    updates = {}
+    for entry in store.entries(retryable_only=retryable_only):
+        updates.setdefault((entry['Updater'], policy_hash(entry['Payload'])), (entry['Updater'], entry['Payload']))
+    results = []
+    for updater, payload in updates.values():
+        final = retry_pass(store, updater, payload, _processor(updater, payload), rounds, wait_first=False, retryable_only=retryable_only)
+        results.extend(
+            {'AccountID': account_id, 'RoleName': role_name, 'TrustPolicyUpdated': outcome.label}
+            for (account_id, role_name), outcome in final.items()
+        )
+    write_rows(output_file, UPDATE_RESULT_FIELDS, results, UPDATE_RESULT_SCHEMA)
+    recovered = sum(1 for row in results if row['TrustPolicyUpdated'] == Outcome.UPDATED.label)
+    console.print(f"[bold green]Recovered {recovered} of {len(results)} roles[/bold green], {len(store.entries())} left in the dead-letter store")
+    console.print(f"[bold bright_red]Output saved as {output_file}[/bold bright_red]")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Inspect and re-drive roles whose trust policy update failed")
+    parser.add_argument('--db', default=DEAD_LETTER_DB, help="Dead-letter store (default: %(default)s)")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    list_parser = commands.add_parser('list', help="Show dead-lettered roles and their latest error")
+    list_parser.add_argument('--retryable', action='store_true', help="Only show entries with a retryable error")
+
+    retry_parser = commands.add_parser('retry', help="Retry dead-lettered roles with exponential backoff")
+    retry_parser.add_argument('--all', action='store_true', help="Also retry entries whose error is not retryable, once")
+    retry_parser.add_argument('--rounds', type=int, default=RETRY_ROUNDS, help="Retry rounds (default: %(default)s)")
+    retry_parser.add_argument('--output', default='dead_letter_retry_results.csv')
+    args = parser.parse_args()
+
+    store = DeadLetterStore(args.db)
+    try:
+        if args.command == 'list':
+            list_entries(store, args.retryable)
+        else:
+            retry_all(store, args.output, args.rounds, retryable_only=not args.all)
+    finally:
+        store.close()
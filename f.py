@@ -1,12 +1,12 @@
-import boto3
 import csv
 from rich.progress import Progress
 from rich.console import Console
+from aws_clients import client
+from stackset_resolver import resolve_stackset_roles
 
-# Initialize clients for IAM, CloudFormation, and CloudFormation StackSets
-iam_client = boto3.client('iam')
-cf_client = boto3.client('cloudformation')
-cf_stackset_client = boto3.client('cloudformation')
+# Initialize clients for IAM and CloudFormation
+iam_client = client('iam')
+cf_client = client('cloudformation')
 
 console = Console()
 
@@ -29,16 +29,8 @@ def get_cloudformation_roles():
                         cf_roles[role_name] = (stack_name, stack_arn)
                         console.log(f":arrow_forward: Processing role from CloudFormation stack: [cyan]{role_name}")
             progress.update(task, advance=1)
-    # Additional handling for StackSets
-    stacksets_paginator = cf_stackset_client.get_paginator('list_stack_instances')
-    for page in stacksets_paginator.paginate():
-        for instance in page['Summaries']:
-            stack_instance_resources = cf_client.list_stack_resources(StackName=instance['StackId'])['StackResourceSummaries']
-            for resource in stack_instance_resources:
-                if resource['ResourceType'] == 'AWS::IAM::Role':
-                    role_name = resource['PhysicalResourceId']
-                    cf_roles[role_name] = (instance['StackSetId'], instance['StackId'])
-                    console.log(f":arrow_forward: Processing role from CloudFormation StackSet: [magenta]{role_name}")
+    # Resolve StackSet instances from inside their target accounts
+    cf_roles.update(resolve_stackset_roles(cf_client))
     return cf_roles
 
 def get_all_roles():
@@ -1,13 +1,18 @@
-import boto3
-import csv
+import argparse
 import logging  # Make sure to import the logging module
 from rich.progress import Progress, BarColumn, TextColumn, TimeRemainingColumn
 from rich.console import Console
 from rich.logging import RichHandler
+from aws_clients import client
+from phase_profiler import add_profile_arguments, profiler
+from role_enrichment import ENRICHMENT_FIELDS, ENRICHMENT_SCHEMA, RoleEnricher
+from role_filter import RoleFilter, add_filter_arguments
+from sinks import open_sink
+from stackset_resolver import resolve_stackset_roles
 
 # Initialize clients for IAM and CloudFormation
-iam_client = boto3.client('iam')
-cf_client = boto3.client('cloudformation')
+iam_client = client('iam')
+cf_client = client('cloudformation')
 
 # Setup console and logging
 console = Console()
@@ -34,36 +39,30 @@ def get_cloudformation_roles():
             for stack in page['Stacks']:
                 stack_name = stack['StackName']
                 stack_arn = stack['StackId']
+                # One details tuple per stack, shared by all of its roles
+                stack_details = (stack_name, stack_arn)
                 # List resources for each stack
                 resources = cf_client.list_stack_resources(StackName=stack_name)['StackResourceSummaries']
                 for resource in resources:
                     if resource['ResourceType'] == 'AWS::IAM::Role':
                         role_name = resource['PhysicalResourceId']
-                        cf_roles[role_name] = (stack_name, stack_arn)
+                        cf_roles[role_name] = stack_details
                         console.log(f"[cyan]Processing role from CloudFormation stack: {role_name}")
             progress.update(task, advance=1)
 
-    # Handle StackSets
-    stacksets = cf_client.list_stack_sets()['Summaries']
-    for stackset in stacksets:
-        stackset_name = stackset['StackSetName']
-        instances_paginator = cf_client.get_paginator('list_stack_instances')
-        for page in instances_paginator.paginate(StackSetName=stackset_name):
-            for instance in page['Summaries']:
-                if 'StackId' in instance:
-                    stack_id = instance['StackId']
-                    stack_instance_resources = cf_client.list_stack_resources(StackName=stack_id)['StackResourceSummaries']
-                    for resource in stack_instance_resources:
-                        if resource['ResourceType'] == 'AWS::IAM::Role':
-                            role_name = resource['PhysicalResourceId']
-                            cf_roles[role_name] = (stackset_name, stack_id)
-                            console.log(f"[magenta]Processing role from CloudFormation StackSet: {role_name}")
-                else:
-                    console.log(f"[red]No StackId found for instance in StackSet: {stackset_name}")
+    # Resolve StackSet instances from inside their target accounts
+    cf_roles.update(resolve_stackset_roles(cf_client))
     return cf_roles
 
-def get_all_roles():
-    """Retrieve all IAM roles"""
+def get_all_roles(role_filter=None, enricher=None):
+    """Retrieve the IAM roles matching the filter, all of them by default
+
+    Returns a set of role names rather than RoleRecords: the audit covers one
+    account and records no outcome, so the bare names are already the
+    smallest form, and audit_rows builds each output row only as it is
+    written.
+    """
+    role_filter = role_filter or RoleFilter()
     all_roles = set()
     with Progress(
         TextColumn("[progress.description]{task.description}"),
@@ -73,38 +72,74 @@ def get_all_roles():
         console=console
     ) as progress:
         task = progress.add_task("[green]Retrieving IAM roles...", total=None)
-        for page in iam_client.get_paginator('list_roles').paginate():
-            for role in page['Roles']:
-                all_roles.add(role['RoleName'])
-                console.log(f"[green]Processing IAM role: {role['RoleName']}")
+        for role in role_filter.roles(iam_client):
+            all_roles.add(role['RoleName'])
+            if enricher:
+                enricher.submit(role['RoleName'])
+            console.log(f"[green]Processing IAM role: {role['RoleName']}")
             progress.update(task, advance=1)
+    if role_filter.listed != role_filter.selected:
+        console.log(f"[green]{role_filter.selected} of {role_filter.listed} listed roles matched the filter")
     return all_roles
 
-def write_to_csv(cloudformation_roles, manual_roles, cf_role_details):
-    """Write roles to a CSV file with CloudFormation stack details"""
-    with open('roles_audit.csv', 'w', newline='') as file:
-        writer = csv.writer(file)
-        writer.writerow(['Role Name', 'Creation Method', 'Stack Name or Set ID', 'Stack ARN'])
-        for role in cloudformation_roles:
-            stack_name, stack_arn = cf_role_details.get(role, ('N/A', 'N/A'))
-            writer.writerow([role, 'CloudFormation', stack_name, stack_arn])
-        for role in manual_roles:
-            writer.writerow([role, 'Manual', 'N/A', 'N/A'])
+AUDIT_FIELDS = ['Role Name', 'Creation Method', 'Stack Name or Set ID', 'Stack ARN']
+
+def audit_rows(cloudformation_roles, manual_roles, cf_role_details, enricher=None):
+    """Yield one audit row per role, with enrichment columns when given an enricher"""
+    for role in cloudformation_roles:
+        stack_name, stack_arn = cf_role_details.get(role, ('N/A', 'N/A'))
+        row = {'Role Name': role, 'Creation Method': 'CloudFormation', 'Stack Name or Set ID': stack_name, 'Stack ARN': stack_arn}
+        if enricher:
+            row.update(enricher.columns(role))
+        yield row
+    for role in manual_roles:
+        row = {'Role Name': role, 'Creation Method': 'Manual', 'Stack Name or Set ID': 'N/A', 'Stack ARN': 'N/A'}
+        if enricher:
+            row.update(enricher.columns(role))
+        yield row
+
+def write_to_csv(cloudformation_roles, manual_roles, cf_role_details, output_file='roles_audit.csv', enricher=None):
+    """Write roles with CloudFormation stack details, and enrichment columns when given an enricher"""
+    fields = AUDIT_FIELDS + ENRICHMENT_FIELDS if enricher else AUDIT_FIELDS
+    with open_sink(output_file, fields, ENRICHMENT_SCHEMA if enricher else None) as sink:
+        for row in audit_rows(cloudformation_roles, manual_roles, cf_role_details, enricher):
+            sink.write(row)
 
-def main():
+def main(output_file='roles_audit.csv', role_filter=None, enrich=True):
     console.log("[bold blue]Starting to gather roles data...")
-    cf_role_details = get_cloudformation_roles()
-    all_roles = get_all_roles()
+    # Role details are fetched in the background while stacks are listed and roles classified
+    enricher = RoleEnricher(iam_client) if enrich else None
+    with profiler.sampling():
+        with profiler.phase('list_stacks'):
+            cf_role_details = get_cloudformation_roles()
+        with profiler.phase('list_roles'):
+            all_roles = get_all_roles(role_filter, enricher)
     
-    cf_roles = set(cf_role_details.keys())
-    manually_created_roles = all_roles - cf_roles
-    cloudformation_created_roles = all_roles & cf_roles
+    with profiler.phase('classify'):
+        cf_roles = set(cf_role_details.keys())
+        manually_created_roles = all_roles - cf_roles
+        cloudformation_created_roles = all_roles & cf_roles
     
     console.log("Writing results to CSV...")
-    write_to_csv(cloudformation_created_roles, manually_created_roles, cf_role_details)
+    with profiler.phase('write'):
+        write_to_csv(cloudformation_created_roles, manually_created_roles, cf_role_details, output_file, enricher)
+    if enricher:
+        enricher.close()
     
     console.log("[bold green]Process completed successfully!")
 
 if __name__ == "__main__":
-    main()
+    parser = argparse.ArgumentParser(description="Classify IAM roles as created by CloudFormation or manually")
+    add_profile_arguments(parser)
+    add_filter_arguments(parser)
+    parser.add_argument('--no-enrich', action='store_true', help="Skip the last-used, creation date and tags columns")
+    parser.add_argument('--output', default='roles_audit.csv', help="Audit file to write, CSV, JSONL or Parquet (default: %(default)s)")
+    args = parser.parse_args()
+    profiler.enable_from_args(args)
+
+    main(args.output, role_filter=RoleFilter(args.filter), enrich=not args.no_enrich)
+
+    report = profiler.write_report(args.output)
+    if report:
+        console.log(f"Phase report saved as {report}")
 
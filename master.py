@@ -1,28 +1,37 @@
-import boto3
+import argparse
 import json
-import csv
 from rich.progress import Progress
 from rich.table import Table
 from rich import print
+from aws_clients import client
+from phase_profiler import add_profile_arguments, profiler
+from role_filter import RoleFilter, add_filter_arguments
+from role_records import Outcome, RoleRecord, to_rows
+from sinks import UPDATE_RESULT_FIELDS, UPDATE_RESULT_SCHEMA, write_rows
+from trust_verify import DocumentExpectation, add_verify_arguments, current_account_iam_client, verify_results
 
 def add_trust_relationship(role_name, trust_policy):
-    iam_client = boto3.client('iam')
+    iam_client = client('iam')
     
     # Update the role's trust relationship policy
+    with profiler.phase('json'):
+        policy_document = json.dumps(trust_policy)
     try:
-        iam_client.update_assume_role_policy(
-            RoleName=role_name,
-            PolicyDocument=json.dumps(trust_policy)
-        )
+        with profiler.phase('update_role'):
+            iam_client.update_assume_role_policy(
+                RoleName=role_name,
+                PolicyDocument=policy_document
+            )
         return True
     except iam_client.exceptions.UnmodifiableEntityException:
         return False
 
-def add_trust_relationship_to_all_roles(trust_policy):
-    iam_client = boto3.client('iam')
+def add_trust_relationship_to_all_roles(trust_policy, output_file='trust_policy_update_results.csv', role_filter=None):
+    iam_client = client('iam')
+    role_filter = role_filter or RoleFilter()
     
-    # Get a list of all IAM roles
-    roles = iam_client.list_roles()['Roles']
+    # Stream the IAM roles that match the filter, with its path prefix pushed down to list_roles
+    roles = profiler.timed('list_roles', role_filter.roles(iam_client))
     
     # Create a table for terminal output
     table = Table(title="Trust Policy Update Results")
@@ -34,8 +43,8 @@ def add_trust_relationship_to_all_roles(trust_policy):
     results = []
     
     # Create a progress bar
-    with Progress() as progress:
-        task = progress.add_task("[cyan]Processing...", total=len(roles))
+    with Progress() as progress, profiler.sampling():
+        task = progress.add_task("[cyan]Processing...", total=None)
         
         # Add trust relationship to each role
         for role in roles:
@@ -43,35 +52,34 @@ def add_trust_relationship_to_all_roles(trust_policy):
             account_id = role['Arn'].split(':')[4]
             
             if role_name.startswith('AWSServiceRole'):
-                result = {'AccountID': account_id, 'RoleName': role_name, 'TrustPolicyUpdated': 'Skipped (Protected role)'}
-                results.append(result)
+                results.append(RoleRecord(account_id, role_name, Outcome.PROTECTED_ROLE))
                 progress.update(task, advance=1)
                 continue  # Skip modifying protected roles
             
             if add_trust_relationship(role_name, trust_policy):
-                result = {'AccountID': account_id, 'RoleName': role_name, 'TrustPolicyUpdated': 'True'}
-                results.append(result)
+                record = RoleRecord(account_id, role_name, Outcome.UPDATED)
             else:
-                result = {'AccountID': account_id, 'RoleName': role_name, 'TrustPolicyUpdated': 'False'}
-                results.append(result)
+                record = RoleRecord(account_id, role_name, Outcome.NOT_UPDATED)
+            results.append(record)
             
-            # Add row to the table
-            table.add_row(account_id, role_name, result['TrustPolicyUpdated'])
-            
-            # Update progress
-            progress.update(task, advance=1)
+            with profiler.phase('render'):
+                # Add row to the table
+                table.add_row(account_id, role_name, record.outcome.label)
+                
+                # Update progress
+                progress.update(task, advance=1)
     
     # Print the table
-    print(table)
+    with profiler.phase('render'):
+        print(table)
     
-    # Write results to a CSV file
-    with open('trust_policy_update_results.csv', mode='w', newline='') as file:
-        writer = csv.DictWriter(file, fieldnames=['AccountID', 'RoleName', 'TrustPolicyUpdated'])
-        writer.writeheader()
-        writer.writerows(results)
+    # Write results to the output file
+    with profiler.phase('write'):
+        write_rows(output_file, UPDATE_RESULT_FIELDS, to_rows(results), UPDATE_RESULT_SCHEMA)
     
     # Print final message
-    print("[bright_red]Output saved as trust_policy_update_results.csv")
+    print(f"[bright_red]{role_filter.selected} of {role_filter.listed} listed roles matched the filter")
+    print(f"[bright_red]Output saved as {output_file}")
 
 # Trust relationship policy to be added to every role
 trust_policy = {
@@ -87,6 +95,23 @@ trust_policy = {
     ]
 }
 
-# Add trust relationship to all roles
-add_trust_relationship_to_all_roles(trust_policy)
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Add the trust relationship to every IAM role in the account")
+    parser.add_argument('--output', default='trust_policy_update_results.csv', help="Results file to write, CSV, JSONL or Parquet (default: %(default)s)")
+    add_profile_arguments(parser)
+    add_filter_arguments(parser)
+    add_verify_arguments(parser)
+    args = parser.parse_args()
+    profiler.enable_from_args(args)
+
+    # Add trust relationship to all roles
+    add_trust_relationship_to_all_roles(trust_policy, args.output, role_filter=RoleFilter(args.filter))
+
+    if args.verify:
+        with profiler.phase('verify'):
+            verify_results(args.output, DocumentExpectation(trust_policy), current_account_iam_client, max_wait=args.verify_wait)
+
+    report = profiler.write_report(args.output)
+    if report:
+        print(f"[bright_red]Phase report saved as {report}")
 
@@ -0,0 +1,229 @@
+import json
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from time import time
+from botocore.exceptions import BotoCoreError, ClientError
+from rich.console import Console
+from aws_clients import client
+from role_records import Outcome
+
+# Where the index is cached and how long it stays fresh, in seconds
+ORG_INDEX_FILE = os.environ.get('AWS_AUTOMATION_ORG_INDEX', 'org_index.json')
+ORG_INDEX_TTL = int(os.environ.get('AWS_AUTOMATION_ORG_INDEX_TTL', '3600'))
+
+class OrgIndex:
+    """Snapshot of the organization tree: OUs, accounts, their parents and status
+
+    Account lookups are dictionary lookups; subtree queries only visit the
+    OUs under the selected one.
+    """
+
+    def __init__(self, root_id, ous, accounts, built_at):
+        self.root_id = root_id
+        # {ou_id: {'Name': ..., 'ParentId': ...}}, the root included
+        self.ous = ous
+        # {account_id: {'Name': ..., 'Status': ..., 'ParentId': ...}}
+        self.accounts = accounts
+        self.built_at = built_at
+        self.child_ous = {}
+        self.member_accounts = {}
+        for ou_id, ou in ous.items():
+            if ou['ParentId']:
+                self.child_ous.setdefault(ou['ParentId'], []).append(ou_id)
+        for account_id, account in accounts.items():
+            self.member_accounts.setdefault(account['ParentId'], []).append(account_id)
+        self._paths = {}
+
+    @classmethod
+    def build(cls, org_client=None, max_workers=4):
+        """Walk the whole OU tree, one level at a time with the level's parents listed concurrently"""
+        org_client = org_client or client('organizations')
+        root = org_client.list_roots()['Roots'][0]
+        ous = {root['Id']: {'Name': root['Name'], 'ParentId': None}}
+        accounts = {}
+
+        def list_children(parent_id):
+            child_ous = []
+            for page in org_client.get_paginator('list_organizational_units_for_parent').paginate(ParentId=parent_id):
+                child_ous.extend(page['OrganizationalUnits'])
+            child_accounts = []
+            for page in org_client.get_paginator('list_accounts_for_parent').paginate(ParentId=parent_id):
+                child_accounts.extend(page['Accounts'])
+            return parent_id, child_ous, child_accounts
+
+        level = [root['Id']]
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            while level:
+                next_level = []
+                for parent_id, child_ous, child_accounts in executor.map(list_children, level):
+                    for ou in child_ous:
+                        ous[ou['Id']] = {'Name': ou['Name'], 'ParentId': parent_id}
+                        next_level.append(ou['Id'])
+                    for account in child_accounts:
+                        accounts[account['Id']] = {'Name': account['Name'], 'Status': account['Status'], 'ParentId': parent_id}
+                level = next_level
+        return cls(root['Id'], ous, accounts, time())
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(data['root_id'], data['ous'], data['accounts'], data['built_at'])
+
+    def to_dict(self):
+        return {'root_id': self.root_id, 'built_at': self.built_at, 'ous': self.ous, 'accounts': self.accounts}
+
+    def account(self, account_id):
+        return self.accounts.get(account_id)
+
+    def status(self, account_id):
+        account = self.accounts.get(account_id)
+        return account['Status'] if account else None
+
+    def ou_path(self, ou_id):
+        """Return the OU's path of names from the root, e.g. Root/Workloads/Prod"""
+        if ou_id not in self._paths:
+            ou = self.ous[ou_id]
+            parent = ou['ParentId']
+            self._paths[ou_id] = f"{self.ou_path(parent)}/{ou['Name']}" if parent else ou['Name']
+        return self._paths[ou_id]
+
+    def account_path(self, account_id):
+        account = self.accounts.get(account_id)
+        return self.ou_path(account['ParentId']) if account else None
+
+    def resolve_ou(self, selector):
+        """Resolve an OU or root ID, a name path from the root, or a unique OU name to an ID"""
+        if selector in self.ous:
+            return selector
+        matches = [
+            ou_id for ou_id, ou in self.ous.items()
+            if self.ou_path(ou_id) == selector.strip('/') or ou['Name'] == selector
+        ]
+        if len(matches) != 1:
+            raise ValueError(f"OU selector {selector!r} matches {len(matches)} OUs")
+        return matches[0]
+
+    def accounts_under(self, selector):
+        """Return the IDs of every account in the selected OU and the OUs below it"""
+        stack = [self.resolve_ou(selector)]
+        account_ids = set()
+        while stack:
+            ou_id = stack.pop()
+            account_ids.update(self.member_accounts.get(ou_id, ()))
+            stack.extend(self.child_ous.get(ou_id, ()))
+        return account_ids
+
+def load_index(cache_file=ORG_INDEX_FILE, ttl=ORG_INDEX_TTL, refresh=False):
+    """Return the cached index, rebuilding it from Organizations when missing, stale, unreadable or refresh is set"""
+    if not refresh and os.path.exists(cache_file):
+        try:
+            with open(cache_file, mode='r') as file:
+                index = OrgIndex.from_dict(json.load(file))
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            # A truncated or corrupt cache is treated as stale
+            Console(stderr=True).print(f"[yellow]Ignoring unreadable organization index {cache_file}: {e!r}[/yellow]")
+            index = None
+        if index is not None and time() - index.built_at < ttl:
+            return index
+
+    index = OrgIndex.build()
+    # Replace the cache atomically so concurrent runs never read a partial file
+    temp_file = f"{cache_file}.{os.getpid()}.tmp"
+    with open(temp_file, mode='w') as file:
+        json.dump(index.to_dict(), file)
+    os.replace(temp_file, cache_file)
+    return index
+
+def accounts_in_ous(selectors, refresh=False, index=None):
+    """Return the account IDs under any of the selected OUs, from the given index or the cached one"""
+    index = index or load_index(refresh=refresh)
+    account_ids = set()
+    for selector in selectors:
+        account_ids |= index.accounts_under(selector)
+    return account_ids
+
+def filter_rows(rows, selectors, refresh=False):
+    """Keep only the input rows whose account sits under one of the selected OUs"""
+    if not selectors:
+        return rows
+    account_ids = accounts_in_ous(selectors, refresh)
+    return (row for row in rows if row['AccountID'] in account_ids)
+
+ACCOUNT_STATUS_FIELDS = ['OU ID', 'OU Path', 'Account ID', 'Status']
+
+def account_status_rows(index, selectors=()):
+    """Yield the OU and status of every account, or of those under the selected OUs, ordered by OU path"""
+    account_ids = accounts_in_ous(selectors, index=index) if selectors else set(index.accounts)
+    for account_id in sorted(account_ids, key=lambda account_id: (index.account_path(account_id), account_id)):
+        account = index.account(account_id)
+        yield {
+            'OU ID': account['ParentId'],
+            'OU Path': index.account_path(account_id),
+            'Account ID': account_id,
+            'Status': account['Status'].replace('_', ' ').capitalize(),
+        }
+
+class AccountPrefilter:
+    """Settle roles in suspended, closed or non-member accounts from the org index, with no API calls
+
+    An account missing from a cached index may have joined since it was
+    built, so the first miss rebuilds the index once before any account is
+    reported as not a member.
+    """
+
+    def __init__(self, index, rebuilt=False):
+        self.index = index
+        self.rebuilt = rebuilt
+        self.lock = threading.Lock()
+
+    def _rebuild(self):
+        with self.lock:
+            if self.rebuilt:
+                return
+            self.rebuilt = True
+            try:
+                self.index = load_index(refresh=True)
+            except (BotoCoreError, ClientError) as e:
+                Console(stderr=True).print(f"[yellow]Could not rebuild the organization index, keeping the cached one: {e}[/yellow]")
+
+    def outcome(self, account_id):
+        """Return the skip outcome for an account, or None when it should be processed"""
+        status = self.index.status(account_id)
+        if status is None and not self.rebuilt:
+            self._rebuild()
+            status = self.index.status(account_id)
+        if status is None:
+            return Outcome.NOT_ORG_MEMBER
+        if status != 'ACTIVE':
+            return Outcome.ACCOUNT_INACTIVE
+        return None
+
+    def split(self, rows, skipped):
+        """Yield the rows worth scheduling, appending (row, outcome) for the others to skipped"""
+        for row in rows:
+            outcome = self.outcome(row['AccountID'])
+            if outcome is None:
+                yield row
+            else:
+                skipped.append((row, outcome))
+
+def load_prefilter(enabled=True, refresh=False):
+    """Return an AccountPrefilter, or None when disabled or Organizations cannot be read"""
+    if not enabled:
+        return None
+    try:
+        return AccountPrefilter(load_index(refresh=refresh), rebuilt=refresh)
+    except (BotoCoreError, ClientError) as e:
+        # Member-account credentials cannot read Organizations; run without the prefilter
+        Console(stderr=True).print(f"[yellow]Account status prefilter disabled, could not read the organization: {e}[/yellow]")
+        return None
+
+def add_ou_arguments(parser, prefilter=True, refresh=False):
+    """Add the OU selection arguments; with refresh the index is rebuilt unless --cached-org-index is given"""
+    parser.add_argument('--ou', action='append', default=[], help="Only target accounts under this OU (ID, name path from the root, or unique name); repeatable")
+    if refresh:
+        parser.add_argument('--cached-org-index', dest='refresh_org_index', action='store_false', help=f"Use the cached organization index if it is younger than {ORG_INDEX_TTL} seconds instead of rebuilding it")
+    else:
+        parser.add_argument('--refresh-org-index', action='store_true', help=f"Rebuild the cached organization index even if it is younger than {ORG_INDEX_TTL} seconds")
+    if prefilter:
+        parser.add_argument('--no-account-prefilter', action='store_true', help="Do not skip suspended, closed or non-member accounts using the organization index")
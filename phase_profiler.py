@@ -0,0 +1,130 @@
+import json
+import os
+import sys
+import threading
+from collections import Counter
+from contextlib import contextmanager
+from time import perf_counter, process_time, thread_time
+
+OUTPUT_EXTENSIONS = ('.gz', '.zst', '.csv', '.jsonl', '.ndjson', '.parquet')
+
+def report_base(output_file):
+    """Strip output extensions so reports land next to the output file"""
+    base = output_file
+    while base.endswith(OUTPUT_EXTENSIONS):
+        base = os.path.splitext(base)[0]
+    return base
+
+class PhaseProfiler:
+    """Accumulate wall and CPU time per named phase across threads
+
+    Disabled by default, in which case phase() costs one attribute check.
+    Wall and CPU times are summed over every thread that entered a phase,
+    so with a thread pool they can exceed the run's total wall time.
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.sample = False
+        self.sample_interval = 0.005
+        self.lock = threading.Lock()
+        self.phases = {}
+        self.samples = Counter()
+        self.started = None
+
+    def enable(self, sample=False):
+        self.enabled = True
+        self.sample = sample
+        self.started = (perf_counter(), process_time())
+
+    def enable_from_args(self, args):
+        if args.profile or args.profile_sample:
+            self.enable(sample=args.profile_sample)
+
+    @contextmanager
+    def phase(self, name):
+        if not self.enabled:
+            yield
+            return
+        wall = perf_counter()
+        cpu = thread_time()
+        try:
+            yield
+        finally:
+            wall = perf_counter() - wall
+            cpu = thread_time() - cpu
+            with self.lock:
+                stats = self.phases.setdefault(name, [0, 0.0, 0.0])
+                stats[0] += 1
+                stats[1] += wall
+                stats[2] += cpu
+
+    def timed(self, name, iterable):
+        """Wrap an iterable so time spent producing each item counts towards a phase"""
+        iterator = iter(iterable)
+        while True:
+            with self.phase(name):
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    return
+            yield item
+
+    @contextmanager
+    def sampling(self):
+        """Sample the stacks of every other thread while the hot loop runs"""
+        if not (self.enabled and self.sample):
+            yield
+            return
+        stop = threading.Event()
+        sampler = threading.Thread(target=self._sample, args=(stop,), daemon=True)
+        sampler.start()
+        try:
+            yield
+        finally:
+            stop.set()
+            sampler.join()
+
+    def _sample(self, stop):
+        own_id = threading.get_ident()
+        while not stop.wait(self.sample_interval):
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                    frame = frame.f_back
+                self.samples[';'.join(reversed(stack))] += 1
+
+    def write_report(self, output_file):
+        """Write <output>.profile.json (and .profile.folded stacks when sampling); returns the report path"""
+        if not self.enabled:
+            return None
+        base = report_base(output_file)
+        report = {
+            'command': ' '.join(sys.argv),
+            'wall_seconds': perf_counter() - self.started[0],
+            'cpu_seconds': process_time() - self.started[1],
+            'phases': {
+                name: {'count': count, 'wall_seconds': wall, 'cpu_seconds': cpu}
+                for name, (count, wall, cpu) in sorted(self.phases.items(), key=lambda item: -item[1][1])
+            },
+        }
+        if self.sample:
+            # Collapsed stacks, loadable by flamegraph.pl and speedscope
+            with open(base + '.profile.folded', mode='w') as file:
+                for stack, count in self.samples.most_common():
+                    file.write(f"{stack} {count}\n")
+            report['samples_file'] = base + '.profile.folded'
+        with open(base + '.profile.json', mode='w') as file:
+            json.dump(report, file, indent=2)
+        return base + '.profile.json'
+
+def add_profile_arguments(parser):
+    parser.add_argument('--profile', action='store_true', help="Record wall and CPU time per phase and write a phase report next to the output")
+    parser.add_argument('--profile-sample', action='store_true', help="Like --profile, and also sample stacks of the hot loop")
+
+# Shared by every module of a run
+profiler = PhaseProfiler()
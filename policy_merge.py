@@ -0,0 +1,25 @@
+import hashlib
+import json
+
+# Number of distinct (source policy, mutation) pairs kept in memory by trust_mutations
+MERGE_CACHE_SIZE = 4096
+
+def canonical_json(document):
+    """Serialize a policy document with sorted keys and no whitespace"""
+    return json.dumps(document, sort_keys=True, separators=(',', ':'))
+
+def policy_hash(document):
+    """Return the SHA-256 hex digest of the canonical form of a policy document"""
+    return hashlib.sha256(canonical_json(document).encode('utf-8')).hexdigest()
+
+def merge_statement(current_policy, statement):
+    """Append a statement to a trust policy unless it is already present
+
+    Returns (needs_update, policy_json), leaving current_policy untouched.
+    Not memoized: a cache key would need the document serialized first,
+    which costs more than the merge itself.
+    """
+    statements = current_policy['Statement']
+    if statement in statements:
+        return False, None
+    return True, json.dumps({**current_policy, 'Statement': statements + [statement]})
@@ -1,42 +1,96 @@
-import boto3
+import argparse
+from itertools import chain
 import json
-import csv
 from rich.progress import Progress
 from rich.table import Table
 from rich import print
+from aws_clients import client
+from circuit_breaker import AccountCircuitBreaker, last_error_code
+from dead_letter import RETRY_ROUNDS, DeadLetterStore, add_dead_letter_arguments, retry_failed
+from org_index import add_ou_arguments, filter_rows, load_index, load_prefilter
+from phase_profiler import add_profile_arguments, profiler
+from role_reader import iter_roles, prefetch
+from role_records import Outcome, RoleRecord, to_rows
+from scheduler import AccountScheduler
+from sinks import UPDATE_RESULT_FIELDS, UPDATE_RESULT_SCHEMA, write_rows
 
-def assume_role(account_id, role_name):
-    sts_client = boto3.client('sts')
+def assume_role(account_id, role_name, errors=None):
+    sts_client = client('sts')
     role_arn = f'arn:aws:iam::{account_id}:role/{role_name}'
     
     try:
-        assumed_role_object = sts_client.assume_role(
-            RoleArn=role_arn,
-            RoleSessionName="AssumeRoleSession"
-        )
+        with profiler.phase('sts'):
+            assumed_role_object = sts_client.assume_role(
+                RoleArn=role_arn,
+                RoleSessionName="AssumeRoleSession"
+            )
         credentials = assumed_role_object['Credentials']
         return credentials
     except Exception as e:
         print(f"[bright_red]Error assuming role {role_name} in account {account_id}: {e}")
+        if errors is not None:
+            errors.append(e)
         return None
 
-def add_trust_relationship(iam_client, role_name, trust_policy):
+def add_trust_relationship(iam_client, role_name, trust_policy, errors=None):
+    """Replace the role's trust policy, appending any ClientError to errors"""
+    with profiler.phase('json'):
+        policy_document = json.dumps(trust_policy)
     try:
-        iam_client.update_assume_role_policy(
-            RoleName=role_name,
-            PolicyDocument=json.dumps(trust_policy)
-        )
+        with profiler.phase('update_role'):
+            iam_client.update_assume_role_policy(
+                RoleName=role_name,
+                PolicyDocument=policy_document
+            )
         return True
-    except iam_client.exceptions.UnmodifiableEntityException:
+    except iam_client.exceptions.UnmodifiableEntityException as e:
+        if errors is not None:
+            errors.append(e)
         return False
+    except iam_client.exceptions.ClientError as e:
+        print(f"[bright_red]Error updating role {role_name}: {e}")
+        if errors is not None:
+            errors.append(e)
+        return False
+
+def process_role(role, trust_policy, circuit_breaker):
+    account_id = role['AccountID']
+    role_name = role['RoleName']
+    
+    if role_name.startswith('AWSServiceRole'):
+        return Outcome.PROTECTED_ROLE  # Skip modifying protected roles
+    
+    # Skip accounts whose role assumption keeps failing
+    if not circuit_breaker.allow(account_id):
+        return Outcome.CIRCUIT_OPEN
+    
+    # Assume the role in the target account; the errors behind a failure travel with the row to the dead-letter store
+    errors = role.setdefault('Errors', [])
+    credentials = assume_role(account_id, role_name, errors)
+    if not credentials:
+        circuit_breaker.record_failure(account_id, last_error_code(errors))
+        return Outcome.ASSUME_ROLE_FAILED
+    circuit_breaker.record_success(account_id)
+    
+    with profiler.phase('client'):
+        iam_client = client(
+            'iam',
+            aws_access_key_id=credentials['AccessKeyId'],
+            aws_secret_access_key=credentials['SecretAccessKey'],
+            aws_session_token=credentials['SessionToken']
+        )
+    
+    if add_trust_relationship(iam_client, role_name, trust_policy, errors):
+        return Outcome.UPDATED
+    return Outcome.NOT_UPDATED
 
-def add_trust_relationship_to_roles_from_csv(trust_policy, input_csv):
-    # Read roles and account IDs from the input CSV file
-    roles = []
-    with open(input_csv, mode='r', newline='') as file:
-        reader = csv.DictReader(file)
-        for row in reader:
-            roles.append({'AccountID': row['AccountID'], 'RoleName': row['RoleName']})
+def add_trust_relationship_to_roles_from_csv(trust_policy, input_csv, output_file, max_workers=16, per_account_limit=4, ous=(), prefilter=None, dead_letters=None, retry_rounds=RETRY_ROUNDS):
+    # Stream roles and account IDs from the input file, keeping only the selected OUs
+    roles = prefetch(profiler.timed('read_input', filter_rows(iter_roles(input_csv), ous)))
+    # Roles in suspended, closed or non-member accounts are settled without scheduling them
+    skipped = []
+    if prefilter:
+        roles = prefilter.split(roles, skipped)
     
     table = Table(title="Trust Policy Update Results")
     table.add_column("Account ID")
@@ -44,50 +98,37 @@ def add_trust_relationship_to_roles_from_csv(trust_policy, input_csv):
     table.add_column("Trust Policy Updated", style="cyan")
     
     results = []
+    scheduler = AccountScheduler(max_workers=max_workers, per_account_limit=per_account_limit)
+    circuit_breaker = AccountCircuitBreaker()
     
-    with Progress() as progress:
-        task = progress.add_task("[cyan]Processing...", total=len(roles))
+    with Progress() as progress, profiler.sampling():
+        task = progress.add_task("[cyan]Processing...", total=None)
         
-        # Add trust relationship to each role
-        for role in roles:
-            account_id = role['AccountID']
-            role_name = role['RoleName']
-            
-            if role_name.startswith('AWSServiceRole'):
-                result = {'AccountID': account_id, 'RoleName': role_name, 'TrustPolicyUpdated': 'Skipped (Protected role)'}
-                results.append(result)
+        # Add trust relationship to each role, spreading the work across accounts
+        for role, outcome in chain(scheduler.run(roles, lambda role: process_role(role, trust_policy, circuit_breaker)), skipped):
+            record = RoleRecord(role['AccountID'], role['RoleName'], outcome)
+            results.append(record)
+            if dead_letters:
+                dead_letters.collect(role, outcome, 'document', trust_policy)
+            with profiler.phase('render'):
+                if outcome != Outcome.PROTECTED_ROLE:
+                    table.add_row(record.account_id, record.role_name, outcome.label)
                 progress.update(task, advance=1)
-                continue  # Skip modifying protected roles
-            
-            # Assume the role in the target account
-            credentials = assume_role(account_id, role_name)
-            if credentials:
-                iam_client = boto3.client(
-                    'iam',
-                    aws_access_key_id=credentials['AccessKeyId'],
-                    aws_secret_access_key=credentials['SecretAccessKey'],
-                    aws_session_token=credentials['SessionToken']
-                )
-                
-                if add_trust_relationship(iam_client, role_name, trust_policy):
-                    result = {'AccountID': account_id, 'RoleName': role_name, 'TrustPolicyUpdated': 'True'}
-                else:
-                    result = {'AccountID': account_id, 'RoleName': role_name, 'TrustPolicyUpdated': 'False'}
-            else:
-                result = {'AccountID': account_id, 'RoleName': role_name, 'TrustPolicyUpdated': 'Assume Role Failed'}
-            
-            results.append(result)
-            table.add_row(account_id, role_name, result['TrustPolicyUpdated'])
-            progress.update(task, advance=1)
     
-    print(table)
+    with profiler.phase('render'):
+        print(table)
+    
+    if dead_letters:
+        with profiler.phase('retry'):
+            retry_failed(
+                dead_letters, results, 'document', trust_policy,
+                lambda role, circuit_breaker: process_role(role, trust_policy, circuit_breaker), retry_rounds
+            )
     
-    with open('trust_policy_update_results.csv', mode='w', newline='') as file:
-        writer = csv.DictWriter(file, fieldnames=['AccountID', 'RoleName', 'TrustPolicyUpdated'])
-        writer.writeheader()
-        writer.writerows(results)
+    with profiler.phase('write'):
+        write_rows(output_file, UPDATE_RESULT_FIELDS, to_rows(results), UPDATE_RESULT_SCHEMA)
     
-    print("[bright_red]Output saved as trust_policy_update_results.csv")
+    print(f"[bright_red]Output saved as {output_file}")
 
 trust_policy = {
     "Version": "2012-10-17",
@@ -104,4 +145,24 @@ trust_policy = {
 
 input_csv = 'roles_input.csv'
 
-add_trust_relationship_to_roles_from_csv(trust_policy, input_csv)
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Add the trust relationship to the roles listed in roles_input.csv")
+    parser.add_argument('--output', default='trust_policy_update_results.csv', help="Results file to write, CSV, JSONL or Parquet (default: %(default)s)")
+    add_profile_arguments(parser)
+    add_ou_arguments(parser)
+    add_dead_letter_arguments(parser)
+    args = parser.parse_args()
+    profiler.enable_from_args(args)
+    if args.refresh_org_index:
+        load_index(refresh=True)
+    prefilter = load_prefilter(not args.no_account_prefilter)
+
+    dead_letters = DeadLetterStore(args.dead_letters)
+    try:
+        add_trust_relationship_to_roles_from_csv(trust_policy, input_csv, args.output, ous=args.ou, prefilter=prefilter, dead_letters=dead_letters, retry_rounds=args.retry_rounds)
+    finally:
+        dead_letters.close()
+
+    report = profiler.write_report(args.output)
+    if report:
+        print(f"[bright_red]Phase report saved as {report}")
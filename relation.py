@@ -1,10 +1,10 @@
-import boto3
 import json
 from rich.progress import Progress
 from tqdm import tqdm
+from aws_clients import client
 
 def add_trust_relationship(role_name, trust_policy):
-    iam_client = boto3.client('iam')
+    iam_client = client('iam')
     
     # Update the role's trust relationship policy
     iam_client.update_assume_role_policy(
@@ -13,7 +13,7 @@ def add_trust_relationship(role_name, trust_policy):
     )
 
 def add_trust_relationship_to_all_roles(trust_policy):
-    iam_client = boto3.client('iam')
+    iam_client = client('iam')
     
     # Get a list of all IAM roles
     roles = iam_client.list_roles()['Roles']
@@ -0,0 +1,110 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from botocore.exceptions import BotoCoreError, ClientError
+from rich.console import Console
+from aws_clients import MAX_CONCURRENCY, rate_limiter
+from phase_profiler import profiler
+
+console = Console()
+
+ENRICHMENT_FIELDS = ['Create Date', 'Last Used', 'Last Used Region', 'Tags']
+MISSING_DETAILS = {field: 'N/A' for field in ENRICHMENT_FIELDS}
+# Typed columns for Parquet output; Never and N/A are written as nulls
+ENRICHMENT_SCHEMA = {'Create Date': 'timestamp', 'Last Used': 'timestamp'}
+
+def detail_columns(role):
+    """Turn a role from get_role or an authorization details snapshot into audit columns"""
+    last_used = role.get('RoleLastUsed', {})
+    return {
+        'Create Date': role['CreateDate'].isoformat(),
+        'Last Used': last_used['LastUsedDate'].isoformat() if 'LastUsedDate' in last_used else 'Never',
+        'Last Used Region': last_used.get('Region', 'N/A'),
+        'Tags': ';'.join(f"{tag['Key']}={tag['Value']}" for tag in role.get('Tags', [])),
+    }
+
+class RoleEnricher:
+    """Fetch last-used, creation date and tags for roles in the background
+
+    Starts with one bulk get_account_authorization_details snapshot of the
+    account's roles, which is a handful of paged calls instead of one per
+    role. If the snapshot cannot be read, roles handed to submit()
+    are fetched with get_role on a thread pool under the shared IAM rate
+    limit. columns() blocks only until the requested role's details exist,
+    and a role whose details cannot be fetched gets N/A columns.
+    """
+
+    def __init__(self, iam_client, max_workers=MAX_CONCURRENCY, use_snapshot=True):
+        self.iam_client = iam_client
+        self.executor = ThreadPoolExecutor(max_workers=max_workers)
+        self.limiter = rate_limiter('iam')
+        self.lock = threading.Lock()
+        self.submitted = []
+        self.lookups = {}
+        self.snapshot = self.executor.submit(self._snapshot) if use_snapshot else None
+        if self.snapshot is None:
+            self.fallback = True
+        else:
+            self.fallback = False
+            self.snapshot.add_done_callback(self._snapshot_done)
+
+    def _snapshot(self):
+        roles = {}
+        with profiler.phase('enrich_snapshot'):
+            paginator = self.iam_client.get_paginator('get_account_authorization_details')
+            for page in paginator.paginate(Filter=['Role']):
+                for role in page['RoleDetailList']:
+                    roles[role['RoleName']] = detail_columns(role)
+        return roles
+
+    def _snapshot_done(self, future):
+        if future.cancelled() or future.exception() is None:
+            return
+        # No snapshot access or the snapshot failed: fall back to get_role for everything seen so far
+        console.log(f"[yellow]Role snapshot unavailable ({future.exception()!r}), fetching roles one by one")
+        with self.lock:
+            self.fallback = True
+            pending = list(self.submitted)
+        for role_name in pending:
+            self._lookup(role_name)
+
+    def _get_role(self, role_name):
+        self.limiter.wait()
+        try:
+            with profiler.phase('enrich_get_role'):
+                return detail_columns(self.iam_client.get_role(RoleName=role_name)['Role'])
+        except self.iam_client.exceptions.NoSuchEntityException:
+            return MISSING_DETAILS
+        except (ClientError, BotoCoreError) as e:
+            console.log(f"[red]Could not fetch details of role {role_name}: {e}")
+            return MISSING_DETAILS
+
+    def _lookup(self, role_name):
+        with self.lock:
+            if role_name not in self.lookups:
+                self.lookups[role_name] = self.executor.submit(self._get_role, role_name)
+            return self.lookups[role_name]
+
+    def submit(self, role_name):
+        """Register a role as soon as it is listed, so a get_role fallback starts early"""
+        with self.lock:
+            self.submitted.append(role_name)
+            fallback = self.fallback
+        if fallback:
+            self._lookup(role_name)
+
+    def columns(self, role_name):
+        """Return the enrichment columns for a role, waiting for its details if needed"""
+        if self.snapshot is not None and self.snapshot.exception() is None:
+            # Roles created after the snapshot are looked up directly
+            details = self.snapshot.result().get(role_name)
+            if details is not None:
+                return details
+        try:
+            return self._lookup(role_name).result()
+        except Exception as e:
+            # An enrichment failure leaves the columns empty rather than aborting the report
+            console.log(f"[red]Could not fetch details of role {role_name}: {e!r}")
+            return MISSING_DETAILS
+
+    def close(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
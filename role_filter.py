@@ -0,0 +1,179 @@
+import fnmatch
+import re
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+from rich.console import Console
+from aws_clients import MAX_CONCURRENCY, rate_limiter
+from org_index import accounts_in_ous
+from phase_profiler import profiler
+
+console = Console()
+
+CLAUSE = re.compile(r'^(?P<key>[A-Za-z_]+|tag:[^=!~<>]+)\s*(?:(?P<op>!=|<=|>=|=|~|<|>)\s*(?P<value>.*))?$')
+COMPARISONS = {
+    '<': lambda a, b: a < b,
+    '<=': lambda a, b: a <= b,
+    '>': lambda a, b: a > b,
+    '>=': lambda a, b: a >= b,
+    '=': lambda a, b: a == b,
+    '!=': lambda a, b: a != b,
+}
+
+FILTER_HELP = (
+    "Role filter clause, repeatable and ANDed: path=/prefix/, name=glob, name!=glob, name~regex, "
+    "tag:Key, tag:Key=value, tag:Key!=value, created<2024-01-01 or created<90d (older than 90 days), "
+    "last_used<90d (unused for 90 days, never used included), last_used=never, account=id[,id], ou=selector"
+)
+
+def _parse_time(value):
+    """Parse an ISO date or an age such as 90d into an aware datetime"""
+    if value.endswith('d') and value[:-1].isdigit():
+        return datetime.now(timezone.utc) - timedelta(days=int(value[:-1]))
+    moment = datetime.fromisoformat(value)
+    return moment if moment.tzinfo else moment.replace(tzinfo=timezone.utc)
+
+def _name_matcher(op, value):
+    if op == '~':
+        return re.compile(value).search
+    match = re.compile(fnmatch.translate(value)).match
+    if op == '!=':
+        return lambda name: not match(name)
+    return match
+
+def _tags(role):
+    return {tag['Key']: tag['Value'] for tag in role.get('Tags', [])}
+
+class RoleFilter:
+    """Compiled role selection expression
+
+    Clauses are split by what they need: a path prefix is pushed down to
+    list_roles, account and OU clauses resolve to a set of account IDs,
+    name and creation-date clauses run on the list_roles output, and only
+    roles that pass those are fetched with get_role when a tag or
+    last-used clause needs the full role.
+    """
+
+    def __init__(self, clauses=()):
+        self.path_prefix = None
+        self.accounts = None
+        self.listed_predicates = []
+        self.detail_predicates = []
+        self.listed = 0
+        self.selected = 0
+        for clause in clauses:
+            self._compile(clause)
+
+    def _compile(self, clause):
+        match = CLAUSE.match(clause.strip())
+        if not match:
+            raise ValueError(f"Invalid role filter clause: {clause!r}")
+        key, op, value = match.group('key'), match.group('op'), match.group('value')
+
+        if key == 'path' and op == '=':
+            if self.path_prefix is not None:
+                raise ValueError("Only one path clause is supported")
+            self.path_prefix = value
+        elif key == 'name' and op in ('=', '!=', '~'):
+            matcher = _name_matcher(op, value)
+            self.listed_predicates.append(lambda role: matcher(role['RoleName']))
+        elif key == 'account' and op == '=':
+            self._restrict_accounts(set(value.split(',')))
+        elif key == 'ou' and op == '=':
+            self._restrict_accounts(accounts_in_ous([value]))
+        elif key == 'created' and op in COMPARISONS:
+            compare, moment = COMPARISONS[op], _parse_time(value)
+            self.listed_predicates.append(lambda role: compare(role['CreateDate'], moment))
+        elif key == 'last_used' and op == '=' and value == 'never':
+            self.detail_predicates.append(lambda role: 'LastUsedDate' not in role.get('RoleLastUsed', {}))
+        elif key == 'last_used' and op in ('<', '<='):
+            # Roles that were never used count as unused for any age
+            compare, moment = COMPARISONS[op], _parse_time(value)
+            self.detail_predicates.append(
+                lambda role: 'LastUsedDate' not in role.get('RoleLastUsed', {}) or compare(role['RoleLastUsed']['LastUsedDate'], moment)
+            )
+        elif key == 'last_used' and op in ('>', '>='):
+            compare, moment = COMPARISONS[op], _parse_time(value)
+            self.detail_predicates.append(
+                lambda role: 'LastUsedDate' in role.get('RoleLastUsed', {}) and compare(role['RoleLastUsed']['LastUsedDate'], moment)
+            )
+        elif key.startswith('tag:') and op in (None, '=', '!='):
+            tag_key = key[4:]
+            if op is None:
+                self.detail_predicates.append(lambda role: tag_key in _tags(role))
+            elif op == '=':
+                self.detail_predicates.append(lambda role: _tags(role).get(tag_key) == value)
+            else:
+                self.detail_predicates.append(lambda role: _tags(role).get(tag_key) != value)
+        else:
+            raise ValueError(f"Unsupported role filter clause: {clause!r}")
+
+    def _restrict_accounts(self, account_ids):
+        self.accounts = account_ids if self.accounts is None else self.accounts & account_ids
+
+    @property
+    def needs_details(self):
+        return bool(self.detail_predicates)
+
+    def list_kwargs(self):
+        """Return the list_roles arguments the filter pushes down"""
+        return {'PathPrefix': self.path_prefix} if self.path_prefix else {}
+
+    def allows_account(self, account_id):
+        return self.accounts is None or account_id in self.accounts
+
+    def matches_listed(self, role):
+        """Evaluate every clause that list_roles output can answer"""
+        if not self.allows_account(role['Arn'].split(':')[4]):
+            return False
+        return all(predicate(role) for predicate in self.listed_predicates)
+
+    def matches_details(self, role):
+        """Evaluate the clauses that need the full role from get_role"""
+        return all(predicate(role) for predicate in self.detail_predicates)
+
+    def roles(self, iam_client, max_workers=MAX_CONCURRENCY):
+        """Yield the roles of an account that match, listing with pushdown and fetching details only for survivors"""
+        listed = self._list(iam_client)
+        if not self.needs_details:
+            for role in listed:
+                self.selected += 1
+                yield role
+            return
+
+        limiter = rate_limiter('iam')
+
+        def get_role(role):
+            limiter.wait()
+            try:
+                with profiler.phase('get_role'):
+                    return iam_client.get_role(RoleName=role['RoleName'])['Role']
+            except iam_client.exceptions.NoSuchEntityException:
+                # Deleted between list_roles and get_role
+                console.log(f"[yellow]Role {role['RoleName']} no longer exists, skipping")
+                return None
+
+        # Keep a bounded window of lookups in flight instead of submitting the whole listing up front
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            pending = deque()
+            for listed_role in listed:
+                pending.append(executor.submit(get_role, listed_role))
+                if len(pending) >= max_workers * 2:
+                    yield from self._selected(pending.popleft().result())
+            while pending:
+                yield from self._selected(pending.popleft().result())
+
+    def _selected(self, role):
+        if role is not None and self.matches_details(role):
+            self.selected += 1
+            yield role
+
+    def _list(self, iam_client):
+        for page in iam_client.get_paginator('list_roles').paginate(**self.list_kwargs()):
+            self.listed += len(page['Roles'])
+            for role in page['Roles']:
+                if self.matches_listed(role):
+                    yield role
+
+def add_filter_arguments(parser):
+    parser.add_argument('--filter', action='append', default=[], metavar='CLAUSE', help=FILTER_HELP)
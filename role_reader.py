@@ -0,0 +1,164 @@
+import csv
+import gzip
+import io
+import json
+import os
+import queue
+import threading
+from operator import itemgetter
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+def open_text(file_path):
+    """Open a plain, gzip or zstd compressed file for reading as text"""
+    if file_path.endswith('.gz'):
+        return gzip.open(file_path, mode='rt', newline='')
+    if file_path.endswith(('.zst', '.zstd')):
+        if zstandard is None:
+            raise RuntimeError(f"Reading {file_path} requires the 'zstandard' package")
+        raw = open(file_path, mode='rb')
+        stream = zstandard.ZstdDecompressor().stream_reader(raw, closefd=True)
+        return io.TextIOWrapper(stream, encoding='utf-8', newline='')
+    return open(file_path, mode='r', newline='')
+
+def uncompressed_size(file_path, chunk_size=1024 * 1024):
+    """Return the size of a file's contents once decompressed, streaming through compressed files"""
+    if file_path.endswith('.gz'):
+        raw = gzip.open(file_path, mode='rb')
+    elif file_path.endswith(('.zst', '.zstd')):
+        if zstandard is None:
+            raise RuntimeError(f"Reading {file_path} requires the 'zstandard' package")
+        raw = zstandard.ZstdDecompressor().stream_reader(open(file_path, mode='rb'), closefd=True)
+    else:
+        return os.path.getsize(file_path)
+    size = 0
+    with raw:
+        while True:
+            chunk = raw.read(chunk_size)
+            if not chunk:
+                return size
+            size += len(chunk)
+
+def _base_name(file_path):
+    for suffix in ('.gz', '.zst', '.zstd'):
+        if file_path.endswith(suffix):
+            return file_path[:-len(suffix)]
+    return file_path
+
+def iter_records(file_path):
+    """Lazily yield each row of a CSV, JSONL (optionally compressed) or Parquet file as a dict"""
+    if file_path.endswith('.parquet'):
+        yield from _iter_parquet(file_path)
+        return
+    is_jsonl = _base_name(file_path).endswith(('.jsonl', '.ndjson'))
+    with open_text(file_path) as file:
+        if is_jsonl:
+            for line in file:
+                line = line.strip()
+                if line:
+                    yield json.loads(line)
+        else:
+            yield from csv.DictReader(file)
+
+def _iter_parquet(file_path):
+    # Imported here so that CSV and JSONL runs never pay for pyarrow
+    try:
+        import pyarrow.parquet
+    except ImportError:
+        raise RuntimeError(f"Reading {file_path} requires the 'pyarrow' package")
+    for batch in pyarrow.parquet.ParquetFile(file_path).iter_batches():
+        yield from batch.to_pylist()
+
+def read_header(file_path):
+    """Return the column names of a CSV file, or the keys of a JSONL file's first record"""
+    for record in iter_records(file_path):
+        return list(record)
+    return []
+
+def iter_columns(file_path, columns, default=''):
+    """Lazily yield a tuple of the named columns for each row; CSV rows skip dict construction"""
+    if _base_name(file_path).endswith(('.jsonl', '.ndjson')):
+        for record in iter_records(file_path):
+            yield tuple(str(record.get(column, default)) for column in columns)
+        return
+    with open_text(file_path) as file:
+        reader = csv.reader(file)
+        index = {name: i for i, name in enumerate(next(reader, []))}
+        if all(column in index for column in columns) and len(columns) > 1:
+            picks = [index[column] for column in columns]
+            getter = itemgetter(*picks)
+            width = max(picks) + 1
+            for row in reader:
+                if len(row) < width:
+                    # Ragged row: missing trailing fields read as the default
+                    row += [default] * (width - len(row))
+                yield getter(row)
+        else:
+            picks = [index.get(column) for column in columns]
+            for row in reader:
+                yield tuple(default if i is None or i >= len(row) else row[i] for i in picks)
+
+def iter_roles(file_path, dedupe=True):
+    """Yield {'AccountID', 'RoleName'} targets from a role list in input order
+
+    Duplicates are dropped by remembering every target seen, so memory grows
+    with the number of distinct targets; pass dedupe=False to stream very
+    large inputs that are already unique in constant memory.
+    """
+    seen = set()
+    for line, record in enumerate(iter_records(file_path), start=1):
+        try:
+            key = (str(record['AccountID']).strip(), record['RoleName'].strip())
+        except KeyError as e:
+            raise ValueError(f"{file_path}: record {line} has no {e.args[0]} column, expected AccountID and RoleName") from None
+        if dedupe:
+            if key in seen:
+                continue
+            seen.add(key)
+        yield {'AccountID': key[0], 'RoleName': key[1]}
+
+_DONE = object()
+
+def prefetch(iterable, depth=1000):
+    """Read ahead of the consumer on a background thread, keeping at most depth items buffered
+
+    If the consumer stops early the producer notices within a fraction of a
+    second and exits instead of blocking on the full buffer.
+    """
+    buffer = queue.Queue(maxsize=depth)
+    stop = threading.Event()
+    errors = []
+
+    def put(item):
+        while not stop.is_set():
+            try:
+                buffer.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def producer():
+        try:
+            for item in iterable:
+                if not put(item):
+                    return
+        except Exception as e:
+            errors.append(e)
+        finally:
+            put(_DONE)
+
+    threading.Thread(target=producer, daemon=True).start()
+    try:
+        while True:
+            item = buffer.get()
+            if item is _DONE:
+                break
+            yield item
+    finally:
+        stop.set()
+    if errors:
+        raise errors[0]
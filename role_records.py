@@ -0,0 +1,51 @@
+import sys
+from enum import IntEnum
+
+class Outcome(IntEnum):
+    """Result of a trust policy update for one role"""
+
+    UPDATED = 0
+    NOT_UPDATED = 1
+    ASSUME_ROLE_FAILED = 2
+    PROTECTED_ROLE = 3
+    CIRCUIT_OPEN = 4
+    ACCOUNT_INACTIVE = 5
+    NOT_ORG_MEMBER = 6
+
+    @property
+    def label(self):
+        """Text written to the TrustPolicyUpdated column"""
+        return OUTCOME_LABELS[self]
+
+OUTCOME_LABELS = {
+    Outcome.UPDATED: 'True',
+    Outcome.NOT_UPDATED: 'False',
+    Outcome.ASSUME_ROLE_FAILED: 'Failed to Assume Role',
+    Outcome.PROTECTED_ROLE: 'Skipped (Protected role)',
+    Outcome.CIRCUIT_OPEN: 'Skipped (Account Circuit Open)',
+    Outcome.ACCOUNT_INACTIVE: 'Skipped (Account Suspended or Closed)',
+    Outcome.NOT_ORG_MEMBER: 'Skipped (Not an Organization Member)',
+}
+
+class RoleRecord:
+    """Compact (account, role, outcome) record used in place of per-row dicts
+
+    Account IDs are interned so every record for an account shares one
+    string, and the outcome is a shared enum member.
+    """
+
+    __slots__ = ('account_id', 'role_name', 'outcome')
+
+    def __init__(self, account_id, role_name, outcome=None):
+        self.account_id = sys.intern(account_id)
+        self.role_name = role_name
+        self.outcome = outcome
+
+    def to_row(self):
+        """Return the record as an update results row"""
+        return {'AccountID': self.account_id, 'RoleName': self.role_name, 'TrustPolicyUpdated': self.outcome.label}
+
+def to_rows(records):
+    """Yield results rows for a sink from an iterable of RoleRecords"""
+    for record in records:
+        yield record.to_row()
@@ -0,0 +1,102 @@
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+class AccountScheduler:
+    """Run work items on a thread pool, dispatching fairly across accounts
+
+    Items are queued per account and dispatched round-robin, so a sorted input
+    does not put every worker on one account. weights maps an account ID to
+    the number of items it may dispatch per turn (default 1), and no account
+    ever has more than per_account_limit items in flight. Up to max_pending
+    items are read ahead of the workers; past that, reading continues only
+    while workers would otherwise sit idle behind accounts at their cap, and
+    never beyond max_read_ahead items (10 * max_pending by default).
+    """
+
+    def __init__(self, max_workers=16, per_account_limit=4, weights=None, max_pending=10000, max_read_ahead=None):
+        if max_workers < 1 or per_account_limit < 1:
+            raise ValueError("max_workers and per_account_limit must be at least 1")
+        weights = weights or {}
+        for account, weight in weights.items():
+            if weight < 1:
+                raise ValueError(f"Weight of account {account} must be at least 1, got {weight}")
+        self.max_workers = max_workers
+        self.per_account_limit = per_account_limit
+        self.weights = weights
+        self.max_pending = max_pending
+        self.max_read_ahead = max(max_pending, max_read_ahead if max_read_ahead is not None else max_pending * 10)
+
+    def _fillable(self, queues, ring, in_flight, idle):
+        """Return whether the queued items can occupy idle workers within the per-account caps"""
+        for account in ring:
+            if idle <= 0:
+                break
+            idle -= min(len(queues[account]), self.per_account_limit - in_flight.get(account, 0))
+        return idle <= 0
+
+    def run(self, items, worker, key=lambda item: item['AccountID']):
+        """Yield (item, worker(item)) pairs in completion order"""
+        items = iter(items)
+        queues = {}
+        ring = deque()
+        in_flight = {}
+        futures = {}
+        pending = 0
+        exhausted = False
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            while True:
+                # Read ahead so other accounts are visible to the dispatcher. Past
+                # max_pending, keep reading only while the queued items cannot fill
+                # the idle workers because their accounts are at the in-flight cap,
+                # up to max_read_ahead so one huge account cannot be buffered whole
+                while not exhausted and pending < self.max_read_ahead:
+                    if pending >= self.max_pending and self._fillable(queues, ring, in_flight, self.max_workers - len(futures)):
+                        break
+                    try:
+                        item = next(items)
+                    except StopIteration:
+                        exhausted = True
+                        break
+                    account = key(item)
+                    if account not in queues:
+                        queues[account] = deque()
+                        ring.append(account)
+                    queues[account].append(item)
+                    pending += 1
+
+                # One turn per account, skipping accounts at their in-flight cap
+                skipped = 0
+                while len(futures) < self.max_workers and skipped < len(ring):
+                    account = ring[0]
+                    if in_flight.get(account, 0) >= self.per_account_limit:
+                        ring.rotate(-1)
+                        skipped += 1
+                        continue
+                    queue = queues[account]
+                    for _ in range(self.weights.get(account, 1)):
+                        if not queue or in_flight.get(account, 0) >= self.per_account_limit or len(futures) >= self.max_workers:
+                            break
+                        item = queue.popleft()
+                        futures[executor.submit(worker, item)] = (item, account)
+                        in_flight[account] = in_flight.get(account, 0) + 1
+                        pending -= 1
+                    skipped = 0
+                    if queue:
+                        ring.rotate(-1)
+                    else:
+                        ring.popleft()
+                        del queues[account]
+
+                if not futures:
+                    if exhausted and not pending:
+                        break
+                    continue
+
+                done, _ = wait(futures, return_when=FIRST_COMPLETED)
+                for future in done:
+                    item, account = futures.pop(future)
+                    in_flight[account] -= 1
+                    if not in_flight[account]:
+                        del in_flight[account]
+                    yield item, future.result()
@@ -0,0 +1,135 @@
+import csv
+import gzip
+import json
+from datetime import datetime
+
+# Fields shared by every trust policy updater's results
+UPDATE_RESULT_FIELDS = ['AccountID', 'RoleName', 'TrustPolicyUpdated']
+# Account IDs keep their leading zeros and TrustPolicyUpdated holds outcome labels, so all three stay strings
+UPDATE_RESULT_SCHEMA = {'AccountID': 'string', 'RoleName': 'string', 'TrustPolicyUpdated': 'string'}
+
+class Sink:
+    """Base class giving every sink context manager support"""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+class CsvSink(Sink):
+    """Write rows to a CSV file, one row at a time"""
+
+    def __init__(self, file_path, fieldnames):
+        self.file = open(file_path, mode='w', newline='')
+        self.writer = csv.DictWriter(self.file, fieldnames=fieldnames)
+        self.writer.writeheader()
+
+    def write(self, row):
+        self.writer.writerow(row)
+
+    def close(self):
+        self.file.close()
+
+class JsonlSink(Sink):
+    """Write rows as JSON lines, flushing in batches (gzip compressed for .gz paths)"""
+
+    def __init__(self, file_path, fieldnames, batch_size=10000):
+        if file_path.endswith('.gz'):
+            self.file = gzip.open(file_path, mode='wt')
+        else:
+            self.file = open(file_path, mode='w')
+        self.fieldnames = fieldnames
+        self.batch_size = batch_size
+        self.batch = []
+
+    def write(self, row):
+        self.batch.append(json.dumps({field: row.get(field) for field in self.fieldnames}))
+        if len(self.batch) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        if self.batch:
+            self.file.write('\n'.join(self.batch) + '\n')
+            self.batch = []
+
+    def close(self):
+        self.flush()
+        self.file.close()
+
+def _timestamp(value):
+    """Parse an ISO timestamp column value; markers such as Never or N/A become nulls"""
+    if isinstance(value, str):
+        try:
+            return datetime.fromisoformat(value)
+        except ValueError:
+            return None
+    return value
+
+def _arrow_type(pyarrow, type_name):
+    if type_name == 'timestamp':
+        return pyarrow.timestamp('s', tz='UTC')
+    return {
+        'string': pyarrow.string,
+        'bool': pyarrow.bool_,
+        'int64': pyarrow.int64,
+        'float64': pyarrow.float64,
+    }[type_name]()
+
+class ParquetSink(Sink):
+    """Write rows to a compressed Parquet file with a typed schema, one row group per batch"""
+
+    def __init__(self, file_path, fieldnames, schema=None, batch_size=100000, compression='zstd'):
+        # Imported here so that CSV and JSONL runs never pay for pyarrow
+        try:
+            import pyarrow
+            import pyarrow.parquet
+        except ImportError:
+            raise RuntimeError(f"Writing {file_path} requires the 'pyarrow' package")
+        self.pyarrow = pyarrow
+        schema = schema or {}
+        fields = [pyarrow.field(field, _arrow_type(pyarrow, schema.get(field, 'string'))) for field in fieldnames]
+        self.schema = pyarrow.schema(fields)
+        self.fieldnames = fieldnames
+        self.converters = {field: _timestamp for field in fieldnames if schema.get(field) == 'timestamp'}
+        self.batch_size = batch_size
+        self.columns = {field: [] for field in fieldnames}
+        self.size = 0
+        self.writer = pyarrow.parquet.ParquetWriter(file_path, self.schema, compression=compression)
+
+    def write(self, row):
+        for field in self.fieldnames:
+            value = row.get(field)
+            converter = self.converters.get(field)
+            self.columns[field].append(converter(value) if converter else value)
+        self.size += 1
+        if self.size >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        if self.size:
+            self.writer.write_table(self.pyarrow.table(self.columns, schema=self.schema))
+            self.columns = {field: [] for field in self.fieldnames}
+            self.size = 0
+
+    def close(self):
+        self.flush()
+        self.writer.close()
+
+def open_sink(file_path, fieldnames, schema=None):
+    """Return a sink for file_path chosen by extension (.csv, .jsonl[.gz], .parquet)
+
+    schema optionally maps field names to 'string', 'bool', 'int64',
+    'float64' or 'timestamp' for typed formats; fields default to 'string'.
+    """
+    if file_path.endswith('.parquet'):
+        return ParquetSink(file_path, fieldnames, schema)
+    if file_path.endswith(('.jsonl', '.jsonl.gz', '.ndjson')):
+        return JsonlSink(file_path, fieldnames)
+    return CsvSink(file_path, fieldnames)
+
+def write_rows(file_path, fieldnames, rows, schema=None):
+    """Write an iterable of row dicts to file_path through the matching sink"""
+    with open_sink(file_path, fieldnames, schema) as sink:
+        for row in rows:
+            sink.write(row)
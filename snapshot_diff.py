@@ -0,0 +1,148 @@
+import argparse
+import csv
+import os
+import sys
+import tempfile
+from collections import Counter
+from rich.console import Console
+from rich.table import Table
+from phase_profiler import add_profile_arguments, profiler
+from role_reader import iter_columns, read_header, uncompressed_size
+from sinks import open_sink
+
+console = Console()
+
+# Columns compared by default when present in both snapshots, and the change each one signals
+TRACKED_COLUMNS = {
+    'Creation Method': 'reclassified',
+    'Stack Name or Set ID': 'reclassified',
+    'TrustPolicyUpdated': 'outcome_changed',
+}
+CHANGE_ORDER = ['added', 'removed', 'reclassified', 'outcome_changed', 'changed']
+DIFF_FIELDS = ['AccountID', 'RoleName', 'Change', 'Old', 'New']
+
+# Inputs larger than this, uncompressed, are hash partitioned to disk and joined one partition
+# at a time; the in-memory side of a join takes roughly ten times its uncompressed size
+PARTITION_BYTES = 32 * 1024 * 1024
+MAX_PARTITIONS = 256
+
+def _key_columns(header):
+    # Audit snapshots are per account and have no AccountID column
+    return ['AccountID', 'RoleName' if 'RoleName' in header or 'Role Name' not in header else 'Role Name']
+
+def _rows(file_path, columns):
+    return iter_columns(file_path, _key_columns(read_header(file_path)) + columns)
+
+def _change(columns, old_values, new_values):
+    changes = [TRACKED_COLUMNS.get(column, 'changed') for column, old, new in zip(columns, old_values, new_values) if old != new]
+    return min(changes, key=CHANGE_ORDER.index)
+
+def _join(old_rows, new_rows, columns):
+    """Hash join two snapshots of (AccountID, RoleName, *values) tuples, building on the old side"""
+    old = {row[:2]: row[2:] for row in old_rows}
+    for row in new_rows:
+        key, values = row[:2], row[2:]
+        previous = old.pop(key, None)
+        if previous is None:
+            yield key, 'added', None, values
+        elif previous != values:
+            yield key, _change(columns, previous, values), previous, values
+    for key, values in old.items():
+        yield key, 'removed', values, None
+
+def _partition(rows, directory, name, partitions, batch_size=10000):
+    files = [open(os.path.join(directory, f"{name}.{n}"), mode='w', newline='') for n in range(partitions)]
+    writers = [csv.writer(file) for file in files]
+    batches = [[] for _ in range(partitions)]
+    for row in rows:
+        # Equal keys share a role name, and string hashes are cheaper than tuple hashes
+        n = hash(row[1]) % partitions
+        batch = batches[n]
+        batch.append(row)
+        if len(batch) >= batch_size:
+            writers[n].writerows(batch)
+            batch.clear()
+    for writer, batch, file in zip(writers, batches, files):
+        writer.writerows(batch)
+        file.close()
+
+def _read_partition(path):
+    with open(path, mode='r', newline='') as file:
+        yield from map(tuple, csv.reader(file))
+
+def diff_snapshots(old_file, new_file, columns=None, partitions=None):
+    """Return the compared columns and an iterator of (key, change, old_values, new_values) per differing role
+
+    Small inputs are joined in memory. Larger ones are split into hash
+    partitions on disk first, so memory is bounded by one partition of the
+    old snapshot.
+    """
+    if columns is None:
+        old_header, new_header = read_header(old_file), read_header(new_file)
+        columns = [column for column in TRACKED_COLUMNS if column in old_header and column in new_header]
+    if partitions is None:
+        # Compressed snapshots are sized by their contents, not their size on disk
+        with profiler.phase('size'):
+            size = max(uncompressed_size(old_file), uncompressed_size(new_file))
+        partitions = min(MAX_PARTITIONS, size // PARTITION_BYTES + 1)
+
+    old_rows = _rows(old_file, columns)
+    new_rows = _rows(new_file, columns)
+    if partitions == 1:
+        return columns, _join(old_rows, new_rows, columns)
+    return columns, _partitioned_join(old_rows, new_rows, columns, partitions)
+
+def _partitioned_join(old_rows, new_rows, columns, partitions):
+    with tempfile.TemporaryDirectory(prefix='snapshot_diff_') as directory:
+        with profiler.phase('partition'):
+            _partition(old_rows, directory, 'old', partitions)
+            _partition(new_rows, directory, 'new', partitions)
+        for n in range(partitions):
+            yield from _join(
+                _read_partition(os.path.join(directory, f"old.{n}")),
+                _read_partition(os.path.join(directory, f"new.{n}")),
+                columns
+            )
+
+def main():
+    parser = argparse.ArgumentParser(description="Report roles added, removed, reclassified or with changed outcomes between two snapshots")
+    parser.add_argument('old', help="Earlier audit or update results file (CSV or JSONL, optionally compressed)")
+    parser.add_argument('new', help="Later snapshot of the same kind")
+    parser.add_argument('--output', default='snapshot_diff.csv', help="Where to write one row per changed role")
+    parser.add_argument('--columns', help="Comma separated columns to compare instead of the tracked ones")
+    parser.add_argument('--partitions', type=int, help="Force the number of on-disk hash partitions")
+    parser.add_argument('--fail-on-drift', action='store_true', help="Exit with status 1 when any role changed, for CI")
+    add_profile_arguments(parser)
+    args = parser.parse_args()
+    profiler.enable_from_args(args)
+
+    counts = Counter()
+    columns, changes = diff_snapshots(args.old, args.new, args.columns.split(',') if args.columns else None, args.partitions)
+    with profiler.phase('diff'), open_sink(args.output, DIFF_FIELDS) as sink:
+        for (account_id, role_name), change, old_values, new_values in changes:
+            counts[change] += 1
+            sink.write({
+                'AccountID': account_id,
+                'RoleName': role_name,
+                'Change': change,
+                'Old': ' | '.join(old_values) if old_values is not None else '',
+                'New': ' | '.join(new_values) if new_values is not None else '',
+            })
+
+    table = Table(title=f"Drift between {args.old} and {args.new}")
+    table.add_column("Change")
+    table.add_column("Roles", justify="right", style="cyan")
+    for change in CHANGE_ORDER:
+        table.add_row(change, str(counts[change]))
+    console.print(table)
+    console.print(f"Compared columns: {', '.join(columns) or 'none (presence only)'}")
+    console.print(f"[bold bright_red]Output saved as {args.output}[/bold bright_red]")
+
+    report = profiler.write_report(args.output)
+    if report:
+        console.print(f"[bold bright_red]Phase report saved as {report}[/bold bright_red]")
+    if args.fail_on_drift and sum(counts.values()):
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from botocore.exceptions import ClientError
+from rich.console import Console
+from aws_clients import client
+
+console = Console()
+
+# Role that StackSets deploy through in self-managed target accounts
+EXECUTION_ROLE_NAME = 'AWSCloudFormationStackSetExecutionRole'
+
+def list_stackset_instances(cf_client):
+    """Yield (stackset summary, instance) for every instance of every active StackSet"""
+    for page in cf_client.get_paginator('list_stack_sets').paginate(Status='ACTIVE'):
+        for stackset in page['Summaries']:
+            for instance_page in cf_client.get_paginator('list_stack_instances').paginate(StackSetName=stackset['StackSetName']):
+                for instance in instance_page['Summaries']:
+                    yield stackset, instance
+
+def _target_cf_client(account_id, region, admin_account_id, execution_role_name):
+    if account_id == admin_account_id:
+        return client('cloudformation', region_name=region)
+    credentials = client('sts').assume_role(
+        RoleArn=f"arn:aws:iam::{account_id}:role/{execution_role_name}",
+        RoleSessionName="StackSetRoleAudit"
+    )['Credentials']
+    return client(
+        'cloudformation',
+        region_name=region,
+        aws_access_key_id=credentials['AccessKeyId'],
+        aws_secret_access_key=credentials['SecretAccessKey'],
+        aws_session_token=credentials['SessionToken']
+    )
+
+def _resolve_target(target, instances, admin_account_id, execution_role_name):
+    account_id, region = target
+    roles = {}
+    try:
+        cf_client = _target_cf_client(account_id, region, admin_account_id, execution_role_name)
+        paginator = cf_client.get_paginator('list_stack_resources')
+        for stack_details in instances:
+            for page in paginator.paginate(StackName=stack_details[1]):
+                for resource in page['StackResourceSummaries']:
+                    if resource['ResourceType'] == 'AWS::IAM::Role':
+                        roles[resource['PhysicalResourceId']] = stack_details
+    except ClientError as e:
+        console.log(f"[red]Could not resolve StackSet instances in {account_id}/{region}: {e}")
+    return roles
+
+def resolve_stackset_roles(cf_client, account_id=None, execution_role_name=EXECUTION_ROLE_NAME, max_workers=16):
+    """Map IAM role names in one account to (stackset_name, stack_id) for the StackSet instances deployed there
+
+    Role names are only unique within an account, so only instances in the
+    audited account (the caller's by default) are resolved, grouped by
+    region and concurrently. Another account is read through the
+    self-managed execution role; service-managed StackSets deploy through a
+    per-StackSet role with a generated name, so their instances in another
+    account are skipped with a warning.
+    """
+    admin_account_id = client('sts').get_caller_identity()['Account']
+    account_id = account_id or admin_account_id
+    targets = defaultdict(list)
+    skipped = defaultdict(int)
+    for stackset, instance in list_stackset_instances(cf_client):
+        stackset_name = stackset['StackSetName']
+        if instance['Account'] != account_id:
+            continue
+        if account_id != admin_account_id and stackset.get('PermissionModel') == 'SERVICE_MANAGED':
+            skipped[stackset_name] += 1
+        elif 'StackId' in instance:
+            targets[(instance['Account'], instance['Region'])].append((stackset_name, instance['StackId']))
+        else:
+            console.log(f"[red]No StackId found for instance in StackSet: {stackset_name}")
+    for stackset_name, count in skipped.items():
+        console.log(f"[yellow]Skipped {count} instances of service-managed StackSet {stackset_name} in {account_id}: no known execution role to read them through")
+
+    stackset_roles = {}
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = [
+            executor.submit(_resolve_target, target, instances, admin_account_id, execution_role_name)
+            for target, instances in targets.items()
+        ]
+        for future in futures:
+            for role_name, details in future.result().items():
+                stackset_roles[role_name] = details
+                console.log(f"[magenta]Processing role from CloudFormation StackSet: {role_name}")
+    return stackset_roles
@@ -0,0 +1,278 @@
+import argparse
+import os
+import socket
+import sqlite3
+import threading
+from time import sleep, time
+from rich.console import Console
+from circuit_breaker import AccountCircuitBreaker
+from org_index import add_ou_arguments, filter_rows, load_index, load_prefilter
+from role_reader import iter_roles
+from role_records import Outcome
+from scheduler import AccountScheduler
+from sinks import UPDATE_RESULT_FIELDS, UPDATE_RESULT_SCHEMA, write_rows
+from xpl import new_trust_policy_statement, process_role
+
+console = Console()
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS work_items (
+    account_id TEXT PRIMARY KEY,
+    status TEXT NOT NULL DEFAULT 'pending',
+    lease_owner TEXT,
+    lease_expires REAL,
+    attempts INTEGER NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS roles (
+    account_id TEXT NOT NULL,
+    role_name TEXT NOT NULL,
+    PRIMARY KEY (account_id, role_name)
+);
+CREATE TABLE IF NOT EXISTS results (
+    account_id TEXT NOT NULL,
+    role_name TEXT NOT NULL,
+    outcome INTEGER NOT NULL,
+    worker TEXT NOT NULL,
+    PRIMARY KEY (account_id, role_name)
+);
+"""
+
+def connect(db_path):
+    """Open the shared store; every thread needs its own connection"""
+    conn = sqlite3.connect(db_path, timeout=60, isolation_level=None)
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.executescript(SCHEMA)
+    return conn
+
+def init_sweep(db_path, input_file, batch_size=10000, ous=(), prefilter=None):
+    """Split an input role list into one work item per account
+
+    Roles in accounts the prefilter rules out get their result straight away
+    and never become work items. Running init again on the same store adds
+    the new roles, and puts accounts already done back to pending when any
+    of their roles has no result yet; those accounts are processed in full
+    again, which leaves already updated roles unchanged.
+    """
+    conn = connect(db_path)
+    batch = []
+    skipped = []
+
+    def flush():
+        conn.execute('BEGIN IMMEDIATE')
+        conn.executemany('INSERT OR IGNORE INTO roles VALUES (?, ?)', batch)
+        account_ids = {(account_id,) for account_id, _ in batch}
+        conn.executemany('INSERT OR IGNORE INTO work_items (account_id) VALUES (?)', account_ids)
+        conn.executemany(
+            "UPDATE work_items SET status = 'pending', attempts = 0, lease_owner = NULL, lease_expires = NULL "
+            "WHERE account_id = ? AND status = 'done' AND EXISTS ("
+            "SELECT 1 FROM roles WHERE roles.account_id = work_items.account_id AND NOT EXISTS ("
+            "SELECT 1 FROM results WHERE results.account_id = roles.account_id AND results.role_name = roles.role_name))",
+            account_ids
+        )
+        conn.executemany(
+            'INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?)',
+            [(row['AccountID'], row['RoleName'], int(outcome), 'prefilter') for row, outcome in skipped]
+        )
+        conn.execute('COMMIT')
+        batch.clear()
+        skipped.clear()
+
+    rows = filter_rows(iter_roles(input_file), ous)
+    if prefilter:
+        rows = prefilter.split(rows, skipped)
+    for row in rows:
+        batch.append((row['AccountID'], row['RoleName']))
+        if len(batch) + len(skipped) >= batch_size:
+            flush()
+    if batch or skipped:
+        flush()
+    count = conn.execute('SELECT COUNT(*) FROM work_items').fetchone()[0]
+    conn.close()
+    return count
+
+def claim(conn, worker_id, lease_seconds, max_attempts):
+    """Lease one pending or expired work item, returning its account ID or None
+
+    Items that used up max_attempts without finishing are marked failed
+    instead, so they no longer count as outstanding work.
+    """
+    now = time()
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        conn.execute(
+            "UPDATE work_items SET status = 'failed', lease_owner = NULL, lease_expires = NULL "
+            "WHERE (status = 'pending' OR (status = 'leased' AND lease_expires < ?)) AND attempts >= ?",
+            (now, max_attempts)
+        )
+        row = conn.execute(
+            "SELECT account_id FROM work_items "
+            "WHERE (status = 'pending' OR (status = 'leased' AND lease_expires < ?)) AND attempts < ? "
+            "ORDER BY attempts LIMIT 1",
+            (now, max_attempts)
+        ).fetchone()
+        if row:
+            conn.execute(
+                "UPDATE work_items SET status = 'leased', lease_owner = ?, lease_expires = ?, attempts = attempts + 1 WHERE account_id = ?",
+                (worker_id, now + lease_seconds, row[0])
+            )
+        conn.execute('COMMIT')
+    except Exception:
+        conn.execute('ROLLBACK')
+        raise
+    return row[0] if row else None
+
+def _heartbeat(db_path, account_id, worker_id, lease_seconds, stop):
+    conn = connect(db_path)
+    while not stop.wait(lease_seconds / 3):
+        renewed = conn.execute(
+            "UPDATE work_items SET lease_expires = ? WHERE account_id = ? AND lease_owner = ? AND status = 'leased'",
+            (time() + lease_seconds, account_id, worker_id)
+        ).rowcount
+        if not renewed:
+            console.log(f"[red]Lost the lease on account {account_id}")
+            break
+    conn.close()
+
+def process_account(conn, db_path, account_id, worker_id, lease_seconds, circuit_breaker, per_account_limit):
+    """Update every role of a leased account and record the results"""
+    stop = threading.Event()
+    heartbeat = threading.Thread(target=_heartbeat, args=(db_path, account_id, worker_id, lease_seconds, stop), daemon=True)
+    heartbeat.start()
+    try:
+        roles = [
+            {'AccountID': account_id, 'RoleName': role_name}
+            for (role_name,) in conn.execute('SELECT role_name FROM roles WHERE account_id = ?', (account_id,))
+        ]
+        scheduler = AccountScheduler(max_workers=per_account_limit, per_account_limit=per_account_limit)
+        results = [
+            (account_id, role['RoleName'], int(outcome), worker_id)
+            for role, outcome in scheduler.run(roles, lambda role: process_role(role, new_trust_policy_statement, circuit_breaker))
+        ]
+    finally:
+        stop.set()
+        heartbeat.join()
+
+    conn.execute('BEGIN IMMEDIATE')
+    owner = conn.execute("SELECT lease_owner FROM work_items WHERE account_id = ? AND status = 'leased'", (account_id,)).fetchone()
+    if owner is None or owner[0] != worker_id:
+        # Another worker took over the expired lease; its results win
+        conn.execute('ROLLBACK')
+        console.log(f"[red]{worker_id} lost account {account_id} to another worker, discarding its results")
+        return 0
+    conn.executemany('INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?)', results)
+    conn.execute(
+        "UPDATE work_items SET status = 'done', lease_expires = NULL WHERE account_id = ? AND lease_owner = ?",
+        (account_id, worker_id)
+    )
+    conn.execute('COMMIT')
+    return len(results)
+
+def run_worker(db_path, worker_id, lease_seconds=300, slots=4, per_account_limit=4, max_attempts=5, poll_interval=5, exit_when_idle=True):
+    """Claim and process accounts until no work is left, on slots threads"""
+    circuit_breaker = AccountCircuitBreaker()
+
+    def slot():
+        conn = connect(db_path)
+        while True:
+            account_id = claim(conn, worker_id, lease_seconds, max_attempts)
+            if account_id is None:
+                # Live leases may still come back if their worker dies
+                leased = conn.execute(
+                    "SELECT COUNT(*) FROM work_items WHERE status = 'leased' AND lease_expires >= ?", (time(),)
+                ).fetchone()[0]
+                if exit_when_idle and not leased:
+                    break
+                sleep(poll_interval)
+                continue
+            try:
+                count = process_account(conn, db_path, account_id, worker_id, lease_seconds, circuit_breaker, per_account_limit)
+            except Exception as e:
+                # Release the lease now instead of leaving it held until it expires
+                if conn.in_transaction:
+                    conn.execute('ROLLBACK')
+                conn.execute(
+                    "UPDATE work_items SET status = 'failed', lease_owner = NULL, lease_expires = NULL "
+                    "WHERE account_id = ? AND lease_owner = ? AND status = 'leased'",
+                    (account_id, worker_id)
+                )
+                console.log(f"[bold red]{worker_id} failed on account {account_id}: {e!r}")
+                continue
+            console.log(f"[green]{worker_id} finished account {account_id} ({count} roles)")
+        conn.close()
+
+    threads = [threading.Thread(target=slot) for _ in range(slots)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+def failed_accounts(conn):
+    """Return the accounts that failed or ran out of attempts, with their role counts"""
+    return conn.execute(
+        "SELECT work_items.account_id, COUNT(roles.role_name) FROM work_items "
+        "LEFT JOIN roles ON roles.account_id = work_items.account_id "
+        "WHERE status = 'failed' GROUP BY work_items.account_id ORDER BY work_items.account_id"
+    ).fetchall()
+
+def report_failed(failed):
+    for account_id, roles in failed:
+        console.print(f"[bold red]Account {account_id} failed, {roles} roles have no result[/bold red]")
+
+def merge_results(db_path, output_file):
+    """Write every recorded result to one output file and report the accounts that failed"""
+    conn = connect(db_path)
+    rows = (
+        {'AccountID': account_id, 'RoleName': role_name, 'TrustPolicyUpdated': Outcome(outcome).label}
+        for account_id, role_name, outcome in conn.execute('SELECT account_id, role_name, outcome FROM results ORDER BY account_id, role_name')
+    )
+    write_rows(output_file, UPDATE_RESULT_FIELDS, rows, UPDATE_RESULT_SCHEMA)
+    report_failed(failed_accounts(conn))
+    conn.close()
+
+def sweep_status(db_path):
+    """Return work item counts by status and the failed accounts"""
+    conn = connect(db_path)
+    counts = dict(conn.execute('SELECT status, COUNT(*) FROM work_items GROUP BY status').fetchall())
+    failed = failed_accounts(conn)
+    conn.close()
+    return counts, failed
+
+def main():
+    parser = argparse.ArgumentParser(description="Coordinate a trust policy sweep across worker processes sharing a local SQLite store")
+    parser.add_argument('--db', default='sweep.db', help="Shared SQLite store on a local disk; WAL mode does not work over network filesystems")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    init_parser = commands.add_parser('init', help="Create one work item per account from an input role list")
+    init_parser.add_argument('--input', default='input_roles.csv')
+    add_ou_arguments(init_parser)
+
+    work_parser = commands.add_parser('work', help="Claim and process work items")
+    work_parser.add_argument('--worker-id', default=f"{socket.gethostname()}:{os.getpid()}")
+    work_parser.add_argument('--lease', type=int, default=300, help="Lease length in seconds")
+    work_parser.add_argument('--slots', type=int, default=4, help="Accounts processed at once")
+    work_parser.add_argument('--per-account-limit', type=int, default=4)
+    work_parser.add_argument('--max-attempts', type=int, default=5)
+
+    merge_parser = commands.add_parser('merge', help="Write all results to one output file")
+    merge_parser.add_argument('--output', default='trust_policy_update_results.csv')
+
+    commands.add_parser('status', help="Show work item counts by status")
+    args = parser.parse_args()
+
+    if args.command == 'init':
+        if args.refresh_org_index:
+            load_index(refresh=True)
+        console.log(f"[bold green]{init_sweep(args.db, args.input, ous=args.ou, prefilter=load_prefilter(not args.no_account_prefilter))} accounts queued in {args.db}")
+    elif args.command == 'work':
+        run_worker(args.db, args.worker_id, args.lease, args.slots, args.per_account_limit, args.max_attempts)
+    elif args.command == 'merge':
+        merge_results(args.db, args.output)
+        console.log(f"[bold bright_red]Output saved as {args.output}")
+    else:
+        counts, failed = sweep_status(args.db)
+        for status, count in sorted(counts.items()):
+            console.print(f"{status}: {count}")
+        report_failed(failed)
+
+if __name__ == "__main__":
+    main()
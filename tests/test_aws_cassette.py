@@ -0,0 +1,49 @@
+import datetime
+from urllib.parse import unquote
+import botocore.session
+import pytest
+from aws_cassette import CassetteRecorder, Sanitizer
+
+REAL_IDS = ('767397855823', '012345678901', 'o-vc3105qz5q')
+
+class Response:
+    status_code = 200
+
+def get_role_model():
+    return botocore.session.get_session().get_service_model('iam').operation_model('GetRole')
+
+def test_policy_documents_are_sanitized_before_encoding(tmp_path):
+    path = tmp_path / 'cassette.jsonl'
+    recorder = CassetteRecorder(str(path))
+    document = {
+        'Version': '2012-10-17',
+        'Statement': [{
+            'Effect': 'Deny',
+            'Principal': {'AWS': 'arn:aws:iam::767397855823:root'},
+            'Action': 'sts:AssumeRole',
+            'Condition': {'StringNotEqualsIfExists': {'aws:PrincipalOrgID': 'o-vc3105qz5q', 'aws:PrincipalAccount': '012345678901'}},
+        }],
+    }
+    parsed = {'Role': {
+        'RoleName': 'app', 'Path': '/', 'RoleId': 'AROAEXAMPLE', 'Arn': 'arn:aws:iam::767397855823:role/app',
+        'CreateDate': datetime.datetime(2024, 1, 1), 'AssumeRolePolicyDocument': document,
+    }}
+    recorder._after(Response(), parsed, get_role_model(), {'cassette_params': {'RoleName': 'app'}})
+    recorder.file.close()
+
+    recorded = unquote(path.read_text())
+    for real_id in REAL_IDS:
+        assert real_id not in recorded
+    # The caller's response is left untouched
+    assert parsed['Role']['AssumeRolePolicyDocument'] is document
+
+def test_leaks_are_reported_through_url_quoting():
+    sanitizer = Sanitizer()
+    sanitizer({'Account': '767397855823'})
+    assert sanitizer.leaks('%22012345678901%22 100000000000') == ['012345678901']
+
+def test_recording_fails_on_a_leak(tmp_path, monkeypatch):
+    recorder = CassetteRecorder(str(tmp_path / 'cassette.jsonl'))
+    monkeypatch.setattr(Sanitizer, '__call__', lambda self, value: value)
+    with pytest.raises(ValueError):
+        recorder._after(Response(), {'Role': {'Arn': 'arn:aws:iam::767397855823:role/app'}}, get_role_model(), {})
@@ -0,0 +1,67 @@
+from botocore.exceptions import ClientError
+import pytest
+from dead_letter import CIRCUIT_OPEN_CODE, DeadLetterStore, retry_failed, retry_pass
+from role_records import Outcome, RoleRecord
+
+STATEMENT = {'Effect': 'Deny', 'Principal': {'AWS': '*'}, 'Action': 'sts:AssumeRole'}
+
+def failed_row(role_name, code=None):
+    row = {'AccountID': '111111111111', 'RoleName': role_name}
+    if code:
+        row['Errors'] = [ClientError({'Error': {'Code': code, 'Message': code}}, 'UpdateAssumeRolePolicy')]
+    return row
+
+@pytest.fixture
+def store(tmp_path):
+    store = DeadLetterStore(str(tmp_path / 'dead_letters.db'))
+    yield store
+    store.close()
+
+def test_failures_are_recorded_and_cleared_by_success(store):
+    store.collect(failed_row('a', 'Throttling'), Outcome.NOT_UPDATED, 'statement', STATEMENT)
+    store.collect(failed_row('b', 'MalformedPolicyDocument'), Outcome.NOT_UPDATED, 'statement', STATEMENT)
+    assert [(entry['RoleName'], entry['Retryable']) for entry in store.entries()] == [('a', True), ('b', False)]
+    store.collect(failed_row('a'), Outcome.UPDATED, 'statement', STATEMENT)
+    assert [entry['RoleName'] for entry in store.entries()] == ['b']
+    assert store.entries('statement', {'other': 'payload'}) == []
+
+def test_circuit_open_keeps_the_earlier_error(store):
+    store.collect(failed_row('a', 'MalformedPolicyDocument'), Outcome.NOT_UPDATED, 'statement', STATEMENT)
+    store.collect(failed_row('a'), Outcome.CIRCUIT_OPEN, 'statement', STATEMENT)
+    entry, = store.entries()
+    assert (entry['ErrorCode'], entry['Retryable'], entry['Attempts']) == ('MalformedPolicyDocument', False, 2)
+
+def test_circuit_open_on_its_own_is_retryable(store):
+    store.collect(failed_row('a'), Outcome.CIRCUIT_OPEN, 'statement', STATEMENT)
+    entry, = store.entries(retryable_only=True)
+    assert entry['ErrorCode'] == CIRCUIT_OPEN_CODE
+
+def test_retry_pass_backs_off_until_the_role_recovers(store, monkeypatch):
+    monkeypatch.setattr('dead_letter.sleep', lambda seconds: None)
+    store.collect(failed_row('a', 'Throttling'), Outcome.NOT_UPDATED, 'statement', STATEMENT)
+    attempts = []
+
+    def process(row, circuit_breaker):
+        attempts.append(row['RoleName'])
+        if len(attempts) < 2:
+            row['Errors'] = failed_row('a', 'Throttling')['Errors']
+            return Outcome.NOT_UPDATED
+        return Outcome.UPDATED
+
+    final = retry_pass(store, 'statement', STATEMENT, process, rounds=3, max_workers=1)
+    assert final == {('111111111111', 'a'): Outcome.UPDATED}
+    assert attempts == ['a', 'a']
+    assert store.entries() == []
+
+def test_retry_failed_updates_the_records_of_the_main_pass(store, monkeypatch):
+    monkeypatch.setattr('dead_letter.sleep', lambda seconds: None)
+    store.collect(failed_row('a', 'Throttling'), Outcome.NOT_UPDATED, 'statement', STATEMENT)
+    store.collect(failed_row('b', 'MalformedPolicyDocument'), Outcome.NOT_UPDATED, 'statement', STATEMENT)
+    results = [
+        RoleRecord('111111111111', 'a', Outcome.NOT_UPDATED),
+        RoleRecord('111111111111', 'b', Outcome.NOT_UPDATED),
+        RoleRecord('111111111111', 'c', Outcome.UPDATED),
+    ]
+    retry_failed(store, results, 'statement', STATEMENT, lambda row, circuit_breaker: Outcome.UPDATED, rounds=1)
+    assert [record.outcome for record in results] == [Outcome.UPDATED, Outcome.NOT_UPDATED, Outcome.UPDATED]
+    assert [entry['RoleName'] for entry in store.entries()] == ['b']
@@ -0,0 +1,29 @@
+from time import time
+import org_index
+from org_index import AccountPrefilter, OrgIndex
+from role_records import Outcome
+
+def make_index(accounts):
+    ous = {'r-root': {'Name': 'Root', 'ParentId': None}}
+    return OrgIndex('r-root', ous, {account_id: {'Name': account_id, 'Status': status, 'ParentId': 'r-root'} for account_id, status in accounts.items()}, time())
+
+def test_a_miss_rebuilds_the_index_once_before_reporting_non_members(monkeypatch):
+    builds = []
+
+    def load_index(refresh=False):
+        builds.append(refresh)
+        return make_index({'111111111111': 'ACTIVE', '222222222222': 'ACTIVE'})
+
+    monkeypatch.setattr(org_index, 'load_index', load_index)
+    prefilter = AccountPrefilter(make_index({'111111111111': 'ACTIVE'}))
+    assert prefilter.outcome('111111111111') is None
+    assert builds == []
+    assert prefilter.outcome('222222222222') is None
+    assert prefilter.outcome('333333333333') == Outcome.NOT_ORG_MEMBER
+    assert prefilter.outcome('444444444444') == Outcome.NOT_ORG_MEMBER
+    assert builds == [True]
+
+def test_a_freshly_built_index_is_not_rebuilt(monkeypatch):
+    monkeypatch.setattr(org_index, 'load_index', lambda refresh=False: 1 / 0)
+    prefilter = AccountPrefilter(make_index({}), rebuilt=True)
+    assert prefilter.outcome('111111111111') == Outcome.NOT_ORG_MEMBER
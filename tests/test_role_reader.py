@@ -0,0 +1,15 @@
+import gzip
+from role_reader import iter_columns, uncompressed_size
+
+def test_ragged_rows_read_missing_fields_as_the_default(tmp_path):
+    path = tmp_path / 'roles.csv'
+    path.write_text('AccountID,RoleName,TrustPolicyUpdated\n1,a,True\n2,b\n3\n')
+    assert list(iter_columns(str(path), ['AccountID', 'TrustPolicyUpdated'])) == [('1', 'True'), ('2', ''), ('3', '')]
+    assert list(iter_columns(str(path), ['RoleName', 'Missing'])) == [('a', ''), ('b', ''), ('', '')]
+
+def test_compressed_files_are_sized_by_their_contents(tmp_path):
+    text = 'AccountID,RoleName\n' + '111111111111,role\n' * 1000
+    path = tmp_path / 'roles.csv.gz'
+    with gzip.open(path, mode='wt') as file:
+        file.write(text)
+    assert uncompressed_size(str(path)) == len(text)
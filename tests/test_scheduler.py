@@ -0,0 +1,107 @@
+import threading
+from collections import Counter
+from concurrent.futures import Future
+from time import sleep
+import pytest
+import scheduler as scheduler_module
+from scheduler import AccountScheduler
+
+class InlineExecutor:
+    """Run each submitted item straight away, so the dispatch order is the submission order"""
+
+    def __init__(self, max_workers):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def submit(self, fn, item):
+        future = Future()
+        future.set_result(fn(item))
+        return future
+
+def rows(counts):
+    """Rows sorted by account, the worst case for fairness"""
+    return [{'AccountID': account, 'RoleName': f"role-{i}"} for account, count in counts.items() for i in range(count)]
+
+def dispatch_order(scheduler, items):
+    order = []
+
+    def worker(item):
+        order.append(item['AccountID'])
+        return True
+
+    results = list(scheduler.run(items, worker))
+    assert len(results) == len(items)
+    return order
+
+@pytest.fixture
+def inline(monkeypatch):
+    monkeypatch.setattr(scheduler_module, 'ThreadPoolExecutor', InlineExecutor)
+
+def test_sorted_input_is_interleaved_across_accounts(inline):
+    order = dispatch_order(AccountScheduler(max_workers=8, per_account_limit=4), rows({'a': 3, 'b': 3, 'c': 3}))
+    assert order == ['a', 'b', 'c'] * 3
+
+def test_weights_dispatch_several_items_per_turn(inline):
+    scheduler = AccountScheduler(max_workers=8, per_account_limit=4, weights={'a': 2})
+    order = dispatch_order(scheduler, rows({'a': 4, 'b': 2}))
+    assert order == ['a', 'a', 'b', 'a', 'a', 'b']
+
+@pytest.mark.parametrize('weight', [0, -1])
+def test_weights_below_one_are_rejected(weight):
+    with pytest.raises(ValueError):
+        AccountScheduler(weights={'a': weight})
+
+def test_limits_are_never_exceeded():
+    max_workers, per_account_limit = 6, 2
+    lock = threading.Lock()
+    running = Counter()
+    peak = Counter()
+
+    def worker(item):
+        with lock:
+            running[item['AccountID']] += 1
+            running['total'] += 1
+            peak[item['AccountID']] = max(peak[item['AccountID']], running[item['AccountID']])
+            peak['total'] = max(peak['total'], running['total'])
+        sleep(0.002)
+        with lock:
+            running[item['AccountID']] -= 1
+            running['total'] -= 1
+        return True
+
+    scheduler = AccountScheduler(max_workers=max_workers, per_account_limit=per_account_limit)
+    results = list(scheduler.run(rows({'a': 20, 'b': 20, 'c': 20, 'd': 20}), worker))
+    assert len(results) == 80
+    assert peak.pop('total') <= max_workers
+    assert max(peak.values()) <= per_account_limit
+
+def test_cold_accounts_are_not_starved_by_a_hot_one(inline):
+    # The hot account fills the first max_pending slots; the cold ones must still run early
+    scheduler = AccountScheduler(max_workers=4, per_account_limit=1, max_pending=10, max_read_ahead=1000)
+    order = dispatch_order(scheduler, rows({'hot': 100, 'cold1': 1, 'cold2': 1}))
+    assert order.index('cold1') < 10 and order.index('cold2') < 10
+
+def test_read_ahead_is_capped():
+    read = 0
+    most_buffered = 0
+
+    def items():
+        nonlocal read
+        for item in rows({'hot': 1000}):
+            read += 1
+            yield item
+
+    def worker(item):
+        return True
+
+    done = 0
+    for _ in AccountScheduler(max_workers=4, per_account_limit=1, max_pending=10, max_read_ahead=50).run(items(), worker):
+        done += 1
+        most_buffered = max(most_buffered, read - done)
+    assert done == 1000
+    assert most_buffered <= 50 + 4
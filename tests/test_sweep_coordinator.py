@@ -0,0 +1,84 @@
+import csv
+from time import time
+import pytest
+import sweep_coordinator
+from role_records import Outcome
+from sweep_coordinator import claim, connect, init_sweep, merge_results, process_account, run_worker, sweep_status
+
+def write_input(path, rows):
+    with open(path, mode='w', newline='') as file:
+        writer = csv.writer(file)
+        writer.writerow(['AccountID', 'RoleName'])
+        writer.writerows(rows)
+
+@pytest.fixture
+def updated(monkeypatch):
+    """Every role update succeeds, without calling AWS"""
+    calls = []
+
+    def process_role(row, statement, circuit_breaker):
+        calls.append((row['AccountID'], row['RoleName']))
+        return Outcome.UPDATED
+
+    monkeypatch.setattr(sweep_coordinator, 'process_role', process_role)
+    return calls
+
+@pytest.fixture
+def db(tmp_path):
+    input_file = tmp_path / 'roles.csv'
+    write_input(input_file, [('111111111111', 'a'), ('111111111111', 'b'), ('222222222222', 'c')])
+    path = str(tmp_path / 'sweep.db')
+    assert init_sweep(path, str(input_file)) == 2
+    return path
+
+def test_workers_process_every_account_once(db, updated, tmp_path):
+    run_worker(db, 'w1', slots=2, poll_interval=0.01)
+    assert sorted(updated) == [('111111111111', 'a'), ('111111111111', 'b'), ('222222222222', 'c')]
+    counts, failed = sweep_status(db)
+    assert counts == {'done': 2} and failed == []
+
+    output = tmp_path / 'results.csv'
+    merge_results(db, str(output))
+    with open(output, newline='') as file:
+        assert [row['TrustPolicyUpdated'] for row in csv.DictReader(file)] == ['True'] * 3
+
+def test_exhausted_expired_lease_is_failed_and_workers_exit(db, updated):
+    conn = connect(db)
+    conn.execute("UPDATE work_items SET status = 'leased', lease_owner = 'dead', lease_expires = ?, attempts = 5 WHERE account_id = '111111111111'", (time() - 1,))
+    run_worker(db, 'w1', slots=1, max_attempts=5, poll_interval=0.01)
+    counts, failed = sweep_status(db)
+    assert counts == {'done': 1, 'failed': 1}
+    assert failed == [('111111111111', 2)]
+
+def test_results_of_a_lost_lease_are_discarded(db, updated):
+    conn = connect(db)
+    assert claim(conn, 'w1', 300, 5) is not None
+    account_id = conn.execute("SELECT account_id FROM work_items WHERE status = 'leased'").fetchone()[0]
+    conn.execute("UPDATE work_items SET lease_owner = 'w2' WHERE account_id = ?", (account_id,))
+    assert process_account(conn, db, account_id, 'w1', 300, None, 2) == 0
+    assert conn.execute('SELECT COUNT(*) FROM results').fetchone()[0] == 0
+
+def test_worker_exception_fails_the_account_and_releases_the_lease(db, monkeypatch):
+    def process_role(row, statement, circuit_breaker):
+        if row['AccountID'] == '111111111111':
+            raise RuntimeError('boom')
+        return Outcome.UPDATED
+
+    monkeypatch.setattr(sweep_coordinator, 'process_role', process_role)
+    run_worker(db, 'w1', slots=1, poll_interval=0.01)
+    counts, failed = sweep_status(db)
+    assert counts == {'done': 1, 'failed': 1}
+    assert failed[0][0] == '111111111111'
+
+def test_init_again_requeues_done_accounts_with_new_roles(db, updated, tmp_path):
+    run_worker(db, 'w1', slots=1, poll_interval=0.01)
+    input_file = tmp_path / 'more.csv'
+    write_input(input_file, [('111111111111', 'a'), ('111111111111', 'new'), ('222222222222', 'c')])
+    init_sweep(db, str(input_file))
+    counts, _ = sweep_status(db)
+    assert counts == {'done': 1, 'pending': 1}
+
+    updated.clear()
+    run_worker(db, 'w1', slots=1, poll_interval=0.01)
+    assert ('111111111111', 'new') in updated
+    assert all(account_id == '111111111111' for account_id, _ in updated)
@@ -0,0 +1,38 @@
+import json
+from time import sleep
+from trust_enforcer import FileEventSource
+
+def write_events(path, count):
+    with open(path, mode='w') as file:
+        for n in range(count):
+            file.write(json.dumps({'n': n}) + '\n')
+
+def committed(path):
+    with open(str(path) + '.offset') as file:
+        return int(file.read())
+
+def test_offset_never_passes_an_event_waiting_for_retry(tmp_path):
+    path = tmp_path / 'events.jsonl'
+    write_events(path, 4)
+    source = FileEventSource(str(path), poll_interval=0.01, retry_delay=0.05)
+
+    first, second = source.receive(2, 0)
+    source.ack([first[1]], [second[1]])
+    source.ack([handle for _, handle in source.receive(10, 0)])
+    assert committed(path) == first[1]
+
+    sleep(0.1)
+    redelivered = source.receive(10, 0)
+    assert [event for event, _ in redelivered] == [{'n': 1}]
+    source.ack([handle for _, handle in redelivered])
+    assert committed(path) == path.stat().st_size
+
+def test_restart_reads_the_event_waiting_for_retry_again(tmp_path):
+    path = tmp_path / 'events.jsonl'
+    write_events(path, 3)
+    source = FileEventSource(str(path), poll_interval=0.01)
+    events = source.receive(3, 0)
+    source.ack([events[0][1], events[2][1]], [events[1][1]])
+
+    restarted = FileEventSource(str(path), poll_interval=0.01)
+    assert [event for event, _ in restarted.receive(3, 0)] == [{'n': 1}, {'n': 2}]
@@ -0,0 +1,47 @@
+from types import SimpleNamespace
+from botocore.exceptions import ClientError
+import trust_verify
+from trust_verify import DocumentExpectation, verify_account
+
+DOCUMENT = {'Version': '2012-10-17', 'Statement': []}
+
+class NoSuchEntityException(ClientError):
+    pass
+
+class FakeIAM:
+    exceptions = SimpleNamespace(ClientError=ClientError, NoSuchEntityException=NoSuchEntityException)
+
+    def __init__(self, failing=()):
+        self.failing = set(failing)
+        self.calls = []
+
+    def get_role(self, RoleName):
+        self.calls.append(('get_role', RoleName))
+        if RoleName in self.failing:
+            raise ClientError({'Error': {'Code': 'Throttling'}}, 'GetRole')
+        return {'Role': {'AssumeRolePolicyDocument': DOCUMENT}}
+
+    def get_paginator(self, name):
+        self.calls.append((name, None))
+        roles = [{'RoleName': f"role-{i}", 'AssumeRolePolicyDocument': DOCUMENT} for i in range(100)]
+        return SimpleNamespace(paginate=lambda **kwargs: [{'RoleDetailList': roles}])
+
+def test_few_roles_are_read_with_get_role(monkeypatch):
+    monkeypatch.setattr(trust_verify, 'SNAPSHOT_THRESHOLD', 5)
+    iam = FakeIAM()
+    results = verify_account('111111111111', ['role-0', 'role-1'], DocumentExpectation(DOCUMENT), lambda *args: iam)
+    assert results == {'role-0': (True, 1), 'role-1': (True, 1)}
+    assert [name for name, _ in iam.calls] == ['get_role', 'get_role']
+
+def test_many_roles_are_read_with_a_snapshot(monkeypatch):
+    monkeypatch.setattr(trust_verify, 'SNAPSHOT_THRESHOLD', 5)
+    iam = FakeIAM()
+    role_names = [f"role-{i}" for i in range(10)]
+    results = verify_account('111111111111', role_names, DocumentExpectation(DOCUMENT), lambda *args: iam)
+    assert all(ok for ok, _ in results.values())
+    assert [name for name, _ in iam.calls] == ['get_account_authorization_details']
+
+def test_a_get_role_error_fails_that_role_only():
+    iam = FakeIAM(failing={'role-1'})
+    results = verify_account('111111111111', ['role-0', 'role-1'], DocumentExpectation(DOCUMENT), lambda *args: iam, max_wait=0)
+    assert results == {'role-0': (True, 1), 'role-1': (False, 1)}
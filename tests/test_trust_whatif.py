@@ -0,0 +1,21 @@
+import pytest
+from trust_whatif import CompiledStatement
+
+@pytest.mark.parametrize('principal_type, principal, action', [
+    ('AWS', 'arn:aws:iam::111111111111:role/app', 'sts:AssumeRole'),
+    ('Federated', 'arn:aws:iam::111111111111:oidc-provider/token.actions.githubusercontent.com', 'sts:AssumeRoleWithWebIdentity'),
+    ('Federated', 'arn:aws:iam::111111111111:saml-provider/idp', 'sts:AssumeRoleWithSAML'),
+    ('Service', 'ec2.amazonaws.com', 'sts:AssumeRole'),
+])
+def test_aws_wildcard_matches_every_principal_type(principal_type, principal, action):
+    statement = CompiledStatement({
+        'Effect': 'Deny',
+        'Principal': {'AWS': '*'},
+        'Action': ['sts:AssumeRole', 'sts:AssumeRoleWithWebIdentity', 'sts:AssumeRoleWithSAML'],
+    })
+    assert statement.applies(principal_type, principal, action, {})
+
+def test_an_account_principal_does_not_match_federated_callers():
+    statement = CompiledStatement({'Effect': 'Deny', 'Principal': {'AWS': '111111111111'}, 'Action': 'sts:*'})
+    assert statement.applies('AWS', 'arn:aws:iam::111111111111:role/app', 'sts:AssumeRole', {})
+    assert not statement.applies('Federated', 'arn:aws:iam::111111111111:saml-provider/idp', 'sts:AssumeRoleWithSAML', {})
@@ -0,0 +1,213 @@
+import argparse
+import json
+import os
+from time import monotonic, sleep
+from rich.console import Console
+from aws_clients import client
+from circuit_breaker import AccountCircuitBreaker
+from role_records import Outcome
+from scheduler import AccountScheduler
+from xpl import new_trust_policy_statement, process_role
+
+console = Console()
+
+# IAM API calls that can leave a role without the trust statement
+WATCHED_EVENTS = {'CreateRole', 'UpdateAssumeRolePolicy'}
+# Outcomes whose events are left unacknowledged so they are delivered again
+REDELIVER_OUTCOMES = {Outcome.ASSUME_ROLE_FAILED, Outcome.CIRCUIT_OPEN}
+
+def _decode(body):
+    """Parse an event body, returning None for a malformed one so it can be acknowledged and dropped"""
+    try:
+        return json.loads(body)
+    except ValueError as e:
+        console.log(f"[bold red]Dropping malformed event: {e}: {body[:200]!r}[/bold red]")
+        return None
+
+def parse_event(event):
+    """Return (account_id, role_name) for a successful CreateRole/UpdateAssumeRolePolicy event, or None
+
+    Accepts EventBridge events, SNS-wrapped EventBridge events and raw
+    CloudTrail records.
+    """
+    if 'Message' in event and isinstance(event['Message'], str):
+        event = json.loads(event['Message'])
+    detail = event.get('detail', event)
+    if detail.get('eventName') not in WATCHED_EVENTS or detail.get('errorCode'):
+        return None
+    role_name = (detail.get('requestParameters') or {}).get('roleName')
+    account_id = event.get('account') or detail.get('recipientAccountId')
+    if not role_name or not account_id:
+        return None
+    return account_id, role_name
+
+class SqsEventSource:
+    """Receive IAM events from an SQS queue fed by an EventBridge rule"""
+
+    def __init__(self, queue_url):
+        self.queue_url = queue_url
+        self.sqs_client = client('sqs')
+
+    def receive(self, max_events, window):
+        """Long-poll until max_events arrive or window seconds pass after the first one"""
+        messages = []
+        deadline = None
+        while len(messages) < max_events:
+            wait_seconds = 20 if deadline is None else max(0, int(deadline - monotonic()))
+            response = self.sqs_client.receive_message(
+                QueueUrl=self.queue_url,
+                MaxNumberOfMessages=min(10, max_events - len(messages)),
+                WaitTimeSeconds=wait_seconds
+            )
+            batch = response.get('Messages', [])
+            if batch and deadline is None:
+                deadline = monotonic() + window
+            messages.extend(batch)
+            if not batch and (deadline is not None or window == 0):
+                break
+            if deadline is not None and monotonic() >= deadline:
+                break
+        return [(_decode(message['Body']), message['ReceiptHandle']) for message in messages]
+
+    def ack(self, handles, retry=()):
+        """Delete handled messages; the ones left out reappear after their visibility timeout"""
+        for i in range(0, len(handles), 10):
+            self.sqs_client.delete_message_batch(
+                QueueUrl=self.queue_url,
+                Entries=[{'Id': str(n), 'ReceiptHandle': handle} for n, handle in enumerate(handles[i:i + 10])]
+            )
+
+class FileEventSource:
+    """Tail a JSONL file of events, a local stand-in for the SQS queue
+
+    The read offset is committed to <path>.offset on ack, so a restarted
+    enforcer resumes after the last processed batch. Events left for retry
+    are delivered again after retry_delay seconds, like an SQS visibility
+    timeout, and the committed offset never passes the oldest of them.
+    """
+
+    def __init__(self, file_path, poll_interval=1.0, retry_delay=30.0):
+        self.file_path = file_path
+        self.offset_path = file_path + '.offset'
+        self.poll_interval = poll_interval
+        self.retry_delay = retry_delay
+        self.offset = 0
+        if os.path.exists(self.offset_path):
+            with open(self.offset_path) as file:
+                self.offset = int(file.read().strip() or 0)
+        self.file = open(file_path, mode='r')
+        self.file.seek(self.offset)
+        # Lines of delivered, unacknowledged events and {handle: (line, due)} of events to retry, by end offset
+        self.lines = {}
+        self.retries = {}
+        # Handles acknowledged past a pending retry, committed once it succeeds
+        self.acked = set()
+
+    def _due_retries(self, limit):
+        now = monotonic()
+        events = []
+        for handle in sorted(self.retries):
+            line, due = self.retries[handle]
+            if len(events) >= limit:
+                break
+            if due <= now:
+                # Stays in retries, which holds the offset back, until it is acknowledged
+                self.retries[handle] = (line, float('inf'))
+                self.lines[handle] = line
+                events.append((_decode(line), handle))
+        return events
+
+    def receive(self, max_events, window):
+        events = []
+        deadline = monotonic() + window
+        while len(events) < max_events:
+            events.extend(self._due_retries(max_events - len(events)))
+            if len(events) >= max_events:
+                break
+            position = self.file.tell()
+            line = self.file.readline()
+            if not line.endswith('\n'):
+                # Partial or no line yet: rewind and wait for the writer
+                self.file.seek(position)
+                if events and monotonic() >= deadline:
+                    break
+                if not events and window == 0:
+                    break
+                sleep(self.poll_interval)
+                continue
+            if line.strip():
+                handle = self.file.tell()
+                self.lines[handle] = line
+                events.append((_decode(line), handle))
+        return events
+
+    def ack(self, handles, retry=()):
+        """Commit the offset up to the oldest event still waiting for a retry, so a restart reads it again"""
+        due = monotonic() + self.retry_delay
+        for handle in retry:
+            self.retries[handle] = (self.lines.pop(handle), due)
+        for handle in handles:
+            self.lines.pop(handle, None)
+            self.retries.pop(handle, None)
+            self.acked.add(handle)
+        oldest_retry = min(self.retries, default=None)
+        ready = [handle for handle in self.acked if oldest_retry is None or handle < oldest_retry]
+        if ready:
+            self.acked.difference_update(ready)
+            self.offset = max(ready)
+            with open(self.offset_path, mode='w') as file:
+                file.write(str(self.offset))
+
+def enforce(source, statement, batch_size=50, batch_window=2.0, max_workers=8, per_account_limit=4, once=False):
+    """Apply the trust statement to roles named in incoming events, one batch at a time
+
+    Our own update_assume_role_policy calls raise events too; the merge
+    finds the statement already present, so they cost one get_role and
+    no write.
+    """
+    scheduler = AccountScheduler(max_workers=max_workers, per_account_limit=per_account_limit)
+    circuit_breaker = AccountCircuitBreaker()
+    while True:
+        batch = source.receive(batch_size, 0 if once else batch_window)
+        if not batch:
+            if once:
+                return
+            continue
+
+        targets = {}
+        handles = {}
+        for event, handle in batch:
+            try:
+                target = parse_event(event) if event is not None else None
+            except (ValueError, KeyError, TypeError, AttributeError) as e:
+                console.log(f"[bold red]Dropping event that cannot be parsed: {e!r}[/bold red]")
+                target = None
+            if target:
+                targets[target] = {'AccountID': target[0], 'RoleName': target[1]}
+            handles[handle] = target
+
+        failed = set()
+        for row, outcome in scheduler.run(targets.values(), lambda row: process_role(row, statement, circuit_breaker)):
+            console.log(f"{row['AccountID']} {row['RoleName']}: {outcome.label}")
+            if outcome in REDELIVER_OUTCOMES:
+                failed.add((row['AccountID'], row['RoleName']))
+        retry = [handle for handle, target in handles.items() if target in failed]
+        source.ack([handle for handle, target in handles.items() if target not in failed], retry)
+
+def main():
+    parser = argparse.ArgumentParser(description="Enforce the trust policy statement on roles as they are created or changed")
+    group = parser.add_mutually_exclusive_group(required=True)
+    group.add_argument('--queue-url', help="SQS queue receiving IAM CloudTrail events from EventBridge")
+    group.add_argument('--event-file', help="JSONL file of events to tail instead of SQS")
+    parser.add_argument('--batch-size', type=int, default=50)
+    parser.add_argument('--batch-window', type=float, default=2.0, help="Seconds to wait for a batch to fill")
+    parser.add_argument('--max-workers', type=int, default=8)
+    parser.add_argument('--once', action='store_true', help="Process the events available now and exit")
+    args = parser.parse_args()
+
+    source = SqsEventSource(args.queue_url) if args.queue_url else FileEventSource(args.event_file)
+    console.log("[bold blue]Waiting for IAM role events...")
+    enforce(source, new_trust_policy_statement, args.batch_size, args.batch_window, args.max_workers, once=args.once)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,74 @@
+import json
+from functools import lru_cache
+from policy_merge import MERGE_CACHE_SIZE, canonical_json
+
+OPERATIONS = ('add', 'replace', 'remove')
+
+def _statements(policy):
+    statements = policy.get('Statement', [])
+    return [statements] if isinstance(statements, dict) else list(statements)
+
+def _find(statements, mutation):
+    """Return the index of the statement a mutation targets, by Sid or canonical match"""
+    if 'sid' in mutation:
+        return next((i for i, statement in enumerate(statements) if statement.get('Sid') == mutation['sid']), None)
+    target = canonical_json(mutation['statement'])
+    return next((i for i, statement in enumerate(statements) if canonical_json(statement) == target), None)
+
+@lru_cache(maxsize=MERGE_CACHE_SIZE)
+def _apply_canonical(source_json, mutations_json):
+    policy = json.loads(source_json)
+    statements = _statements(policy)
+    original = list(statements)
+    for mutation in json.loads(mutations_json):
+        index = _find(statements, mutation)
+        if mutation['op'] == 'remove':
+            if index is not None:
+                del statements[index]
+        elif index is None:
+            statements.append(mutation['statement'])
+        elif mutation['op'] == 'replace':
+            statements[index] = mutation['statement']
+    if statements == original:
+        return False, None
+    policy['Statement'] = statements
+    return True, json.dumps(policy)
+
+class TrustSpec:
+    """Ordered trust policy mutations applied to a role in one read and one write
+
+    Each mutation is {'op': 'add' | 'replace' | 'remove', ...} and targets
+    a statement by 'sid' or, without one, by canonical match of
+    'statement'. add appends the statement unless the target exists,
+    replace swaps the target for 'statement' (appending it when missing)
+    and remove drops the target. Results are cached per distinct source
+    document, since matching a target already serializes its statements.
+    """
+
+    def __init__(self, mutations):
+        for mutation in mutations:
+            if mutation.get('op') not in OPERATIONS:
+                raise ValueError(f"Unknown mutation op {mutation.get('op')!r}, expected one of {', '.join(OPERATIONS)}")
+            if mutation['op'] != 'remove' and 'statement' not in mutation:
+                raise ValueError(f"A {mutation['op']} mutation needs a statement")
+            if mutation['op'] == 'add' and 'sid' not in mutation and 'Sid' in mutation['statement']:
+                # Adding a statement whose Sid exists would give the policy duplicate Sids
+                mutation['sid'] = mutation['statement']['Sid']
+            if 'sid' not in mutation and 'statement' not in mutation:
+                raise ValueError("A remove mutation needs a sid or a statement")
+        self.mutations = mutations
+        # Serialized once per run rather than once per role
+        self.key = canonical_json(mutations)
+
+    @classmethod
+    def load(cls, file_path):
+        with open(file_path, mode='r') as file:
+            return cls(json.load(file)['mutations'])
+
+    def apply(self, current_policy):
+        """Return (needs_update, policy_json) for a role's current trust policy"""
+        return _apply_canonical(canonical_json(current_policy), self.key)
+
+def mutation_cache_info():
+    """Return hit/miss statistics for the mutation cache"""
+    return _apply_canonical.cache_info()
@@ -0,0 +1,164 @@
+import argparse
+from itertools import chain
+from rich.progress import Progress
+from rich.table import Table
+from rich.console import Console
+from aws_clients import client
+from circuit_breaker import AccountCircuitBreaker, last_error_code
+from dead_letter import RETRY_ROUNDS, DeadLetterStore, add_dead_letter_arguments, retry_failed
+from org_index import add_ou_arguments, filter_rows, load_index, load_prefilter
+from phase_profiler import add_profile_arguments, profiler
+from role_filter import RoleFilter, add_filter_arguments
+from role_reader import iter_roles, prefetch
+from role_records import Outcome, RoleRecord, to_rows
+from scheduler import AccountScheduler
+from sinks import UPDATE_RESULT_FIELDS, UPDATE_RESULT_SCHEMA, write_rows
+from trust_mutations import TrustSpec
+from xpl import assume_role
+
+console = Console()
+
+def apply_spec(iam_client, role_name, spec, errors=None):
+    """Apply every mutation of the spec with one get_role and at most one update_assume_role_policy"""
+    try:
+        with profiler.phase('get_role'):
+            current_policy = iam_client.get_role(RoleName=role_name)['Role']['AssumeRolePolicyDocument']
+    except iam_client.exceptions.ClientError as e:
+        console.print(f"[bold red]Error getting role {role_name}: {str(e)}[/bold red]")
+        if errors is not None:
+            errors.append(e)
+        return False
+
+    with profiler.phase('merge'):
+        needs_update, policy_document = spec.apply(current_policy)
+    if not needs_update:
+        return True
+    try:
+        with profiler.phase('update_role'):
+            iam_client.update_assume_role_policy(
+                RoleName=role_name,
+                PolicyDocument=policy_document
+            )
+        return True
+    except iam_client.exceptions.ClientError as e:
+        console.print(f"[bold red]Error updating role {role_name}: {str(e)}[/bold red]")
+        if errors is not None:
+            errors.append(e)
+        return False
+
+def process_role(row, spec, circuit_breaker):
+    if row['RoleName'].startswith('AWSServiceRole'):
+        return Outcome.PROTECTED_ROLE
+
+    if not circuit_breaker.allow(row['AccountID']):
+        return Outcome.CIRCUIT_OPEN
+
+    errors = row.setdefault('Errors', [])
+    credentials = assume_role(row['AccountID'], row['RoleName'], errors)
+    if not credentials:
+        circuit_breaker.record_failure(row['AccountID'], last_error_code(errors))
+        return Outcome.ASSUME_ROLE_FAILED
+    circuit_breaker.record_success(row['AccountID'])
+
+    with profiler.phase('client'):
+        iam_client = client(
+            'iam',
+            aws_access_key_id=credentials['AccessKeyId'],
+            aws_secret_access_key=credentials['SecretAccessKey'],
+            aws_session_token=credentials['SessionToken']
+        )
+
+    if apply_spec(iam_client, row['RoleName'], spec, errors):
+        return Outcome.UPDATED
+    return Outcome.NOT_UPDATED
+
+def _run(rows, worker, output_file, spec=None, dead_letters=None, retry_rounds=RETRY_ROUNDS):
+    table = Table(title="Trust Policy Update Results")
+    table.add_column("Account ID")
+    table.add_column("Role Name")
+    table.add_column("Trust Policy Updated", style="cyan")
+
+    results = []
+    with Progress() as progress, profiler.sampling():
+        task = progress.add_task("[cyan]Processing...", total=None)
+        for row, outcome in worker(rows):
+            record = RoleRecord(row['AccountID'], row['RoleName'], outcome)
+            results.append(record)
+            if dead_letters:
+                dead_letters.collect(row, outcome, 'spec', spec.mutations)
+            style = 'bold green' if outcome == Outcome.UPDATED else 'bold red'
+            with profiler.phase('render'):
+                table.add_row(record.account_id, record.role_name, f"[{style}]{outcome.label}[/{style}]")
+                progress.update(task, advance=1)
+
+    with profiler.phase('render'):
+        console.print(table)
+
+    if dead_letters:
+        with profiler.phase('retry'):
+            retry_failed(dead_letters, results, 'spec', spec.mutations, lambda row, circuit_breaker: process_role(row, spec, circuit_breaker), retry_rounds)
+
+    with profiler.phase('write'):
+        write_rows(output_file, UPDATE_RESULT_FIELDS, to_rows(results), UPDATE_RESULT_SCHEMA)
+
+    console.print(f"[bold bright_red]Output saved as {output_file}[/bold bright_red]")
+
+def apply_spec_from_file(spec, input_file, output_file='trust_policy_update_results.csv', max_workers=16, per_account_limit=4, ous=(), prefilter=None, dead_letters=None, retry_rounds=RETRY_ROUNDS):
+    """Apply the spec to the roles listed in an input file, assuming into each account"""
+    rows = prefetch(profiler.timed('read_input', filter_rows(iter_roles(input_file), ous)))
+    skipped = []
+    if prefilter:
+        rows = prefilter.split(rows, skipped)
+    scheduler = AccountScheduler(max_workers=max_workers, per_account_limit=per_account_limit)
+    circuit_breaker = AccountCircuitBreaker()
+    _run(rows, lambda rows: chain(scheduler.run(rows, lambda row: process_role(row, spec, circuit_breaker)), skipped), output_file, spec, dead_letters, retry_rounds)
+
+def apply_spec_to_account(spec, output_file='trust_policy_update_results.csv', role_filter=None, max_workers=16):
+    """Apply the spec to the matching roles of the current account"""
+    iam_client = client('iam')
+    role_filter = role_filter or RoleFilter()
+    rows = (
+        {'AccountID': role['Arn'].split(':')[4], 'RoleName': role['RoleName']}
+        for role in profiler.timed('list_roles', role_filter.roles(iam_client))
+    )
+
+    def worker(row):
+        if row['RoleName'].startswith('AWSServiceRole'):
+            return Outcome.PROTECTED_ROLE
+        return Outcome.UPDATED if apply_spec(iam_client, row['RoleName'], spec) else Outcome.NOT_UPDATED
+
+    scheduler = AccountScheduler(max_workers=max_workers, per_account_limit=max_workers)
+    _run(rows, lambda rows: scheduler.run(rows, worker), output_file)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Apply a declarative set of trust policy mutations to each role in one read and one write")
+    parser.add_argument('spec', help="JSON file with a 'mutations' list, see trust_spec.example.json")
+    target = parser.add_mutually_exclusive_group()
+    target.add_argument('--input', default='input_roles.csv', help="Roles to update across accounts (default: %(default)s)")
+    target.add_argument('--all-roles', action='store_true', help="Update the matching roles of the current account instead")
+    parser.add_argument('--output', default='trust_policy_update_results.csv')
+    add_filter_arguments(parser)
+    add_ou_arguments(parser)
+    add_dead_letter_arguments(parser)
+    add_profile_arguments(parser)
+    args = parser.parse_args()
+    profiler.enable_from_args(args)
+    if args.refresh_org_index:
+        load_index(refresh=True)
+
+    spec = TrustSpec.load(args.spec)
+    if args.all_roles:
+        apply_spec_to_account(spec, args.output, RoleFilter(args.filter))
+    else:
+        dead_letters = DeadLetterStore(args.dead_letters)
+        try:
+            apply_spec_from_file(
+                spec, args.input, args.output, ous=args.ou, prefilter=load_prefilter(not args.no_account_prefilter),
+                dead_letters=dead_letters, retry_rounds=args.retry_rounds
+            )
+        finally:
+            dead_letters.close()
+
+    report = profiler.write_report(args.output)
+    if report:
+        console.print(f"[bold bright_red]Phase report saved as {report}[/bold bright_red]")
@@ -0,0 +1,208 @@
+import argparse
+import json
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from time import sleep
+from rich.console import Console
+from rich.table import Table
+from aws_clients import client, rate_limiter
+from phase_profiler import add_profile_arguments, profiler, report_base
+from policy_merge import policy_hash
+from role_reader import iter_records
+from role_records import Outcome
+from sinks import open_sink
+from trust_mutations import TrustSpec
+
+console = Console()
+
+VERIFY_FIELDS = ['AccountID', 'RoleName', 'Verification', 'Checks']
+
+# Accounts with more unconfirmed roles than this are re-read with a snapshot rather than get_role per role
+SNAPSHOT_THRESHOLD = 25
+
+class StatementExpectation:
+    """The trust policy contains the statement, compared by canonical hash"""
+
+    def __init__(self, statement):
+        self.digest = policy_hash(statement)
+
+    def met(self, document):
+        statements = document.get('Statement', [])
+        if isinstance(statements, dict):
+            statements = [statements]
+        return any(policy_hash(statement) == self.digest for statement in statements)
+
+class DocumentExpectation:
+    """The trust policy is exactly the document, compared by canonical hash"""
+
+    def __init__(self, document):
+        self.digest = policy_hash(document)
+
+    def met(self, document):
+        return policy_hash(document) == self.digest
+
+class SpecExpectation:
+    """Applying the spec to the trust policy would change nothing"""
+
+    def __init__(self, spec):
+        self.spec = spec
+
+    def met(self, document):
+        return not self.spec.apply(document)[0]
+
+def assumed_iam_client(account_id, role_names):
+    """Return an IAM client for the account using the first role the updater could assume"""
+    sts_client = client('sts')
+    for role_name in role_names:
+        try:
+            with profiler.phase('sts'):
+                credentials = sts_client.assume_role(
+                    RoleArn=f"arn:aws:iam::{account_id}:role/{role_name}",
+                    RoleSessionName="VerifyTrustPolicySession"
+                )['Credentials']
+        except sts_client.exceptions.ClientError:
+            continue
+        return client(
+            'iam',
+            aws_access_key_id=credentials['AccessKeyId'],
+            aws_secret_access_key=credentials['SecretAccessKey'],
+            aws_session_token=credentials['SessionToken']
+        )
+    return None
+
+def current_account_iam_client(account_id, role_names):
+    return client('iam')
+
+def _snapshot(iam_client):
+    documents = {}
+    with profiler.phase('verify_snapshot'):
+        for page in iam_client.get_paginator('get_account_authorization_details').paginate(Filter=['Role']):
+            for role in page['RoleDetailList']:
+                documents[role['RoleName']] = role['AssumeRolePolicyDocument']
+    return documents
+
+def _get_documents(iam_client, role_names, limiter):
+    """Read each role's trust policy; a role that cannot be read fails this check and stays pending"""
+    documents = {}
+    for role_name in role_names:
+        limiter.wait()
+        try:
+            with profiler.phase('verify_get_role'):
+                documents[role_name] = iam_client.get_role(RoleName=role_name)['Role']['AssumeRolePolicyDocument']
+        except iam_client.exceptions.NoSuchEntityException:
+            pass
+        except iam_client.exceptions.ClientError as e:
+            console.log(f"[yellow]Could not read {role_name}: {e.response['Error']['Code']}")
+    return documents
+
+def verify_account(account_id, role_names, expectation, iam_client_for, max_wait=120, initial_delay=2):
+    """Return {role_name: (confirmed, checks)} for one account
+
+    Each check reads the roles still pending from one authorization
+    details snapshot while more than SNAPSHOT_THRESHOLD remain, and with
+    get_role per role otherwise. Roles that do not match yet are re-read
+    with exponential backoff until max_wait seconds have passed.
+    """
+    iam_client = iam_client_for(account_id, role_names)
+    if iam_client is None:
+        return {role_name: (False, 0) for role_name in role_names}
+    limiter = rate_limiter('iam')
+    results = {}
+    pending = list(role_names)
+    checks = 0
+    delay = initial_delay
+    waited = 0
+    snapshot_denied = False
+    while True:
+        checks += 1
+        documents = None
+        if len(pending) > SNAPSHOT_THRESHOLD and not snapshot_denied:
+            try:
+                documents = _snapshot(iam_client)
+            except iam_client.exceptions.ClientError:
+                # No snapshot permission in this account: use get_role from now on
+                snapshot_denied = True
+        if documents is None:
+            documents = _get_documents(iam_client, pending, limiter)
+        still_pending = []
+        for role_name in pending:
+            document = documents.get(role_name)
+            if document is not None and expectation.met(document):
+                results[role_name] = (True, checks)
+            else:
+                still_pending.append(role_name)
+        pending = still_pending
+        if not pending or waited >= max_wait:
+            break
+        sleep(delay)
+        waited += delay
+        delay = max(1, min(delay * 2, max_wait - waited))
+    for role_name in pending:
+        results[role_name] = (False, checks)
+    return results
+
+def verify_results(results_file, expectation, iam_client_for=assumed_iam_client, output_file=None, max_workers=16, max_wait=120):
+    """Verify every role an update results file reports as updated and write a verification report"""
+    output_file = output_file or report_base(results_file) + '.verify.csv'
+    accounts = defaultdict(list)
+    updated_label = Outcome.UPDATED.label
+    for row in iter_records(results_file):
+        if row['TrustPolicyUpdated'] == updated_label:
+            accounts[str(row['AccountID'])].append(row['RoleName'])
+
+    confirmed = unconfirmed = 0
+    with ThreadPoolExecutor(max_workers=max_workers) as executor, open_sink(output_file, VERIFY_FIELDS) as sink:
+        futures = {
+            executor.submit(verify_account, account_id, role_names, expectation, iam_client_for, max_wait): account_id
+            for account_id, role_names in accounts.items()
+        }
+        for future, account_id in futures.items():
+            for role_name, (ok, checks) in future.result().items():
+                if ok:
+                    confirmed += 1
+                else:
+                    unconfirmed += 1
+                sink.write({'AccountID': account_id, 'RoleName': role_name, 'Verification': 'Confirmed' if ok else 'Unconfirmed', 'Checks': checks})
+
+    table = Table(title="Trust Policy Verification")
+    table.add_column("Confirmed", style="green", justify="right")
+    table.add_column("Unconfirmed", style="red", justify="right")
+    table.add_row(str(confirmed), str(unconfirmed))
+    console.print(table)
+    console.print(f"[bold bright_red]Verification report saved as {output_file}[/bold bright_red]")
+    return confirmed, unconfirmed
+
+def add_verify_arguments(parser):
+    parser.add_argument('--verify', action='store_true', help="Re-read updated roles afterwards and report which changes have propagated")
+    parser.add_argument('--verify-wait', type=int, default=120, help="Seconds to keep polling unconfirmed roles (default: %(default)s)")
+
+def _load_json(file_path):
+    with open(file_path, mode='r') as file:
+        return json.load(file)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Confirm that trust policy updates in a results file have propagated")
+    parser.add_argument('results', help="Update results file written by xpl.py, prod.py, master.py or trust_spec.py")
+    expected = parser.add_mutually_exclusive_group(required=True)
+    expected.add_argument('--statement', help="JSON file with a statement every updated role must contain")
+    expected.add_argument('--document', help="JSON file with the exact trust policy every updated role must have")
+    expected.add_argument('--spec', help="Mutation spec (as for trust_spec.py) that must already be satisfied")
+    parser.add_argument('--current-account', action='store_true', help="Read roles with the current credentials instead of assuming into each account")
+    parser.add_argument('--output', help="Report path (default: <results>.verify.csv)")
+    parser.add_argument('--max-wait', type=int, default=120, help="Seconds to keep polling unconfirmed roles")
+    add_profile_arguments(parser)
+    args = parser.parse_args()
+    profiler.enable_from_args(args)
+
+    if args.statement:
+        expectation = StatementExpectation(_load_json(args.statement))
+    elif args.document:
+        expectation = DocumentExpectation(_load_json(args.document))
+    else:
+        expectation = SpecExpectation(TrustSpec.load(args.spec))
+    iam_client_for = current_account_iam_client if args.current_account else assumed_iam_client
+    verify_results(args.results, expectation, iam_client_for, args.output, max_wait=args.max_wait)
+
+    report = profiler.write_report(args.output or report_base(args.results) + '.verify.csv')
+    if report:
+        console.print(f"[bold bright_red]Phase report saved as {report}[/bold bright_red]")
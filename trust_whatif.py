@@ -0,0 +1,308 @@
+import argparse
+import fnmatch
+import json
+import re
+from collections import Counter
+from urllib.parse import unquote
+from botocore.exceptions import BotoCoreError, ClientError
+from rich.console import Console
+from rich.table import Table
+from aws_clients import client
+from org_index import load_index
+from phase_profiler import add_profile_arguments, profiler, report_base
+from policy_merge import canonical_json, policy_hash
+from role_reader import iter_records
+from sinks import open_sink
+from xpl import new_trust_policy_statement
+
+console = Console()
+
+SNAPSHOT_FIELDS = ['AccountID', 'RoleName', 'AssumeRolePolicyDocument']
+WHATIF_FIELDS = ['AccountID', 'RoleName', 'BlockedPrincipals', 'BlockedCandidates']
+PRINCIPAL_FIELDS = ['PrincipalType', 'Principal', 'Action', 'Roles']
+
+ACCOUNT_IN_PRINCIPAL = re.compile(r'^(?:arn:aws[\w-]*:(?:iam|sts)::)?(\d{12})(?::|$)')
+
+def principal_context(principal_type, principal, org_accounts=None, org_id=None):
+    """Build the condition context a request from this principal would carry"""
+    context = {}
+    if principal_type == 'AWS':
+        match = ACCOUNT_IN_PRINCIPAL.match(principal)
+        if match:
+            context['aws:PrincipalAccount'] = match.group(1)
+            if org_accounts is not None and org_id and match.group(1) in org_accounts:
+                context['aws:PrincipalOrgID'] = org_id
+        context['aws:PrincipalArn'] = principal
+        context['aws:PrincipalIsAWSService'] = 'false'
+    elif principal_type == 'Service':
+        context['aws:PrincipalIsAWSService'] = 'true'
+        context['aws:PrincipalServiceName'] = principal
+    return context
+
+def _values(value):
+    return [value] if not isinstance(value, list) else value
+
+def _string(value):
+    return str(value).lower() if isinstance(value, bool) else str(value)
+
+def _like(values):
+    patterns = [re.compile(fnmatch.translate(value)) for value in values]
+    return lambda actual: any(pattern.match(actual) for pattern in patterns)
+
+# Base operator -> (builds a test of one context value, negated)
+OPERATORS = {
+    'StringEquals': (lambda values: set(values).__contains__, False),
+    'StringNotEquals': (lambda values: lambda actual: actual not in values, True),
+    'StringEqualsIgnoreCase': (lambda values: lambda actual: actual.lower() in {v.lower() for v in values}, False),
+    'StringNotEqualsIgnoreCase': (lambda values: lambda actual: actual.lower() not in {v.lower() for v in values}, True),
+    'StringLike': (_like, False),
+    'StringNotLike': (lambda values: (lambda like: lambda actual: not like(actual))(_like(values)), True),
+    'ArnEquals': (lambda values: set(values).__contains__, False),
+    'ArnLike': (_like, False),
+    'ArnNotEquals': (lambda values: lambda actual: actual not in values, True),
+    'ArnNotLike': (lambda values: (lambda like: lambda actual: not like(actual))(_like(values)), True),
+    'Bool': (lambda values: {v.lower() for v in values}.__contains__, False),
+}
+
+def compile_condition(condition):
+    """Compile a statement's Condition block into one predicate over a context dict"""
+    checks = []
+    for operator, keys in (condition or {}).items():
+        if operator == 'Null':
+            for key, value in keys.items():
+                expect_absent = _string(_values(value)[0]).lower() == 'true'
+                checks.append(lambda context, key=key, expect_absent=expect_absent: (key not in context) == expect_absent)
+            continue
+        if_exists = operator.endswith('IfExists')
+        base = operator[:-len('IfExists')] if if_exists else operator
+        if base not in OPERATORS:
+            raise ValueError(f"Unsupported condition operator {operator}")
+        build, negated = OPERATORS[base]
+        for key, values in keys.items():
+            test = build([_string(value) for value in _values(values)])
+            # A missing key satisfies IfExists and negated operators, and fails the rest
+            missing = if_exists or negated
+            checks.append(lambda context, key=key, test=test, missing=missing: test(context[key]) if key in context else missing)
+    return lambda context: all(check(context) for check in checks)
+
+def _compile_actions(actions):
+    patterns = [re.compile(fnmatch.translate(action.lower())) for action in _values(actions)]
+    return lambda action: any(pattern.match(action.lower()) for pattern in patterns)
+
+def _compile_principal(principal):
+    # In a trust policy {"AWS": "*"} means the same as "*": every principal, federated and service ones included
+    if principal == '*' or '*' in _values(principal.get('AWS', [])):
+        return lambda principal_type, value: True
+    allowed = {}
+    for principal_type, values in principal.items():
+        allowed[principal_type] = set(_values(values))
+    def matches(principal_type, value):
+        values = allowed.get(principal_type, ())
+        if '*' in values:
+            return True
+        if value in values:
+            return True
+        match = ACCOUNT_IN_PRINCIPAL.match(value) if principal_type == 'AWS' else None
+        # An account or its root ARN covers every principal in the account
+        return bool(match) and (match.group(1) in values or f"arn:aws:iam::{match.group(1)}:root" in values)
+    return matches
+
+class CompiledStatement:
+    """A policy statement with its principal, action and condition matchers compiled once"""
+
+    def __init__(self, statement):
+        if 'NotPrincipal' in statement or 'NotAction' in statement:
+            raise ValueError("NotPrincipal and NotAction statements are not supported")
+        self.effect = statement['Effect']
+        self.principal = _compile_principal(statement.get('Principal', '*'))
+        self.action = _compile_actions(statement.get('Action', '*'))
+        self.condition = compile_condition(statement.get('Condition'))
+
+    def applies(self, principal_type, principal, action, context):
+        return self.principal(principal_type, principal) and self.action(action) and self.condition(context)
+
+def trusted_principals(document):
+    """Return the (principal type, principal, action) triples a trust policy allows"""
+    triples = set()
+    statements = document.get('Statement', [])
+    for statement in [statements] if isinstance(statements, dict) else statements:
+        if statement.get('Effect') != 'Allow' or 'Principal' not in statement:
+            continue
+        principal = statement['Principal']
+        principal = {'AWS': '*'} if principal == '*' else principal
+        for action in _values(statement.get('Action', [])):
+            for principal_type, values in principal.items():
+                for value in _values(values):
+                    triples.add((principal_type, value, action))
+    return frozenset(triples)
+
+def _document(value):
+    if isinstance(value, dict):
+        return value
+    value = value.strip()
+    return json.loads(value if value.startswith('{') else unquote(value))
+
+class WhatIf:
+    """Evaluate a Deny statement against the trusted principals of every role in snapshots
+
+    Every distinct trust document is parsed once and every distinct trusted
+    principal is evaluated against the compiled statement once, so the cost
+    follows the number of distinct documents and principals rather than
+    roles x principals.
+    """
+
+    def __init__(self, deny_statement, org_accounts=None, org_id=None, candidates=()):
+        self.deny = CompiledStatement(deny_statement)
+        self.org_accounts = org_accounts
+        self.org_id = org_id
+        # Trust document -> (blocked trusted principals, blocked candidates), computed once per distinct document
+        self.documents = {}
+        self.document_roles = Counter()
+        self.verdicts = {}
+        self.roles = 0
+        # Extra principals to test against every role; only the ones the statement denies can matter
+        self.candidates = [triple for triple in candidates if self._blocked(triple)]
+
+    def _blocked(self, triple):
+        verdict = self.verdicts.get(triple)
+        if verdict is None:
+            principal_type, principal, action = triple
+            context = principal_context(principal_type, principal, self.org_accounts, self.org_id)
+            verdict = self.verdicts[triple] = self.deny.applies(principal_type, principal, action, context)
+        return verdict
+
+    def _evaluate_document(self, document):
+        blocked = sorted(triple for triple in trusted_principals(document) if self._blocked(triple))
+        candidates = ()
+        if self.candidates:
+            statements = document.get('Statement', [])
+            allows = [
+                CompiledStatement(statement)
+                for statement in ([statements] if isinstance(statements, dict) else statements)
+                if statement.get('Effect') == 'Allow' and 'Principal' in statement
+            ]
+            candidates = tuple(
+                triple for triple in self.candidates
+                if any(allow.principal(triple[0], triple[1]) and allow.action(triple[2]) for allow in allows)
+            )
+        return tuple(blocked), candidates
+
+    def evaluate(self, snapshot_file):
+        """Yield (account_id, role_name, blocked trusted triples, blocked candidate triples) per role"""
+        for row in iter_records(snapshot_file):
+            self.roles += 1
+            raw = row['AssumeRolePolicyDocument']
+            key = raw if isinstance(raw, str) else canonical_json(raw)
+            result = self.documents.get(key)
+            if result is None:
+                result = self.documents[key] = self._evaluate_document(_document(raw))
+            self.document_roles[key] += 1
+            yield str(row['AccountID']), row['RoleName'], result[0], result[1]
+
+    def principal_totals(self):
+        """Return how many evaluated roles each blocked principal could no longer assume"""
+        totals = Counter()
+        for key, roles in self.document_roles.items():
+            blocked, candidates = self.documents[key]
+            for triple in blocked + candidates:
+                totals[triple] += roles
+        return totals
+
+def capture_snapshot(output_file):
+    """Write the current account's roles and trust policies to a snapshot file"""
+    iam_client = client('iam')
+    with open_sink(output_file, SNAPSHOT_FIELDS) as sink:
+        for page in iam_client.get_paginator('get_account_authorization_details').paginate(Filter=['Role']):
+            for role in page['RoleDetailList']:
+                sink.write({
+                    'AccountID': role['Arn'].split(':')[4],
+                    'RoleName': role['RoleName'],
+                    'AssumeRolePolicyDocument': canonical_json(role['AssumeRolePolicyDocument']),
+                })
+
+def load_candidates(file_path):
+    """Read extra principals to test from a CSV or JSONL file with PrincipalType, Principal and optional Action"""
+    return [
+        (row['PrincipalType'], row['Principal'], row.get('Action') or 'sts:AssumeRole')
+        for row in iter_records(file_path)
+    ]
+
+def _org_membership():
+    try:
+        return set(load_index().accounts)
+    except (BotoCoreError, ClientError) as e:
+        console.print(f"[yellow]Organization membership unavailable, treating every account as outside the organization: {e}[/yellow]")
+        return None
+
+def main():
+    parser = argparse.ArgumentParser(description="Find trusted principals a Deny trust statement would block, offline")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    capture_parser = commands.add_parser('capture', help="Snapshot the current account's role trust policies")
+    capture_parser.add_argument('--output', default='trust_snapshot.jsonl')
+
+    run_parser = commands.add_parser('run', help="Evaluate a Deny statement against a snapshot")
+    run_parser.add_argument('snapshot', nargs='+', help="Snapshot files with AccountID, RoleName and AssumeRolePolicyDocument")
+    run_parser.add_argument('--statement', help="JSON file with the Deny statement (default: xpl.py's perimeter statement)")
+    run_parser.add_argument('--org-id', help="Organization ID of member accounts (default: the statement's aws:PrincipalOrgID)")
+    run_parser.add_argument('--principals', help="CSV or JSONL of extra candidate principals (PrincipalType, Principal, Action) to test against every role")
+    run_parser.add_argument('--output', default='trust_whatif.csv', help="One row per role that would lose a trusted principal")
+    add_profile_arguments(run_parser)
+    args = parser.parse_args()
+
+    if args.command == 'capture':
+        capture_snapshot(args.output)
+        console.print(f"[bold bright_red]Snapshot saved as {args.output}[/bold bright_red]")
+        return
+
+    profiler.enable_from_args(args)
+    if args.statement:
+        with open(args.statement, mode='r') as file:
+            deny_statement = json.load(file)
+    else:
+        deny_statement = new_trust_policy_statement
+    org_id = args.org_id
+    if org_id is None:
+        for operator, keys in deny_statement.get('Condition', {}).items():
+            if isinstance(keys.get('aws:PrincipalOrgID'), str):
+                org_id = keys['aws:PrincipalOrgID']
+    with profiler.phase('org_index'):
+        org_accounts = _org_membership()
+
+    candidates = load_candidates(args.principals) if args.principals else ()
+    whatif = WhatIf(deny_statement, org_accounts, org_id, candidates)
+    affected = 0
+    labels = {}
+    with profiler.phase('evaluate'), open_sink(args.output, WHATIF_FIELDS) as sink:
+        for snapshot in args.snapshot:
+            for account_id, role_name, blocked, candidates in whatif.evaluate(snapshot):
+                if not (blocked or candidates):
+                    continue
+                affected += 1
+                if blocked not in labels:
+                    labels[blocked] = '; '.join(f"{principal_type}:{principal} ({action})" for principal_type, principal, action in blocked)
+                sink.write({'AccountID': account_id, 'RoleName': role_name, 'BlockedPrincipals': labels[blocked], 'BlockedCandidates': len(candidates)})
+
+    principals_file = report_base(args.output) + '.principals.csv'
+    with profiler.phase('write'), open_sink(principals_file, PRINCIPAL_FIELDS) as sink:
+        for (principal_type, principal, action), roles in whatif.principal_totals().most_common():
+            sink.write({'PrincipalType': principal_type, 'Principal': principal, 'Action': action, 'Roles': roles})
+
+    table = Table(title=f"What-if: {policy_hash(deny_statement)[:12]}")
+    table.add_column("Measure")
+    table.add_column("Count", justify="right", style="cyan")
+    table.add_row("Roles evaluated", str(whatif.roles))
+    table.add_row("Distinct trust documents", str(len(whatif.documents)))
+    table.add_row("Distinct trusted principals", str(len(whatif.verdicts)))
+    table.add_row("Principals that would be blocked", str(sum(whatif.verdicts.values())))
+    table.add_row("Candidate principals the statement denies", str(len(whatif.candidates)))
+    table.add_row("Roles with a blocked principal", str(affected))
+    console.print(table)
+    console.print(f"[bold bright_red]Output saved as {args.output}, blocked principals in {principals_file}[/bold bright_red]")
+
+    report = profiler.write_report(args.output)
+    if report:
+        console.print(f"[bold bright_red]Phase report saved as {report}[/bold bright_red]")
+
+if __name__ == "__main__":
+    main()
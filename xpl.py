@@ -1,58 +1,114 @@
-import boto3
-import json
-import csv
+import argparse
+from itertools import chain
 from rich.progress import Progress
 from rich.table import Table
 from rich import print
 from rich.console import Console
 from time import time
+from aws_clients import client
+from circuit_breaker import AccountCircuitBreaker, last_error_code
+from dead_letter import RETRY_ROUNDS, DeadLetterStore, add_dead_letter_arguments, retry_failed
+from org_index import add_ou_arguments, filter_rows, load_index, load_prefilter
+from phase_profiler import add_profile_arguments, profiler
+from policy_merge import merge_statement
+from role_reader import iter_roles, prefetch
+from role_records import Outcome, RoleRecord, to_rows
+from scheduler import AccountScheduler
+from sinks import UPDATE_RESULT_FIELDS, UPDATE_RESULT_SCHEMA, write_rows
+from trust_verify import StatementExpectation, add_verify_arguments, verify_results
 
 console = Console()
 
-def assume_role(account_id, role_name):
-    sts_client = boto3.client('sts')
+def assume_role(account_id, role_name, errors=None):
+    sts_client = client('sts')
     role_arn = f"arn:aws:iam::{account_id}:role/{role_name}"
     try:
-        assumed_role = sts_client.assume_role(
-            RoleArn=role_arn,
-            RoleSessionName="AssumeRoleSession"
-        )
+        with profiler.phase('sts'):
+            assumed_role = sts_client.assume_role(
+                RoleArn=role_arn,
+                RoleSessionName="AssumeRoleSession"
+            )
         return assumed_role['Credentials']
     except sts_client.exceptions.ClientError as e:
         console.print(f"[bold red]Failed to assume role {role_name} in account {account_id}: {str(e)}[/bold red]")
+        if errors is not None:
+            errors.append(e)
         return None
 
-def update_trust_policy(iam_client, role_name, new_trust_policy_statement):
+def update_trust_policy(iam_client, role_name, new_trust_policy_statement, errors=None):
+    """Merge the statement into the role's trust policy, appending any ClientError to errors"""
     try:
-        current_policy = iam_client.get_role(RoleName=role_name)['Role']['AssumeRolePolicyDocument']
-    except iam_client.exceptions.NoSuchEntityException:
+        with profiler.phase('get_role'):
+            current_policy = iam_client.get_role(RoleName=role_name)['Role']['AssumeRolePolicyDocument']
+    except iam_client.exceptions.NoSuchEntityException as e:
         console.print(f"[bold red]Role {role_name} not found.[/bold red]")
+        if errors is not None:
+            errors.append(e)
         return False
     except iam_client.exceptions.ClientError as e:
         console.print(f"[bold red]Error getting role {role_name}: {str(e)}[/bold red]")
+        if errors is not None:
+            errors.append(e)
         return False
 
-    if new_trust_policy_statement not in current_policy['Statement']:
-        current_policy['Statement'].append(new_trust_policy_statement)
+    with profiler.phase('merge'):
+        needs_update, policy_document = merge_statement(current_policy, new_trust_policy_statement)
+    if needs_update:
         try:
-            iam_client.update_assume_role_policy(
-                RoleName=role_name,
-                PolicyDocument=json.dumps(current_policy)
-            )
+            with profiler.phase('update_role'):
+                iam_client.update_assume_role_policy(
+                    RoleName=role_name,
+                    PolicyDocument=policy_document
+                )
             return True
-        except iam_client.exceptions.UnmodifiableEntityException:
+        except iam_client.exceptions.UnmodifiableEntityException as e:
             console.print(f"[bold red]Cannot modify role {role_name}.[/bold red]")
+            if errors is not None:
+                errors.append(e)
             return False
         except iam_client.exceptions.ClientError as e:
             console.print(f"[bold red]Error updating role {role_name}: {str(e)}[/bold red]")
+            if errors is not None:
+                errors.append(e)
             return False
     else:
         return True
 
-def process_roles_from_csv(file_path, new_trust_policy_statement):
-    with open(file_path, mode='r') as file:
-        csv_reader = csv.DictReader(file)
-        rows = list(csv_reader)
+def assumed_iam_client(account_id, role_name, errors=None):
+    """Return an IAM client acting as the role, or None when it cannot be assumed"""
+    credentials = assume_role(account_id, role_name, errors)
+    if not credentials:
+        return None
+    with profiler.phase('client'):
+        return client(
+            'iam',
+            aws_access_key_id=credentials['AccessKeyId'],
+            aws_secret_access_key=credentials['SecretAccessKey'],
+            aws_session_token=credentials['SessionToken']
+        )
+
+def process_role(row, new_trust_policy_statement, circuit_breaker, iam_client_for=assumed_iam_client):
+    if not circuit_breaker.allow(row['AccountID']):
+        return Outcome.CIRCUIT_OPEN
+    
+    # The errors behind a failure travel with the row to the dead-letter store
+    errors = row.setdefault('Errors', [])
+    iam_client = iam_client_for(row['AccountID'], row['RoleName'], errors)
+    if iam_client is None:
+        circuit_breaker.record_failure(row['AccountID'], last_error_code(errors))
+        return Outcome.ASSUME_ROLE_FAILED
+    circuit_breaker.record_success(row['AccountID'])
+    
+    if update_trust_policy(iam_client, row['RoleName'], new_trust_policy_statement, errors):
+        return Outcome.UPDATED
+    return Outcome.NOT_UPDATED
+
+def process_roles_from_csv(file_path, new_trust_policy_statement, output_file='trust_policy_update_results.csv', max_workers=16, per_account_limit=4, ous=(), prefilter=None, dead_letters=None, retry_rounds=RETRY_ROUNDS):
+    rows = prefetch(profiler.timed('read_input', filter_rows(iter_roles(file_path), ous)))
+    # Roles in suspended, closed or non-member accounts are settled without scheduling them
+    skipped = []
+    if prefilter:
+        rows = prefilter.split(rows, skipped)
 
     table = Table(title="Trust Policy Update Results")
     table.add_column("Account ID")
@@ -60,45 +116,36 @@ def process_roles_from_csv(file_path, new_trust_policy_statement):
     table.add_column("Trust Policy Updated", style="cyan")
     
     results = []
+    scheduler = AccountScheduler(max_workers=max_workers, per_account_limit=per_account_limit)
+    circuit_breaker = AccountCircuitBreaker()
     
-    with Progress() as progress:
-        task = progress.add_task("[cyan]Processing...", total=len(rows))
+    with Progress() as progress, profiler.sampling():
+        task = progress.add_task("[cyan]Processing...", total=None)
         
-        for row in rows:
-            account_id = row['AccountID']
-            role_name = row['RoleName']
-            
-            credentials = assume_role(account_id, role_name)
-            if not credentials:
-                result = {'AccountID': account_id, 'RoleName': role_name, 'TrustPolicyUpdated': 'Failed to Assume Role'}
-                results.append(result)
-                table.add_row(account_id, role_name, f"[bold red]{result['TrustPolicyUpdated']}[/bold red]")
+        for row, outcome in chain(scheduler.run(rows, lambda row: process_role(row, new_trust_policy_statement, circuit_breaker)), skipped):
+            record = RoleRecord(row['AccountID'], row['RoleName'], outcome)
+            results.append(record)
+            if dead_letters:
+                dead_letters.collect(row, outcome, 'statement', new_trust_policy_statement)
+            style = 'bold green' if outcome == Outcome.UPDATED else 'bold red'
+            with profiler.phase('render'):
+                table.add_row(record.account_id, record.role_name, f"[{style}]{outcome.label}[/{style}]")
                 progress.update(task, advance=1)
-                continue
-            
-            iam_client = boto3.client(
-                'iam',
-                aws_access_key_id=credentials['AccessKeyId'],
-                aws_secret_access_key=credentials['SecretAccessKey'],
-                aws_session_token=credentials['SessionToken']
-            )
-            
-            if update_trust_policy(iam_client, role_name, new_trust_policy_statement):
-                result = {'AccountID': account_id, 'RoleName': role_name, 'TrustPolicyUpdated': '[bold green]True[/bold green]'}
-            else:
-                result = {'AccountID': account_id, 'RoleName': role_name, 'TrustPolicyUpdated': '[bold red]False[/bold red]'}
-            results.append(result)
-            table.add_row(account_id, role_name, result['TrustPolicyUpdated'])
-            progress.update(task, advance=1)
     
-    print(table)
+    with profiler.phase('render'):
+        print(table)
+
+    if dead_letters:
+        with profiler.phase('retry'):
+            retry_failed(
+                dead_letters, results, 'statement', new_trust_policy_statement,
+                lambda row, circuit_breaker: process_role(row, new_trust_policy_statement, circuit_breaker), retry_rounds
+            )
     
-    with open('trust_policy_update_results.csv', mode='w', newline='') as file:
-        writer = csv.DictWriter(file, fieldnames=['AccountID', 'RoleName', 'TrustPolicyUpdated'])
-        writer.writeheader()
-        writer.writerows(results)
+    with profiler.phase('write'):
+        write_rows(output_file, UPDATE_RESULT_FIELDS, to_rows(results), UPDATE_RESULT_SCHEMA)
     
-    console.print("[bold bright_red]Output saved as trust_policy_update_results.csv[/bold bright_red]")
+    console.print(f"[bold bright_red]Output saved as {output_file}[/bold bright_red]")
 
 new_trust_policy_statement = {
     "Effect": "Deny",
@@ -120,11 +167,36 @@ new_trust_policy_statement = {
     }
 }
 
-start_time = time()
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Add the data perimeter Deny statement to the trust policy of the roles in input_roles.csv")
+    parser.add_argument('--output', default='trust_policy_update_results.csv', help="Results file to write, CSV, JSONL or Parquet (default: %(default)s)")
+    add_profile_arguments(parser)
+    add_ou_arguments(parser)
+    add_verify_arguments(parser)
+    add_dead_letter_arguments(parser)
+    args = parser.parse_args()
+    profiler.enable_from_args(args)
+    if args.refresh_org_index:
+        load_index(refresh=True)
+    prefilter = load_prefilter(not args.no_account_prefilter)
+
+    start_time = time()
+
+    dead_letters = DeadLetterStore(args.dead_letters)
+    try:
+        process_roles_from_csv('input_roles.csv', new_trust_policy_statement, args.output, ous=args.ou, prefilter=prefilter, dead_letters=dead_letters, retry_rounds=args.retry_rounds)
+    finally:
+        dead_letters.close()
+
+    end_time = time()
+    elapsed_time = end_time - start_time
 
-process_roles_from_csv('input_roles.csv', new_trust_policy_statement)
+    console.print(f"[bold bright_red]Script completed in {elapsed_time:.2f} seconds[/bold bright_red]")
 
-end_time = time()
-elapsed_time = end_time - start_time
+    if args.verify:
+        with profiler.phase('verify'):
+            verify_results(args.output, StatementExpectation(new_trust_policy_statement), max_wait=args.verify_wait)
 
-console.print(f"[bold bright_red]Script completed in {elapsed_time:.2f} seconds[/bold bright_red]")
+    report = profiler.write_report(args.output)
+    if report:
+        console.print(f"[bold bright_red]Phase report saved as {report}[/bold bright_red]")